@@ -0,0 +1,206 @@
+"""
+aioserver.py
+
+Asyncio server for several Plexon clients/recording arrays at once (isAsync in server.py, NSLOC model):
+array i is served on comPort + i by server process i % numServerProcs, one queue per process
+"""
+
+import asyncio
+import socket
+import struct
+import array
+import numpy as np
+from plxstream import PlxStream
+from ringbuffer import RingSet
+from backpressure import Backpressure
+from latency import RECEIVE, FILTER, BIN, ENQUEUE, now as latencyNow
+import server as srv
+
+
+# state of a client (recording array)
+class ArrayClient:
+    def __init__(self, index, isUdp):
+        self.index = index
+        self.offset = index * srv.arrayChannels # channel offset in the queue items
+        self.port = srv.comPort + index
+        self.stream = PlxStream(None, 4, isUdp) # rows of |data type|ch#|unit#|TS|, filled by the event loop
+        self.syncRem = np.zeros((0, 4)) # sync filter state (syncSpkFilter 2)
+        self.syncJ = 0
+        self.SN = 1 # serial number
+        self.lastEndTS = 0.0 # second
+        self.recvTime = latencyNow() # when the buffered data was received
+        self.spikes = 0 # spikes queued
+        self.connections = 0
+
+
+# handshake with the clients (server process 0): assigns free arrays in order of first ALIVE
+class HandshakeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.clients = {} # client address -> array index (while the array is in use)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        cdata = struct.unpack('H' * (len(data) // 2), data)
+        if len(cdata) == 0:
+            return
+        if cdata[0] == srv.ALIVE:
+            index = self.clients.get(addr)
+            if index is None or not srv.arraysInUse[index]: # new client (ALIVE repeated by a client keeps its array)
+                free = [i for i in range(srv.numArrays) if not srv.arraysInUse[i]]
+                if not free:
+                    print("[aioserver] ERROR: no array left for client", addr)
+                    return
+                index = free[0]
+                srv.arraysInUse[index] = 1
+                self.clients = dict((a, i) for a, i in self.clients.items() if i != index)
+                self.clients[addr] = index
+            a = array.array('H')
+            a.extend([srv.INITDATA, srv.comPort + index, srv.isUdp, srv.isDp, srv.isLwc, srv.binWnd, srv.timeOut, srv.unsortedSpkFilter, srv.syncSpkFilter, srv.verbose])
+            self.transport.sendto(a.tobytes(), addr)
+        elif cdata[0] == srv.ACK and addr in self.clients:
+            print("Connection success (array %d)!!!" % self.clients[addr])
+
+
+class AioServer:
+    def __init__(self, proc=0, dir="data", host=""):
+        self.proc = proc
+        self.host = host # all available interfaces
+        self.queue = srv.queue.rings[proc] if isinstance(srv.queue, RingSet) else srv.queue
+        self.backpressure = Backpressure(self.queue, lambda: srv.currNeuronTime.value, srv.queuePolicy, srv.LR, srv.queueItemSpikes, srv.coalesceQueueItems)
+        self.latency = srv.nrn_py_latencyRecorder(dir, "Aio%d" % proc)
+        self.arrays = [ArrayClient(i, srv.isUdp) for i in range(proc, srv.numArrays, srv.numServerProcs)]
+
+    def bind(self, kind, port):
+        sock = socket.socket(socket.AF_INET, kind)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self.host, port))
+        sock.setblocking(False)
+        return sock
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        if self.proc == 0:
+            await loop.create_datagram_endpoint(HandshakeProtocol, sock=self.bind(socket.SOCK_DGRAM, srv.initPort))
+        tasks = [asyncio.ensure_future(self.serveUdp(client) if srv.isUdp else self.serveTcp(client)) for client in self.arrays]
+        await asyncio.gather(loop.create_future(), *tasks) # serve until terminated
+
+    # data of an array over UDP: each datagram is decoded when received
+    async def serveUdp(self, client):
+        loop = asyncio.get_running_loop()
+        sock = self.bind(socket.SOCK_DGRAM, client.port)
+        while 1:
+            data = await loop.sock_recv(sock, 65536)
+            client.recvTime = latencyNow()
+            client.stream.feed(data)
+            if await self.process(client): # 'exit'
+                await self.clientExited(client)
+
+    # accept the connections of an array (one at a time) and decode its data
+    async def serveTcp(self, client):
+        loop = asyncio.get_running_loop()
+        listenSock = self.bind(socket.SOCK_STREAM, client.port)
+        listenSock.listen(1)
+        while 1:
+            conn, addr = await loop.sock_accept(listenSock)
+            conn.setblocking(False)
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client.connections += 1
+            client.stream = PlxStream(None, 4, 0)
+            try:
+                while 1:
+                    n = await loop.sock_recv_into(conn, client.stream.reserve())
+                    client.recvTime = latencyNow()
+                    if n == 0: # connection closed
+                        break
+                    client.stream.commit(n)
+                    if await self.process(client): # 'exit'
+                        break
+            except OSError as e:
+                print("[aioserver] array %d connection error: %s" % (client.index, e))
+            finally:
+                conn.close()
+            await self.clientExited(client)
+
+    # decode, filter and queue all complete messages in the buffer of an array; returns True on 'exit'
+    async def process(self, client):
+        while 1:
+            msgType, msg = client.stream.nextMessage()
+            if msgType is None: # no complete message in buffer
+                return False
+            stageTime = self.latency.record(RECEIVE, client.recvTime)
+            if msgType == 'exit':
+                return True
+            if msgType == 'nodata':
+                await self.feedTimeout(client)
+                self.latency.record(ENQUEUE, stageTime)
+                continue
+            rows = self.filter(client, msg)
+            stageTime = self.latency.record(FILTER, stageTime)
+            await self.feedSpikes(client, rows, stageTime)
+
+    def filter(self, client, rows):
+        if srv.isLwc == 1:
+            if srv.syncSpkFilter > 0: # with the filter state of this array
+                syncFilter = srv.nrn_py_filterSyncSpk
+                syncFilter.FRem, syncFilter.jValue = client.syncRem, client.syncJ
+                rows = syncFilter(rows)
+                client.syncRem, client.syncJ = syncFilter.FRem, syncFilter.jValue
+            if srv.unsortedSpkFilter == 1:
+                rows = srv.nrn_py_filterUnsortedSpk(rows)
+        return rows
+
+    # put an item through the backpressure policy, waiting (without blocking the other arrays) while it would block
+    async def enqueue(self, item, spikeTimes):
+        itemTime = srv.queueItemTime(item)
+        while self.backpressure.wouldBlock(itemTime):
+            await asyncio.sleep(self.backpressure.wait)
+        self.backpressure.put(item, itemTime, spikeTimes)
+
+    # queue the valid spikes of rows in chunks of SPKNUM spikes
+    async def feedSpikes(self, client, rows, stageTime):
+        channelID = rows[:, 1]
+        unitID = rows[:, 2]
+        valid = (rows[:, 0] == 1) & (1 <= channelID) & (channelID <= srv.arrayChannels) & (srv.UNIT_START <= unitID) & (unitID <= srv.UNIT_END)
+        spikes = rows[valid, 1:4] # |CH_ID|Unit_ID|Time_stamp| (copy)
+        spikes[:, 0] += client.offset
+        for item in srv.nrn_py_spikeItems(spikes, client.SN):
+            spkNum = item[srv.SPKSZ - 1]
+            client.SN += 1
+            client.lastEndTS = item[(spkNum - 1) * 3 + 2]
+            stageTime = self.latency.record(BIN, stageTime)
+            await self.enqueue(item, [ts * 1000 for ts in item[2:3 * spkNum:3]])
+            stageTime = self.latency.record(ENQUEUE, stageTime)
+        client.spikes += len(spikes)
+
+    # timeout item after a NODATA message (same as nrn_py_interfaceNsloc)
+    async def feedTimeout(self, client):
+        item = [0] * (srv.SPKSZ + 1)
+        item[0] = client.offset + 1 # a channel of the array (srv.queueItemArray), no spike
+        item[2] = client.lastEndTS # last end timestamp of previous data
+        item[srv.SPKSZ - 2] = client.lastEndTS + srv.TIMEOUT
+        item[srv.SPKSZ - 1] = 0 # number of spikes
+        item[srv.SPKSZ] = client.SN
+        client.lastEndTS += srv.TIMEOUT
+        client.SN += 1
+        await self.enqueue(item, [])
+
+    async def clientExited(self, client, flushTimeout=1.0):
+        print("Client of array %d has exited! %d spikes queued (%d connections)" % (client.index, client.spikes, client.connections))
+        waited = 0.0
+        while self.backpressure.pending is not None and self.backpressure.wouldBlock(self.backpressure.pendingTime) and waited < flushTimeout:
+            await asyncio.sleep(self.backpressure.wait)
+            waited += self.backpressure.wait
+        self.backpressure.flush(0) # queue the item held by the coalesce policy (dropped if there's still no slot)
+        srv.arraysInUse[client.index] = 0 # a new handshake can assign the array again
+        print(self.backpressure.report())
+        self.latency.export()
+        print(self.latency.report())
+
+
+# server process proc (Manager.start with isAsync): serves arrays proc, proc + numServerProcs, ...
+def serve(dir, proc=0):
+    print("[aioserver %d running: arrays %s]" % (proc, list(range(proc, srv.numArrays, srv.numServerProcs))))
+    asyncio.run(AioServer(proc, dir).run())
@@ -13,6 +13,7 @@ from time import time
 import csv
 import pickle
 import shared as s
+import armKinematics
 
 ###############################################################################
 ### Simulation-related graph plotting functions
@@ -329,6 +330,28 @@ def plot3darch():
     ylabel('cortical depth (mm)')
 
 
+## plot hand trajectory and hand-target error from saved arm data (.mat with angAll and targetPos)
+def plotArmTraj(filename):
+    data = loadmat(filename)
+    angAll = data['angAll'] # (T,2) shoulder, elbow angles
+    targetPos = data['targetPos'].flatten()
+    handPos = armKinematics.angles2pos(angAll, s.armLen)
+    error = armKinematics.handError(handPos, targetPos)
+    figure()
+    subplot(1,2,1)
+    plot(handPos[:,0], handPos[:,1], 'r')
+    plot(targetPos[0], targetPos[1], 'go')
+    title('X-Y Hand trajectory')
+    xlabel('x')
+    ylabel('y')
+    subplot(1,2,2)
+    plot(arange(len(error))*s.loopstep, error)
+    title('Hand-target error (mean = %.3f m)' % (mean(error)))
+    xlabel('time (ms)')
+    ylabel('error (m)')
+    return handPos, error
+
+
 ###############################################################################
 ### Evolutionary-algorithm analysis/plotting functions
 ###############################################################################
@@ -15,8 +15,10 @@ Version: 2015jan28 by salvadordura@gmail.com
 
 from neuron import h
 import arminterface
+import armKinematics
+from armAnim import ArmAnimation
 from numpy import array, zeros, pi, ones, cos, sin, mean
-from pylab import concatenate, figure, show, ion, ioff, pause,xlabel, ylabel, plot, Circle, sqrt, arctan, arctan2, close
+from pylab import concatenate, figure, show, xlabel, ylabel, plot, Circle, close
 from copy import copy
 from random import uniform, seed, sample, randint
 
@@ -39,23 +41,11 @@ class Arm:
 
     # convert cartesian position to joint angles
     def pos2angles(self, armPos, armLen):
-        x = armPos[0]
-        y = armPos[1]
-        l1 = armLen[0]
-        l2 = armLen[1]
-        elang = abs(2*arctan(sqrt(((l1 + l2)**2 - (x**2 + y**2))/((x**2 + y**2) - (l1 - l2)**2))));
-        phi = arctan2(y,x);
-        psi = arctan2(l2 * sin(elang), l1 + (l2 * cos(elang)));
-        shang = phi - psi;
-        return [shang,elang]
+        return armKinematics.pos2angles(armPos, armLen).tolist()
 
     # convert joint angles to cartesian position
     def angles2pos(self, armAng, armLen):
-        elbowPosx = armLen[0] * cos(armAng[0]) # end of elbow
-        elbowPosy = armLen[0] * sin(armAng[0])
-        wristPosx = elbowPosx + armLen[1] * cos(+armAng[0]+armAng[1]) # wrist=arm position
-        wristPosy = elbowPosy + armLen[1] * sin(+armAng[0]+armAng[1])
-        return [wristPosx,wristPosy]
+        return armKinematics.angles2pos(armAng, armLen).tolist()
 
     #%% setTargetByID
     def setTargetByID(self, id, startAng, targetDist, armLen):
@@ -73,34 +63,27 @@ class Arm:
     #%% setupDummyArm
     def setupDummyArm(self):
         if self.anim:
-            ion()
-            self.fig = figure() # create figure
-            l = 1.1*sum(self.armLen)
-            self.ax = self.fig.add_subplot(111, autoscale_on=False, xlim=(-l/2, +l), ylim=(-l/2, +l)) # create subplot
-            self.ax.grid()
-            self.line, = self.ax.plot([], [], 'o-', lw=2)
-            self.circle = Circle((0,0),0.04, color='g', fill=False)
-            self.ax.add_artist(self.circle)
+            self.animation = ArmAnimation(self.armLen, self.animFps, self.animVideo) # renders in separate process
+            self.animation.start()
 
     #%% runDummyArm: update position and velocity based on motor commands; and plot
-    def runDummyArm(self, dataReceived):
-        friction = 0.5 # friction coefficient
-        shang = (self.ang[SH] + self.angVel[SH] * self.interval/1000) #% update shoulder angle
-        elang = (self.ang[EL] + self.angVel[EL] * self.interval/1000) #% update elbow angle
+    def runDummyArm(self, dataReceived, t):
+        friction = self.friction # friction coefficient
+        if self.pendingData: # pipelined: arm state runs ahead of the (delayed) state seen by the network
+            ang, angVel = self.pendingData[-1][0:2], self.pendingData[-1][2:4]
+        else:
+            ang, angVel = self.ang, self.angVel
+        shang = (ang[SH] + angVel[SH] * self.interval/1000) #% update shoulder angle
+        elang = (ang[EL] + angVel[EL] * self.interval/1000) #% update elbow angle
         if shang<self.minPval: shang = self.minPval # limits
         if elang<self.minPval: elang = self.minPval # limits
         if shang>self.maxPval: shang = self.maxPval # limits
         if elang>self.maxPval: elang = self.maxPval # limits
-        elpos = [self.armLen[SH] * cos(shang), self.armLen[SH] * sin(shang)] # calculate shoulder x-y pos
-        handpos = [elpos[X] + self.armLen[EL] * cos(shang+elang), elpos[Y] + self.armLen[EL] * sin(shang+elang)]
-        shvel = self.angVel[SH] + (dataReceived[1]-dataReceived[0]) - (friction * self.angVel[SH])# update velocities based on incoming commands (accelerations) and friction
-        elvel = self.angVel[EL] + (dataReceived[3]-dataReceived[2]) - (friction * self.angVel[EL])
-        if self.anim:
-            self.circle.center = self.targetPos
-            self.line.set_data([0, elpos[0], handpos[0]], [0, elpos[1], handpos[1]]) # update line in figure
-            self.ax.set_title('Time = %.1f ms, shoulder: pos=%.2f rad, vel=%.2f, acc=%.2f ; elbow: pos = %.2f rad, vel = %.2f, acc=%.2f' % (float(self.duration), shang, shvel, dataReceived[0] - (friction * shvel), elang, elvel, dataReceived[1] - (friction * elvel) ), fontsize=10)
-            show(block=False)
-            pause(0.0001) # pause so that the figure refreshes at every time step
+        handpos = self.angles2pos([shang, elang], self.armLen) # calculate hand x-y pos
+        shvel = angVel[SH] + (dataReceived[1]-dataReceived[0]) - (friction * angVel[SH])# update velocities based on incoming commands (accelerations) and friction
+        elvel = angVel[EL] + (dataReceived[3]-dataReceived[2]) - (friction * angVel[EL])
+        if self.anim: # publish state to renderer (non-blocking; frames dropped if renderer lags)
+            self.animation.update(t, shang, elang, shvel, elvel, dataReceived[0] - (friction * shvel), dataReceived[1] - (friction * elvel), self.targetPos)
         return [shang, elang, shvel, elvel, handpos[0], handpos[1]]
 
     #%% Reset arm variables so doesn't move between trials
@@ -110,6 +93,7 @@ class Arm:
         if self.type == 'dummyArm':
             self.ang = list(self.startAng) # keeps track of shoulder and elbow angles
             self.angVel = [0,0] # keeps track of joint angular velocities
+            self.pendingData = [] # discard arm states not yet fed back (pipelined mode)
             self.motorCmd = [0,0,0,0] # motor commands to muscles
             self.error = 0 # error signal (eg. difference between )
             self.critic = 0 # critic signal (1=reward; -1=punishment)
@@ -155,8 +139,8 @@ class Arm:
         fig = figure()
         l = 1.1*sum(self.armLen)
         ax = fig.add_subplot(111, autoscale_on=False, xlim=(-l/2, +l), ylim=(-l/2, +l)) # create subplot
-        posX, posY = list(zip(*[self.angles2pos([x[SH],x[EL]], self.armLen) for x in self.angAll]))
-        ax.plot(posX, posY, 'r')
+        handPos = armKinematics.angles2pos(self.angAll, self.armLen) # whole trajectory at once
+        ax.plot(handPos[:,X], handPos[:,Y], 'r')
         targ = Circle((self.targetPos),0.04, color='g', fill=False) # target
         ax.add_artist(targ)
         ax.grid()
@@ -174,8 +158,7 @@ class Arm:
         el = [x[EL] for x in self.angAll]
         ax.plot(sh, 'r', label='shoulder')
         ax.plot(el, 'b', label='elbow')
-        shTarg = self.pos2angles(self.targetPos, self.armLen)[0]
-        elTarg = self.pos2angles(self.targetPos, self.armLen)[1]
+        shTarg, elTarg = self.pos2angles(self.targetPos, self.armLen)
         ax.plot(list(range(0,len(sh))), [shTarg] * len(sh), 'r:', label='sh target')
         ax.plot(list(range(0,len(el))), [elTarg] * len(el), 'b:', label='el target')
         ax.set_title('Joint angles')
@@ -220,6 +203,8 @@ class Arm:
         self.RLinterval = s.RLinterval # interval between RL updates in msec
         self.minRLerror = s.minRLerror # minimum error change for RL (m)
         self.armLen = s.armLen # elbow - shoulder from MSM;radioulnar - elbow from MSM;
+        self.animFps = s.animArmFps # arm animation frame rate
+        self.animVideo = s.animArmVideo # if set, save arm animation to video file (headless)
         self.handPos = [0,0] # keeps track of hand (end-effector) x,y position
         self.handPosAll = [] # list with all handPos
         self.handVel = [0,0] # keeps track of hand (end-effector) x,y velocity
@@ -231,6 +216,8 @@ class Arm:
         self.angVelAll = [] # list with all angVel
         self.motorCmd = [0,0,0,0] # motor commands to muscles
         self.motorCmdAll = [] # list with all motorCmd
+        self.motorCmdRawAll = [] # list with raw motor command (spike count of each muscle population) of each step, for arm replay (armReplay.py)
+        self.friction = s.armFriction # dummyArm joint friction coefficient
         self.targetDist = s.targetDist # target distance from center (15 cm)
         #self.targetid = 0 # target id (eg. 0=right, 1=left, 2=top, 3=bottom)
         self.targetidAll = [] # list with all targetid
@@ -242,6 +229,9 @@ class Arm:
         self.randDur = 0 # initialize explor movs duration
         self.initArmMovement = int(s.initArmMovement) # start arm movement after x msec
         self.trial = 0 # trial number
+        self.feedbackDelay = int(s.armFeedbackDelay) # arm feedback delay in loopsteps (0 = serial; n>0 = pipelined)
+        self.pendingTimes = [] # musculoskeletal: times of motor commands sent whose reply (joint angles) has not been read yet
+        self.pendingData = [] # dummyArm: arm states computed but not yet fed back to the network
 
         # motor command encoding
         self.vec = h.Vector()
@@ -272,11 +262,8 @@ class Arm:
             if self.type == 'dummyArm':
                 self.setupDummyArm() # setup dummyArm (eg. graph animation)
             elif self.type == 'musculoskeletal':
-                damping = 1 # damping of muscles (.osim parameter)
-                shExtGain = 2  # gain factor to multiply force of shoulder extensor muscles (.osim parameter)
-                shFlexGain = 1 # gain factor to multiply force of shoulder flexor muscles (.osim parameter)
-                elExtGain = 1 # gain factor to multiply force of elbow extensor muscles (.osim parameter)
-                elFlexGain = 0.8 # gain factor to multiply force of elbox flexor muscles (.osim parameter)
+                damping = s.armDamping # damping of muscles (.osim parameter)
+                [shExtGain, shFlexGain, elExtGain, elFlexGain] = s.armMuscleGains # gain factors to multiply force of sh ext, sh flex, el ext and el flex muscles (.osim parameter)
                 # call function to initialize virtual arm params and run virtual arm C++ executable
                 arminterface.setup(self.duration/1000.0, self.interval, self.startAng[SH], self.startAng[EL], self.targetPos[X], self.targetPos[Y], damping, shExtGain, shFlexGain, elExtGain, elFlexGain)
 
@@ -343,12 +330,14 @@ class Arm:
             if s.trialReset and t-s.timeoflastreset > s.testTime:
                 self.resetArm(s, t)
                 s.targetid = s.trialTargets[self.trial] # set target based on trial number
+                self.targetid = s.targetid
                 self.targetPos = self.setTargetByID(s.targetid, self.startAng, self.targetDist, self.armLen)
                 if s.PMdinput == 'targetSplit': self.setPMdInput(s)
 
 
             ## Only move after initial period - avoids initial transitory spiking period (NSLOC sync spikes), and allows for variables with history to clear
             # can be justified as preparatory period (eg. watiing for go cue)
+            motorCmdRaw = [0] * s.nMuscles # spike count of each muscle population (0 if arm not moving)
             if t > self.initArmMovement:
                 ## Gather spikes #### from all vectors to then calculate motor command
                 for i in range(s.nMuscles):
@@ -356,6 +345,7 @@ class Arm:
                     self.motorCmd[i] = sum([len(x[(x < t) * (x > t-self.cmdtimewin)]) for x in cmdVecs])
                     s.pc.allreduce(self.vec.from_python([self.motorCmd[i]]), 1) # sum
                     self.motorCmd[i] = self.vec.to_python()[0]
+                motorCmdRaw = list(self.motorCmd)
             # else:
             #     for i in range(s.nMuscles): # stimulate all muscles equivalently so arm doesnt move
             #         self.motorCmd[i] = 0.2 * self.cmdmaxrate
@@ -373,6 +363,7 @@ class Arm:
                         elif self.motorCmd[EL_EXT] < self.motorCmd[EL_FLEX]: # el ext > el flex
                             self.motorCmd[EL_EXT] = self.motorCmd[EL_EXT]**2 / self.motorCmd[EL_FLEX] / s.antagInh
 
+            if s.rank == 0: self.motorCmdRawAll.append(motorCmdRaw)
 
         ############################
         # ALL arms: Send motor command to virtual arm; receive new position; update proprioceptive population (ASC)
@@ -381,15 +372,26 @@ class Arm:
         #print "t=%f , self.initArmMovement=%f"%(t, self.initArmMovement)
         if s.rank == 0:
             if self.type == 'musculoskeletal': # MUSCULOSKELETAL
+                # serial: send command and wait for the arm to integrate it;
+                # pipelined: send command and read the reply to the command sent feedbackDelay loopsteps ago (arm integrated it while the network ran)
                 try:
-                    dataReceived = arminterface.sendAndReceiveDataPackets(t, self.interval, self.motorCmd[0], self.motorCmd[1], self.motorCmd[2], self.motorCmd[3])
+                    arminterface.sendDataPacket(t, self.interval, self.motorCmd[0], self.motorCmd[1], self.motorCmd[2], self.motorCmd[3])
+                    self.pendingTimes.append(t)
+                    if len(self.pendingTimes) > self.feedbackDelay:
+                        dataReceived = arminterface.receiveDataPacket(self.pendingTimes.pop(0), self.interval) # blocks until reply or deadline
+                    else: # pipeline filling: keep current angles
+                        dataReceived = [self.ang[SH], self.ang[EL]]
                 except:
                     dataReceived = [self.ang[SH], self.ang[EL]]
-                if not dataReceived or dataReceived==[-3,3]:  # if error receiving packet
+                if not dataReceived or dataReceived==[-3,-3]:  # if error receiving packet
                     dataReceived = [self.ang[SH], self.ang[EL]]  # use previous packet
-                    print('Missed packet at t=%.2f',t)
+                    print('Missed packet at t=%.2f' % t)
             elif self.type == 'dummyArm': # DUMMYARM
-                dataReceived = self.runDummyArm(self.motorCmd) # run dummyArm
+                self.pendingData.append(self.runDummyArm(self.motorCmd, t)) # run dummyArm
+                if len(self.pendingData) > self.feedbackDelay:
+                    dataReceived = self.pendingData.pop(0) # state feedbackDelay loopsteps old (current state if serial)
+                else: # pipeline filling: keep current state
+                    dataReceived = [self.ang[SH], self.ang[EL], self.angVel[SH], self.angVel[EL], self.handPos[X], self.handPos[Y]]
             elif self.type == 'randomOutput': # RANDOMOUTPUT
                 dataReceived = [0,0]
                 dataReceived[0] = uniform(self.minPval, self.maxPval) # generate 2 random values
@@ -430,7 +432,7 @@ class Arm:
         #### Calculate error between hand and target for interval between RL updates
         if s.rank == 0 and self.initArmMovement: # do not update between trials
             #print 't=%.2f, xpos=%.2f'%(t,self.targetPos[X])
-            self.error = sqrt((self.handPos[X] - self.targetPos[X])**2 + (self.handPos[Y] - self.targetPos[Y])**2)
+            self.error = float(armKinematics.handError(self.handPos, self.targetPos))
 
         return self.critic
 
@@ -463,8 +465,7 @@ class Arm:
                 print('\nClosing dummy virtual arm ...')
 
                 if self.anim:
-                    ioff() # turn interactive mode off
-                    close(self.fig) # close arm animation graph
+                    self.animation.stop() # close arm animation (finalizes video if exporting)
                 if self.graphs: # plot graphs
                     self.plotTraj(s.filename)
                     #self.plotAngs()
@@ -0,0 +1,142 @@
+"""
+armAnim.py
+
+Arm animation rendered in a separate process (interactive window or headless video export)
+
+Usage:
+    anim = ArmAnimation(armLen, fps=25, videoFile='')
+    anim.start()
+    anim.update(t, shang, elang, shvel, elvel, shacc, elacc, targetPos)  # every arm step
+    anim.stop()
+"""
+
+import time
+from multiprocessing import Process, Event, RawArray, RawValue
+from math import cos, sin
+
+
+# layout of the shared arm state slot
+[T, SHANG, ELANG, SHVEL, ELVEL, SHACC, ELACC, TARGX, TARGY] = list(range(9))
+stateSize = 9
+
+
+class ArmAnimation:
+    def __init__(self, armLen, fps=25, videoFile=''):
+        self.armLen = list(armLen)
+        self.fps = fps # frame rate (wall time for interactive mode; sim time for video mode)
+        self.videoFile = videoFile # if set, render headless and save video to this file
+        self.seq = RawValue('L', 0) # seqlock counter: odd while the simulation is writing
+        self.state = RawArray('d', stateSize) # latest arm state
+        self.published = RawValue('L', 0) # number of states published by the simulation
+        self.rendered = RawValue('L', 0) # number of frames rendered
+        self.stopEvent = Event()
+        self.proc = None
+
+    # start renderer process
+    def start(self):
+        self.proc = Process(target=render, args=(self.armLen, self.fps, self.videoFile, self.seq, self.state, self.published, self.rendered, self.stopEvent))
+        self.proc.daemon = True # don't keep sim alive if renderer hangs
+        self.proc.start()
+
+    # publish latest arm state (called from simulation loop; never blocks)
+    def update(self, t, shang, elang, shvel, elvel, shacc, elacc, targetPos):
+        self.seq.value += 1 # odd = write in progress
+        self.state[:] = [t, shang, elang, shvel, elvel, shacc, elacc, targetPos[0], targetPos[1]]
+        self.seq.value += 1 # even = consistent
+        self.published.value += 1
+
+    # stop renderer, wait for video to be finalized
+    def stop(self, timeout=10.0):
+        if self.proc is None:
+            return
+        self.stopEvent.set()
+        self.proc.join(timeout)
+        if self.proc.is_alive():
+            self.proc.terminate()
+        print(('  Arm animation: %d states published, %d frames rendered (%d dropped)' % (self.published.value, self.rendered.value, self.published.value - self.rendered.value)))
+        self.proc = None
+
+
+# read a consistent copy of the shared state; returns (seq, state) or (None, None) if being written
+def readState(seq, state):
+    seq1 = seq.value
+    if seq1 % 2:
+        return None, None
+    data = state[:]
+    if seq.value != seq1: # overwritten while copying
+        return None, None
+    return seq1, data
+
+
+# renderer process main loop
+def render(armLen, fps, videoFile, seq, state, published, rendered, stopEvent):
+    import matplotlib
+    if videoFile:
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.animation import FFMpegWriter
+        fig = Figure()
+        FigureCanvasAgg(fig)
+    else:
+        # forked after the simulation imported pylab (arm.py): forget its figures without closing them (GUI state of the
+        # simulation process) and select the backend again before any figure, so the renderer makes its own GUI state
+        import matplotlib.pyplot as plt
+        from matplotlib._pylab_helpers import Gcf
+        Gcf.figs.clear()
+        plt.switch_backend(matplotlib.rcParams['backend'])
+        plt.ion()
+        fig = plt.figure()
+    from matplotlib.patches import Circle
+
+    l = 1.1*sum(armLen)
+    ax = fig.add_subplot(111, autoscale_on=False, xlim=(-l/2, +l), ylim=(-l/2, +l))
+    ax.grid()
+    line, = ax.plot([], [], 'o-', lw=2)
+    circle = Circle((0,0), 0.04, color='g', fill=False)
+    ax.add_artist(circle)
+
+    def draw(data):
+        elpos = [armLen[0] * cos(data[SHANG]), armLen[0] * sin(data[SHANG])]
+        handpos = [elpos[0] + armLen[1] * cos(data[SHANG]+data[ELANG]), elpos[1] + armLen[1] * sin(data[SHANG]+data[ELANG])]
+        circle.center = (data[TARGX], data[TARGY])
+        line.set_data([0, elpos[0], handpos[0]], [0, elpos[1], handpos[1]])
+        ax.set_title('Time = %.1f ms, shoulder: pos=%.2f rad, vel=%.2f, acc=%.2f ; elbow: pos = %.2f rad, vel = %.2f, acc=%.2f' % (data[T], data[SHANG], data[SHVEL], data[SHACC], data[ELANG], data[ELVEL], data[ELACC]), fontsize=10)
+
+    period = 1.0/fps
+    lastSeq = 0
+    if videoFile: # headless: frames at fixed sim-time intervals
+        writer = FFMpegWriter(fps=fps)
+        writer.setup(fig, videoFile)
+        nextFrameTime = 0.0 # ms of simulated time
+        while True:
+            stopping = stopEvent.is_set()
+            s, data = readState(seq, state)
+            if s is not None and s != lastSeq:
+                lastSeq = s
+                if data[T] >= nextFrameTime:
+                    draw(data)
+                    writer.grab_frame()
+                    rendered.value += 1
+                    while nextFrameTime <= data[T]: nextFrameTime += period*1000 # skip frames we fell behind on
+            if stopping:
+                break
+            time.sleep(0.001)
+        writer.finish()
+        print(('  Arm animation saved to %s' % videoFile))
+    else: # interactive: fixed wall-time frame rate
+        nextFrame = time.time()
+        while not stopEvent.is_set():
+            s, data = readState(seq, state)
+            if s is not None and s != lastSeq:
+                lastSeq = s
+                draw(data)
+                fig.canvas.draw_idle()
+                rendered.value += 1
+            fig.canvas.flush_events()
+            nextFrame += period
+            wait = nextFrame - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                nextFrame = time.time() # behind: drop frames instead of catching up
+        plt.close(fig)
@@ -0,0 +1,53 @@
+"""
+armBenchmark.py
+
+Measures per-packet round-trip latency of the pipe interface with the musculoskeletal arm
+(arminterface.sendAndReceiveDataPackets), for the 'text' and 'binary' protocols, split into send
+(encoding and write) and receive (blocked on the arm's reply, reads and decoding), with the
+number of pipe reads per packet. Runs of each protocol alternate (repeats), since the round trip
+is dominated by the arm process and varies from run to run more than between protocols.
+
+By default runs against the local stand-in arm (msarmStub.py, optionally with artificial
+latency/jitter per packet); 'msarm' runs against the real msarm/Run executable.
+
+Usage: python armBenchmark.py [text|binary|both] [stub|msarm] [numPackets] [latency ms] [jitter ms] [repeats]
+"""
+
+import sys
+import time
+import numpy
+
+
+# run numPackets through arminterface and report latency percentiles (us)
+def benchmark(protocol, arm, numPackets, latency=0.0, jitter=0.0):
+    import arminterface
+    msecInterval = 10.0
+    arminterface.msmProtocol = protocol
+    arminterface.msmStandIn = (arm == 'stub')
+    arminterface.msmStandInLatency = latency
+    arminterface.msmStandInJitter = jitter
+    arminterface.setup(numPackets*msecInterval/1000.0 + 0.1, msecInterval, 0.62, 1.53, 0.0, 0.3, 1, 2, 1, 1, 0.8)
+    latency = numpy.zeros(numPackets)
+    for i in range(numPackets):
+        t0 = time.perf_counter()
+        arminterface.sendAndReceiveDataPackets((i+1)*msecInterval, msecInterval, 0.1, 0.2, 0.3, 0.4)
+        latency[i] = time.perf_counter() - t0
+    arminterface.closeSavePlot(numPackets*msecInterval/1000.0, msecInterval)
+    latency = latency[1:]*1e6 # exclude first packet (includes arm startup)
+    wait = numpy.array(arminterface.msmStats['wait'][1:])*1e6
+    print('  %s protocol (%s arm, %d packets): mean=%.1f us, p50=%.1f us, p99=%.1f us, max=%.1f us; send %.1f us, receive %.1f us; %.2f pipe reads/packet' % \
+        (protocol, arm, numPackets, latency.mean(), numpy.percentile(latency, 50), numpy.percentile(latency, 99), latency.max(),
+        latency.mean() - wait.mean(), wait.mean(), arminterface.msmStats['reads'] / float(numPackets)))
+    return latency
+
+
+if __name__ == '__main__':
+    protocol = sys.argv[1] if len(sys.argv) > 1 else 'both'
+    arm = sys.argv[2] if len(sys.argv) > 2 else 'stub'
+    numPackets = int(sys.argv[3]) if len(sys.argv) > 3 else 5000
+    latency = float(sys.argv[4]) if len(sys.argv) > 4 else 0.0
+    jitter = float(sys.argv[5]) if len(sys.argv) > 5 else 0.0
+    repeats = int(sys.argv[6]) if len(sys.argv) > 6 else 3
+    for i in range(repeats):
+        for p in (['text', 'binary'] if protocol == 'both' else [protocol]):
+            benchmark(p, arm, numPackets, latency, jitter)
@@ -17,6 +17,8 @@ from mpl_toolkits.mplot3d import Axes3D
 from pylab import figure, show
 from numpy import *
 import csv
+from armKinematics import forwardKinematics, angles2pos
+import armPnt
 #import os
 
 
@@ -33,7 +35,8 @@ numMuscles = 4 # number of muscles = shFlex (PECT), shExt (DELT), elFlex (BIC),
 muscleNames =  ["Shoulder ext", "Shoulder flex", "Elbow ext", "Elbow flex"]
 numMusBranches = 18 # number of muscle branches
 numJoints = 2 # number of joints (DOFs)
-armLen = [0.4634 - 0.173, 0.7169 - 0.4634] # elbow - shoulder from MSM;radioulnar - elbow from MSM;  useJointPos = 0 # use joint positions vs joint angles for 2d arm animation
+armLen = [0.4634 - 0.173, 0.7169 - 0.4634] # elbow - shoulder from MSM;radioulnar - elbow from MSM;
+useJointPos = 0 # use joint positions vs joint angles for 2d arm animation
 showBranches = 0 # include muscle branches in graphs
 verbose = 0 # whether to show output on screen
 
@@ -43,43 +46,22 @@ verbose = 0 # whether to show output on screen
 ###############################
 
 
-# function to read the result .pnt file containing muscle excitation and force
-def readPntFiles(msmFolder, pntFile, secLength, msecInterval):
+# function to read the result .pnt files containing joint positions and muscle excitation, activation and force
+# (last n = secLength/msecInterval samples, or samples within timeRange=[t1, t2] in s; muscles = branch indices, default all)
+def readPntFiles(msmFolder, pntFile, secLength, msecInterval, timeRange=None, muscles=None, cache=False):
 
     n = int(secLength*1000/msecInterval) # calculate number of samples
 
     ###################################
     # read joint position
 
-    # open pnt file and read data
     fileName = msmFolder+"SUNY_arm_2DOFs_horizon_static_coordinate_status.pnt"
     try:
-        #f = open(fileName, "r" )
-        jointData = []
-        with open(fileName, "r") as f:
-            #next(f)
-            for line in f:
-                print(line)
-                jointData.append([float(i) for i in line.split()])
-        jointData = array(jointData).transpose()
-        jointData = jointData[:, len(jointData[0])-n:] # make number of rows equal to n (packets received)
-
-        # create arrays to store read data (joints include shoulder, elbow and wrist * 3 coords (xyz))
-        jointPosSeq = zeros(((numJoints+1)*3, n))
-
-        # assign activation and force to output arrays
         # file has format: time,ground_thorax_xyz,sternoclavicular_xyz,acromioclavicular_xyz,shoulder_xyz,elbow_xyz,radioulnar_xyz,radius_hand_xyz
-
-        #jointPosSeq[0:6,:] = jointData[10:16,:]
-        #jointPosSeq[6:9,:] = jointData[19:22,:]
-
-        jointPosSeq[0,:] = jointData[10,:]
-        jointPosSeq[1,:] = jointData[12,:]
-        jointPosSeq[2,:] = jointData[13,:]
-        jointPosSeq[3,:] = jointData[15,:]
-        jointPosSeq[4,:] = jointData[19,:]
-        jointPosSeq[5,:] = jointData[21,:]
-    except:
+        jointData = armPnt.readPnt(fileName, timeRange, [10, 12, 13, 15, 19, 21], cache)
+        jointPosSeq = zeros(((numJoints+1)*3, min(n, len(jointData)))) # joints include shoulder, elbow and wrist * 3 coords (xyz)
+        jointPosSeq[0:6,:] = jointData[len(jointData)-jointPosSeq.shape[1]:].T # make number of rows equal to n (packets received)
+    except (IOError, IndexError):
         jointPosSeq=[]
         if verbose:
             print("coordinate pnt file not available")
@@ -87,28 +69,8 @@ def readPntFiles(msmFolder, pntFile, secLength, msecInterval):
     ########################################################
     # Read muscle activation and force
 
-    # open pnt file and read data
-    #fileName = msmFolder+"SUNY_arm_2DOFs_horizon_static_muscle_status.pnt"
-    fileName = pntFile
-    #f = open(fileName, "r" )
-    muscleData = []
-    with open(fileName, "r") as f:
-        #next(f)
-        for line in f:
-            muscleData.append([float(i) for i in line.split()])
-    muscleData = array(muscleData).transpose() # transpose
-    muscleData = muscleData[:, len(muscleData[0])-n:] # make number of rows equal to n (packets received)
-
-    # create arrays to store read data
-    musExcSeq = zeros((numMusBranches, n))
-    musActSeq = zeros((numMusBranches, n))
-    musForcesSeq = zeros((numMusBranches, n))
-
-    # assign activation and force to output arrays
     # file has format: time  DELT1_excitation  DELT1_activation  DELT1_force  DELT2_excitation  DELT2_activation  DELT2_force  ...
-    musExcSeq = muscleData[1::3 , :]
-    musActSeq = muscleData[2::3 , :]
-    musForcesSeq = muscleData[3::3 , :]
+    musExcSeq, musActSeq, musForcesSeq = armPnt.readMuscleStatus(pntFile, timeRange, muscles, n, cache) # only last n samples (packets received)
 
     return jointPosSeq, musExcSeq, musActSeq, musForcesSeq
 
@@ -149,6 +111,7 @@ def plotGraphs(jointPosSeq, jointAnglesSeq, musLengthsSeq, musExcSeq, musActSeq,
         ###########################
         # 2D arm movement animation
         armImages=[]
+        elbowPosAll, wristPosAll = forwardKinematics(jointAnglesSeq[:, t1Samples:t2Samples].T, armLen) # all samples at once
         for t in arange(t1Samples,t2Samples):
             # Update the arm position based on jointPosSeq
             if useJointPos:
@@ -164,13 +127,10 @@ def plotGraphs(jointPosSeq, jointAnglesSeq, musLengthsSeq, musExcSeq, musActSeq,
 
             # Update the arm position based on jointAnglesSeq
             else:
-                armAng = jointAnglesSeq[:,t]
                 shoulderPosx = 0
                 shoulderPosy = 0
-                elbowPosx = armLen[0] * cos(armAng[0]) # end of elbow
-                elbowPosy = armLen[0] * sin(armAng[0])
-                wristPosx = elbowPosx + armLen[1] * cos(+armAng[0]+armAng[1]) # wrist=arm position
-                wristPosy = elbowPosy + armLen[1] * sin(+armAng[0]+armAng[1])
+                elbowPosx, elbowPosy = elbowPosAll[t-t1Samples] # end of elbow
+                wristPosx, wristPosy = wristPosAll[t-t1Samples] # wrist=arm position
 
             # create
             armLine1 = lines.Line2D([0, elbowPosx-shoulderPosx], [0, elbowPosy-shoulderPosy], color=color1, linestyle=line1, linewidth=linWidth)
@@ -221,8 +181,7 @@ def plotGraphs(jointPosSeq, jointAnglesSeq, musLengthsSeq, musExcSeq, musActSeq,
         xTraj = jointPosSeq[4, t1Samples:t2Samples]
         yTraj = jointPosSeq[5, t1Samples:t2Samples]
     else:
-        xTraj = armLen[0]*cos(jointAnglesSeq[0,t1Samples:t2Samples])+armLen[1]*cos(jointAnglesSeq[1,t1Samples:t2Samples])
-        yTraj = armLen[0]*sin(jointAnglesSeq[0,t1Samples:t2Samples])+armLen[0]*sin(jointAnglesSeq[1,t1Samples:t2Samples])
+        xTraj, yTraj = angles2pos(jointAnglesSeq[:, t1Samples:t2Samples].T, armLen).T
 
     #ax.plot(xTraj, yTraj,color=color2,linestyle=line1, linewidth=linWidth)
     ax.plot(T, xTraj,color=color1,linestyle=line1, linewidth=linWidth, label="x")
@@ -327,7 +286,7 @@ def plotGraphs(jointPosSeq, jointAnglesSeq, musLengthsSeq, musExcSeq, musActSeq,
 
 
 # run single test (udp transfer, read files, plot graphs)
-def readAndPlot(jointAnglesSeq, musLengthsSeq, msmFolder, armAnimation, saveGraphs, saveName, timeRange, msecInterval):
+def readAndPlot(jointAnglesSeq, musLengthsSeq, msmFolder, armAnimation, saveGraphs, saveName, timeRange, msecInterval, pntFile):
     # Sim parameters
     #armAnimation = 1 #  show 2D arm animation
     #saveGraphs = 1 # save graph and animation
@@ -339,7 +298,7 @@ def readAndPlot(jointAnglesSeq, musLengthsSeq, msmFolder, armAnimation, saveGrap
     #jointAnglesSeq, musLengthsSeq = sendAndReceiveMsmData(initJointAngles, musExcSeq, readSimFromFile)
 
     # Read data from .pnt files
-    jointPosSeq,musExcSeq, musActSeq, musForcesSeq = readPntFiles(msmFolder, timeRange[1], msecInterval)
+    jointPosSeq,musExcSeq, musActSeq, musForcesSeq = readPntFiles(msmFolder, pntFile, timeRange[1], msecInterval)
 
     # Plot results (last 2 arguments = initial and end times in seconds)
     plotGraphs(jointPosSeq, jointAnglesSeq, musLengthsSeq, musExcSeq, musActSeq, musForcesSeq, timeRange[0], timeRange[1], msecInterval, armAnimation, saveGraphs, saveName)
@@ -0,0 +1,58 @@
+"""
+armKinematics.py
+
+Array-native forward/inverse kinematics of the 2-joint (shoulder, elbow) planar arm.
+All functions accept a single sample (shape (2,)) or whole trajectories (shape (T,2))
+and operate on all samples at once, so post-processing of long simulations
+(10^5-10^6 arm samples) doesn't loop in python.
+
+Angles in rad (shoulder, elbow), positions in m (x, y), armLen = [upper arm, forearm].
+Shoulder is at the origin.
+"""
+
+from numpy import asarray, cos, sin, arctan, arctan2, sqrt, hypot, stack, abs, mean
+
+
+# convert joint angles to elbow and hand (end-effector) positions; returns (elbowPos, handPos)
+def forwardKinematics(ang, armLen):
+    ang = asarray(ang, dtype=float)
+    sh = ang[..., 0]
+    shel = sh + ang[..., 1] # absolute angle of forearm
+    elbowPos = stack((armLen[0] * cos(sh), armLen[0] * sin(sh)), axis=-1)
+    handPos = elbowPos + stack((armLen[1] * cos(shel), armLen[1] * sin(shel)), axis=-1)
+    return elbowPos, handPos
+
+
+# convert joint angles to hand position
+def angles2pos(ang, armLen):
+    return forwardKinematics(ang, armLen)[1]
+
+
+# convert hand position to joint angles (elbow-down solution)
+def pos2angles(pos, armLen):
+    pos = asarray(pos, dtype=float)
+    x = pos[..., 0]
+    y = pos[..., 1]
+    l1 = armLen[0]
+    l2 = armLen[1]
+    d2 = x**2 + y**2
+    elang = abs(2*arctan(sqrt(((l1 + l2)**2 - d2)/(d2 - (l1 - l2)**2))))
+    phi = arctan2(y, x)
+    psi = arctan2(l2 * sin(elang), l1 + (l2 * cos(elang)))
+    return stack((phi - psi, elang), axis=-1)
+
+
+# euclidean distance between hand position(s) and target position
+def handError(handPos, targetPos):
+    handPos = asarray(handPos, dtype=float)
+    return hypot(handPos[..., 0] - targetPos[0], handPos[..., 1] - targetPos[1])
+
+
+# hand-target distance for each sample of a joint angle trajectory (T,2)
+def trajError(ang, targetPos, armLen):
+    return handError(angles2pos(ang, armLen), targetPos)
+
+
+# mean hand-target distance over a joint angle trajectory (T,2)
+def meanTrajError(ang, targetPos, armLen):
+    return mean(trajError(ang, targetPos, armLen))
@@ -0,0 +1,74 @@
+"""
+armPnt.py
+
+Fast columnar reader for the .pnt text files written by the musculoskeletal arm (msarm):
+- muscle status: time  DELT1_excitation  DELT1_activation  DELT1_force  DELT2_excitation ...
+- coordinate status: time, ground_thorax_xyz, sternoclavicular_xyz, ... (one row per arm interval)
+
+The text is parsed in a single numpy call (no per-line python loop). Optionally the parsed
+array is saved next to the text file as <file>.npy (one-time binary conversion); later reads
+memory-map it and only touch the requested rows/columns.
+
+Usage:
+    data = readPnt(fileName, timeRange=[t1, t2], columns=[0, 1, 2])  # rows = samples
+    exc, act, force = readMuscleStatus(fileName, timeRange=[t1, t2], muscles=[0, 15])  # muscles x samples
+"""
+
+import os
+import numpy
+
+
+# parse .pnt text file into 2D array (samples x columns); incomplete last line (eg. run stopped) is dropped
+def parsePnt(fileName):
+    with open(fileName, 'rb') as f:
+        text = f.read()
+    firstLine = text[:text.find(b'\n')] if b'\n' in text else text
+    numCols = len(firstLine.split())
+    if numCols == 0:
+        return numpy.zeros((0, 0))
+    values = numpy.fromstring(text, dtype=float, sep=' ') # any whitespace (incl. newlines) separates values
+    numRows = len(values) // numCols
+    return values[:numRows*numCols].reshape(numRows, numCols)
+
+
+# load whole .pnt file as 2D array (samples x columns); if cache, convert once to .npy and memory-map it
+def loadPnt(fileName, cache=False):
+    if not cache:
+        return parsePnt(fileName)
+    cacheFile = fileName + '.npy'
+    if not os.path.exists(cacheFile) or os.path.getmtime(cacheFile) < os.path.getmtime(fileName):
+        numpy.save(cacheFile, parsePnt(fileName))
+    return numpy.load(cacheFile, mmap_mode='r')
+
+
+# select rows with time (column 0, in s) within timeRange=[t1, t2], and selected columns (default all), of loaded .pnt array
+def selectPnt(data, timeRange=None, columns=None):
+    if len(data) == 0:
+        return numpy.zeros((0, len(columns) if columns is not None else 0))
+    rows = slice(None)
+    if timeRange is not None:
+        t = data[:, 0]
+        rows = slice(numpy.searchsorted(t, timeRange[0], 'left'), numpy.searchsorted(t, timeRange[1], 'right'))
+    if columns is None:
+        return numpy.array(data[rows])
+    return numpy.array(data[rows][:, columns]) # copy only selected rows/columns out of the (memory-mapped) array
+
+
+# read .pnt file rows within timeRange=[t1, t2] (s), and selected columns (default all)
+def readPnt(fileName, timeRange=None, columns=None, cache=False):
+    return selectPnt(loadPnt(fileName, cache), timeRange, columns)
+
+
+# read muscle excitation, activation and force from muscle status .pnt file; returns 3 arrays (muscles x samples)
+# muscles = muscle branch indices (default all), lastSamples = keep only last n samples (after timeRange)
+def readMuscleStatus(fileName, timeRange=None, muscles=None, lastSamples=None, cache=False):
+    data = loadPnt(fileName, cache)
+    if muscles is None:
+        muscles = list(range((data.shape[1] - 1) // 3))
+    muscles = numpy.asarray(muscles, dtype=int)
+    columns = numpy.concatenate(([0], 1+3*muscles, 2+3*muscles, 3+3*muscles))
+    data = selectPnt(data, timeRange, columns)
+    if lastSamples is not None:
+        data = data[max(len(data)-lastSamples, 0):]
+    n = len(muscles)
+    return data[:, 1:1+n].T, data[:, 1+n:1+2*n].T, data[:, 1+2*n:1+3*n].T
@@ -0,0 +1,172 @@
+"""
+armReplay.py
+
+Arm-only replay of the motor commands of a saved run with new arm parameters (no network simulation)
+
+Usage:
+    python armReplay.py file.mat [param=v1,v2,...] ...
+    eg. python armReplay.py out_target_0.mat cmdmaxrate=80,160,320 antagInh=0,1 armFriction=0.3,0.5
+"""
+
+import sys
+import time
+import itertools
+import numpy
+import armKinematics
+
+[SH,EL] = [X,Y] = [0,1]
+[SH_EXT, SH_FLEX, EL_EXT, EL_FLEX] = [0,1,2,3]
+targetOffsets = numpy.array([[0.15, 0], [-0.15, 0], [0, 0.15], [0, -0.15]]) # target position relative to start position for each target id (same as Arm.setTargetByID)
+
+
+# load raw motor commands, target ids, saved error and arm params from .mat file saved by network.saveData
+def loadRun(filename):
+    from scipy.io import loadmat
+    m = loadmat(filename, squeeze_me=True, struct_as_record=False)
+    armParams = m['armParams']
+    run = {name: getattr(armParams, name) for name in armParams._fieldnames}
+    run.setdefault('armFeedbackDelay', 0) # saved since the pipelined arm; serial before
+    run['motorCmdRaw'] = numpy.atleast_2d(numpy.asarray(m['motorCmdRawAll'], dtype=float))
+    run['targetid'] = numpy.atleast_1d(m['targetidAll']).astype(int)
+    run['errorAll'] = numpy.atleast_1d(m['errorAll'])
+    return run
+
+
+# normalize raw motor commands (spike counts, shape (...,4)) and apply antagonist inhibition; same as Arm.run
+# cmdmaxrate and antagInh broadcast against the leading dims (eg. one value per parameter set)
+def normalizeMotorCmd(motorCmdRaw, cmdmaxrate, antagInh):
+    cmd = numpy.asarray(motorCmdRaw, dtype=float) / numpy.asarray(cmdmaxrate, dtype=float)[..., None]
+    antagInh = numpy.broadcast_to(antagInh, cmd.shape[:-1])
+    out = cmd.copy()
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        for ext, flex in [(SH_EXT, SH_FLEX), (EL_EXT, EL_FLEX)]:
+            out[..., flex] = numpy.where((antagInh != 0) & (cmd[..., ext] > cmd[..., flex]), cmd[..., flex]**2 / cmd[..., ext] / antagInh, out[..., flex])
+            out[..., ext] = numpy.where((antagInh != 0) & (cmd[..., ext] < cmd[..., flex]), cmd[..., ext]**2 / cmd[..., flex] / antagInh, out[..., ext])
+    return out
+
+
+# time, trial reset flag and target position of each arm step (same trial logic as Arm.run/resetArm)
+def trialSchedule(run):
+    numSteps = len(run['motorCmdRaw'])
+    t = (numpy.arange(numSteps) + 1) * run['loopstep']
+    reset = numpy.zeros(numSteps, dtype=bool)
+    targetid = numpy.zeros(numSteps, dtype=int)
+    timeoflastreset = 0
+    currentTarget = run['targetid'][0]
+    startPos = armKinematics.angles2pos(run['startAng'], run['armLen'])
+    for k in range(numSteps):
+        if run['trialReset'] and t[k] - timeoflastreset > run['testTime']:
+            reset[k] = True
+            timeoflastreset = t[k]
+            currentTarget = run['targetid'][min(k+1, numSteps-1)] # target ids are stored at the start of each step (before reset)
+        targetid[k] = currentTarget
+    return t, reset, startPos + targetOffsets[targetid]
+
+
+# mean error as computed from Arm.errorAll (error stored at start of each step: 0 before first step, error after step k-1 at step k)
+def meanStepError(error):
+    return numpy.concatenate((numpy.zeros((1,) + error.shape[1:]), error[:-1])).mean(axis=0)
+
+
+# angles seen by the network with a pipelined arm (armFeedbackDelay loopsteps, same as Arm.run): the arm state delay steps old,
+# start angles while the pipeline fills (start of the run and, dummyArm, every reset); angAll (T,...,2)
+def feedbackAngles(angAll, reset, startAng, delay):
+    seenAll = numpy.empty_like(angAll)
+    trialStart = 0
+    for k in range(len(angAll)):
+        if reset[k]:
+            trialStart = k
+        seenAll[k] = angAll[k - delay] if k - delay >= trialStart else startAng
+    return seenAll
+
+
+# replay dummyArm for P parameter sets at once (each param scalar or array of P values); returns mean error (P,) and angles (T,P,2)
+def replayDummyArm(run, cmdmaxrate=None, antagInh=None, armFriction=None):
+    cmdmaxrate = numpy.atleast_1d(run['cmdmaxrate'] if cmdmaxrate is None else cmdmaxrate).astype(float)
+    antagInh = numpy.atleast_1d(run['antagInh'] if antagInh is None else antagInh).astype(float)
+    friction = numpy.atleast_1d(run['armFriction'] if armFriction is None else armFriction).astype(float)
+    cmdmaxrate, antagInh, friction = numpy.broadcast_arrays(cmdmaxrate, antagInh, friction)
+    numSets = len(cmdmaxrate)
+
+    t, reset, targetPos = trialSchedule(run)
+    numSteps = len(run['motorCmdRaw'])
+    cmd = normalizeMotorCmd(run['motorCmdRaw'][:, None, :], cmdmaxrate[None, :], antagInh[None, :]) # (T,P,4)
+    acc = numpy.stack((cmd[..., SH_FLEX] - cmd[..., SH_EXT], cmd[..., EL_FLEX] - cmd[..., EL_EXT]), axis=-1) # (T,P,2)
+    dt = run['loopstep'] / 1000.0
+    startAng = numpy.asarray(run['startAng'], dtype=float)
+
+    # raw motor command is 0 whenever the arm wasn't moving (before initArmMovement), so only resets need special handling
+    ang = numpy.tile(startAng, (numSets, 1))
+    angVel = numpy.zeros((numSets, 2))
+    angAll = numpy.zeros((numSteps, numSets, 2))
+    for k in range(numSteps):
+        if reset[k]:
+            ang[:] = startAng
+            angVel[:] = 0
+        newAng = (ang + angVel * dt).clip(run['minPval'], run['maxPval'])
+        angVel = angVel + acc[k] - friction[:, None] * angVel # update velocities based on motor commands (accelerations) and friction
+        ang = newAng
+        angAll[k] = ang
+
+    if run['armFeedbackDelay'] > 0:
+        angAll = feedbackAngles(angAll, reset, startAng, int(run['armFeedbackDelay']))
+    error = armKinematics.handError(armKinematics.angles2pos(angAll, run['armLen']), targetPos.T[:, :, None]) # (T,P)
+    return meanStepError(error), angAll
+
+
+# replay musculoskeletal arm (through arminterface, stand-in arm if standIn) for one parameter set; returns mean error and angles (T,2)
+def replayMusculoskeletal(run, cmdmaxrate=None, antagInh=None, armDamping=None, armMuscleGains=None, standIn=0):
+    import arminterface
+    cmdmaxrate = run['cmdmaxrate'] if cmdmaxrate is None else cmdmaxrate
+    antagInh = run['antagInh'] if antagInh is None else antagInh
+    damping = run['armDamping'] if armDamping is None else armDamping
+    gains = list(run['armMuscleGains'] if armMuscleGains is None else armMuscleGains)
+
+    t, reset, targetPos = trialSchedule(run)
+    cmd = normalizeMotorCmd(run['motorCmdRaw'], cmdmaxrate, antagInh)
+    interval = run['loopstep']
+    secLength = len(cmd) * interval / 1000.0
+    startAng = list(run['startAng'])
+    arminterface.msmStandIn = standIn
+    arminterface.setup(secLength, interval, startAng[SH], startAng[EL], targetPos[0][X], targetPos[0][Y], damping, *gains)
+    ang = list(startAng)
+    angAll = numpy.zeros((len(cmd), 2))
+    for k in range(len(cmd)):
+        dataReceived = arminterface.sendAndReceiveDataPackets(t[k], interval, *cmd[k])
+        if dataReceived and dataReceived != [-3, -3]: # otherwise use previous packet
+            ang = dataReceived
+        angAll[k] = ang
+    arminterface.closeSavePlot(secLength, interval)
+    if run['armFeedbackDelay'] > 0: # the musculoskeletal arm isn't reset between trials
+        angAll = feedbackAngles(angAll, numpy.zeros(len(cmd), dtype=bool), startAng, int(run['armFeedbackDelay']))
+    error = armKinematics.handError(armKinematics.angles2pos(angAll, run['armLen']), targetPos.T)
+    return meanStepError(error), angAll
+
+
+# replay run for all combinations of parameter values (dict param name -> list of values); returns list of (params, mean error)
+def sweep(run, paramValues, standIn=0):
+    names = list(paramValues.keys())
+    combos = list(itertools.product(*[paramValues[name] for name in names]))
+    if run['useArm'] == 'dummyArm':
+        values = {name: numpy.array([c[i] for c in combos], dtype=float) for i, name in enumerate(names)}
+        errors, angAll = replayDummyArm(run, **values)
+    else:
+        errors = [replayMusculoskeletal(run, standIn=standIn, **dict(zip(names, c)))[0] for c in combos]
+    return [(dict(zip(names, c)), float(e)) for c, e in zip(combos, errors)]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    run = loadRun(sys.argv[1])
+    paramValues = {}
+    for arg in sys.argv[2:]:
+        name, values = arg.split('=')
+        paramValues[name] = [float(x) for x in values.split(',')]
+    print('Replaying %s arm: %d steps, saved mean error = %.4f' % (run['useArm'], len(run['motorCmdRaw']), numpy.mean(run['errorAll'])))
+    start = time.time()
+    results = sweep(run, paramValues) if paramValues else sweep(run, {'cmdmaxrate': [run['cmdmaxrate']]})
+    print('%d parameter sets replayed in %.3f s' % (len(results), time.time() - start))
+    for params, error in sorted(results, key=lambda x: x[1]):
+        print('  mean error = %.4f ; %s' % (error, ', '.join('%s=%g' % (k, v) for k, v in params.items())))
@@ -14,9 +14,9 @@ import os  # to kill subprocess
 import signal  # to kill subprocess
 import xml.etree.ElementTree as ET
 import atexit
-from io import StringIO
-import random
+import tempfile
 import os.path
+import sys
 
 # Verbosity level (for debugging).
 verbose = 0
@@ -41,16 +41,53 @@ wamForwardType = 'pos'
 # MSM returns length of all branches per muscle - decide which to use as proprioceptive info for BMM (0 = mean); one value per muscle
 muscleLengthBranch = [3,1,1,1]
 
+# Protocol used to exchange data with the MSM via pipes: 'text' (space-delimited lines) or 'binary' (fixed-size frames);
+# same round trip with the stand-in arm (armBenchmark.py), both bound by the wait for the arm
+msmProtocol = 'text'
+
+# Binary frame format (must match msarm/MsmPacket.h): header = magic, packet type, num values, packet ID, sim time (ms); followed by float64 values
+msmMagic = 0x314D534D # "MSM1"
+msmMagicBytes = struct.pack('<I', msmMagic)
+[MSM_EXC, MSM_COORDS, MSM_LENGTHS, MSM_STOP] = [1, 2, 3, 4]
+msmHeader = struct.Struct('<IHHId')
+msmExcFrame = struct.Struct('<IHHId4d') # header + 4 muscle excitations
+numJoints = 2 # number of joint angles received
+numMuscles = 18 # number of muscle branch lengths received
+rxBufferSize = 65536 # size of preallocated buffer to read from MSM pipe
+
+# Deadlines for blocking reads from MSM pipe (s)
+msmReadyTimeout = 60.0 # wait for MSM to load model and print READY TO RUN
+msmReplyTimeout = 5.0 # wait for reply to a packet
+msmLastReplyTimeout = 0.1 # wait for reply to last packet (MSM may have finished already)
+
 # Flag to run MSM from Python
 msmRun = 1
+
+# Flag to keep a single MSM process alive across setup()/closeSavePlot() calls (eg. train and test phases):
+# at close the run is stopped, and the next setup resets it with the new .xml/.osim files instead of restarting it
+msmPersistent = 1
+msmStopTimeout = 5.0 # max time to wait for MSM to finish the current run after stopping it (s)
+msmPipe = None # MSM process
+msmPipeCommand = None # command used to start MSM process
 #msmFolder = "/home/salvadord/Documents/ISB/Models_linux/msarm/source/test/"
 msmFolder = "msarm/" #update to use os.getcwd()
 
+# Command to run MSM (xml file appended as last argument)
+msmExecutable = [msmFolder+"Run"]
+
+# Flag to run local python stand-in arm (msarmStub.py) instead of msarm (to benchmark/test without OpenSim)
+msmStandIn = 0
+msmStandInLatency = 0.0 # artificial delay of stand-in arm per packet (ms)
+msmStandInJitter = 0.0 # mean of additional exponential delay of stand-in arm per packet (ms)
+
 # .osim file with arm model description
 # will be copied with timestamp in 'osimFile' to enable multiple instances running simultaneously
 osimOriginal = msmFolder + "SUNY_arm_2DOFs_horizon.osim"
 osimFile = osimOriginal
 
+# Parsed original .xml/.osim files (see msmLoadTemplate)
+msmTemplates = {}
+
 # Flag to show MSM animation
 msmAnim  = 0
 
@@ -61,18 +98,6 @@ msmGraphs = 0
 import armGraphs        # to plot muscskel arm graphs
 
 
-class PipeReader(object):
-    def __init__(self, fd):
-        self._fd = fd
-        self._buf = ''
-
-    def fileno(self):
-        return self._fd
-
-    def readlines(self):
-        data = os.read(self._fd, 4096)
-        return data
-
 #
 # Initialize and setup the sockets, data format and other variables
 #
@@ -85,6 +110,7 @@ def setup(secLength, msecInterval, shInit, elInit, targetx, targety, damping, sh
     # output variables
     global msmCommand
     global msmPipe
+    global msmPipeCommand
     global jointAnglesSeq
     global musLengthsSeq
     global packetID
@@ -94,14 +120,24 @@ def setup(secLength, msecInterval, shInit, elInit, targetx, targety, damping, sh
     global xmlFile
     global osimFile
     global msmSockMaxIter
-    global proc_stdout
+    global msmStdout
+    global msmStdin
     global armReady
-    global inputbuffer
+    global rxBuffer
+    global rxView
+    global rxStart
+    global rxEnd
+    global txBuffer
     global pntFile
+    global setupTime
+    global msmStats
+    global msmNumPackets
+    global sendTimes
 
 
     # Packet ID numbers (0 is first packet, with sim start time)
     packetID = 0
+    msmNumPackets = int(round(secLength*1000/msecInterval)) # number of packets exchanged in this run
     jointAngleID = -1
     muscleLengthID = -1
 
@@ -118,46 +154,51 @@ def setup(secLength, msecInterval, shInit, elInit, targetx, targety, damping, sh
     # Run MSM simulation asynchronously (i.e. Python goes on while MSM is running)
     if msmRun:
         # Set paths to run MSM from Python
-        msmCommand = msmFolder+"Run" # runs MSM sim
+        if msmStandIn: # runs python stand-in arm
+            msmCommand = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'msarmStub.py'), '--latency', str(msmStandInLatency), '--jitter', str(msmStandInJitter)]
+        else:
+            msmCommand = list(msmExecutable) # runs MSM sim
         if msmAnim:
             xmlOriginal = msmFolder+"SUNY_arm_horizon_fwd_10ms.xml" # xml file with sim parametersd - with 3D visualization
         else:
             xmlOriginal = msmFolder+"SUNY_arm_horizon_fwd_no_visual_10ms.xml" # xml file with sim parameters - no visualization
 
         # make copy of .xml and .osim to enable running multiple isntances simultaneously
-        while 1:
-            random.seed()
-            rand=int(random.random()*100000000)
-            xmlTemp = "xml_temp_"+str(rand)+".xml"
-            xmlFile = msmFolder+xmlTemp
-            if not os.path.isfile(xmlFile): # if file doesn't exist, exit loop; otherwise try different filename
-                break
-
-        osimTemp = "osim_temp_"+str(rand)+".osim"
+        setupStart = time()
+        fd, xmlFile = tempfile.mkstemp(prefix="xml_temp_", suffix=".xml", dir=msmFolder) # unique file name
+        os.close(fd)
+        rand = os.path.basename(xmlFile)[len("xml_temp_"):-len(".xml")]
+
+        osimTemp = "osim_temp_"+rand+".osim"
         osimFile = msmFolder+osimTemp
-        cp_xml_str='cp %s %s' % (xmlOriginal, xmlFile)
-        cp_osim_str = 'cp %s %s' % (osimOriginal, osimFile)
-        os.system(cp_xml_str)
-        os.system(cp_osim_str)
 
         # generate name of temporary pnt file to store muscle data
-        pntTemp = "muscleData_temp_"+str(rand)+".pnt"
+        pntTemp = "muscleData_temp_"+rand+".pnt"
         pntFile = msmFolder+pntTemp
 
+        # parsed original .xml and .osim (cached; all fields below are overwritten on every setup)
+        xmlTree = msmLoadTemplate(xmlOriginal)
+        osimTree = msmLoadTemplate(osimOriginal)
+        xmlRoot = xmlTree.getroot()
+        osimRoot = osimTree.getroot()
+
         # set temporary .pnt file name in temporary .xml file
-        msmSetPntFileName(xmlFile, pntFile)
+        msmSetPntFileName(xmlRoot, pntFile)
 
         # set temporary .osim file name in temporary .xml file
-        msmSetOsimFileName(xmlFile, osimTemp)
+        msmSetOsimFileName(xmlRoot, osimTemp)
 
         # set msm duration = sim duration via XML
-        msmSetDurationXML(secLength, xmlFile)
+        msmSetDurationXML(xmlRoot, secLength)
+
+        # set pipe protocol of msm event handlers
+        msmSetProtocolXML(xmlRoot, msmProtocol)
 
         # set initial joint angles via XML
-        msmSetJointAnglesXML(shInit,elInit)
+        msmSetJointAnglesXML(osimRoot, shInit, elInit)
 
         # set damping
-        msmSetDampingXML(damping)
+        msmSetDampingXML(osimRoot, damping)
 
         # set max isometric force
         shMuscleList = ['DELT1', 'DELT2', 'DELT3', 'Infraspinatus', 'Latissimus_dorsi_1', 'Latissimus_dorsi_2', 'Latissimus_dorsi_3','Teres_minor', 'PECM1', 'PECM2', 'PECM3', 'Coracobrachialis'] # only shoulder muscles
@@ -166,18 +207,46 @@ def setup(secLength, msecInterval, shInit, elInit, targetx, targety, damping, sh
         elMuscleList =  ['TRIlong', 'TRIlat', 'TRImed', 'BIClong', 'BICshort', 'BRA'] # only elbow muscles
         elMuscleOriginalValues = [elExtGain*798.52, elExtGain*624.30, elExtGain*624.30, elFlexGain*624.30, elFlexGain*435.56, elFlexGain*987.26]
 
+        muscleForces = {}
         for i in range(len(shMuscleList)):
-            msmSetMaxIsometricForceXML(shMuscleList[i], shMuscleOriginalValues[i]*3.0) #*3
-
+            muscleForces[shMuscleList[i]] = shMuscleOriginalValues[i]*3.0 #*3
         for i in range(len(elMuscleList)):
-            msmSetMaxIsometricForceXML(elMuscleList[i], elMuscleOriginalValues[i]*1.0)
+            muscleForces[elMuscleList[i]] = elMuscleOriginalValues[i]*1.0
+        msmSetMaxIsometricForceXML(osimRoot, muscleForces)
 
         # set target location
-        msmSetTargetPositionXML(targetx,targety)
-
-        # run MSM and create pipe to read output
-        msmPipe = subprocess.Popen([msmCommand, xmlFile],  preexec_fn=os.setsid, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-        proc_stdout = PipeReader(msmPipe.stdout.fileno())
+        msmSetTargetPositionXML(osimRoot, targetx, targety)
+
+        # write temporary .xml and .osim files (once)
+        xmlTree.write(xmlFile)
+        osimTree.write(osimFile)
+        setupTime = time() - setupStart
+        print('  Arm setup: temp .xml/.osim files written in %.1f ms' % (setupTime*1000))
+
+        # run MSM and create pipe to read output (persistent mode: reset running MSM with new files if possible)
+        if msmPersistent and msmPipe is not None and msmPipe.poll() is None and msmPipeCommand == msmCommand:
+            try:
+                os.write(msmStdin, ("\nRESET %s\n" % xmlFile).encode())
+                reused = 1
+            except OSError:
+                reused = 0
+        else:
+            reused = 0
+        if not reused:
+            msmShutdown()
+            msmPipeCommand = msmCommand
+            msmPipe = subprocess.Popen(msmCommand + [xmlFile] + (['--server'] if msmPersistent else []),  preexec_fn=os.setsid, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0)
+            msmStdout = msmPipe.stdout # unbuffered: readinto() returns whatever is available
+            msmStdin = msmPipe.stdin.fileno()
+
+            # Preallocated buffers to store data during pipe communication (rxStart:rxEnd = unread data)
+            rxBuffer = bytearray(rxBufferSize)
+            rxView = memoryview(rxBuffer)
+            rxStart = 0
+            rxEnd = 0
+            txBuffer = bytearray(msmExcFrame.size)
+        if verbose:
+            print("MSM process %s (pid %d)" % ('reused' if reused else 'started', msmPipe.pid))
 
         # initialize timeInterval
         time1 = time()
@@ -185,108 +254,125 @@ def setup(secLength, msecInterval, shInit, elInit, targetx, targety, damping, sh
         # Flag to ensure first pacekt is sent once the virtual arm executable is ready
         armReady = 0
 
-        # Buffer to store data during pipe communication
-        inputbuffer = StringIO()
+        # I/O stats (see printStats)
+        msmStats = {'packets': 0, 'timeouts': 0, 'latency': [], 'wait': [], 'waitCpu': 0.0, 'reads': 0}
+        sendTimes = [] # send time of packets waiting for reply (more than one if pipelined)
 
         # save data
         if saveDataExchanged:
             savedDataSent = []
             savedDataReceived = []
 
-def sendAndReceiveDataPackets(simtime, msecInterval, data1, data2, data3, data4):
-    # input variables
-    global packetID
-    global muscleLengthID
-    global jointAngleID
-    global verbose
-    global anglesReceived
-    global savedDataSent
-    global savedDataReceived
-    global jointAnglesSeq
-    global musLengthsSeq
-    global muscleLengthBranch
-    global wamForwardType
+# Send motor commands (muscle excitations) to MSM; returns immediately (reply read with receiveDataPacket)
+def sendDataPacket(simtime, msecInterval, data1, data2, data3, data4):
     global packetID
-    global jointAngleID
-    global time1
-    global msmReady
-    global proc_stdout
-    global armReady
-    global inputbuffer
 
     # concatenate input arguments into a list
     data = [data1, data2,data3,data4]
 
     # Increase packet ID.
-    packetID += 1.0
-
-    #####################
-    # Send packets
-    #####################
+    packetID += 1
 
     # Send packets to MSM
 
-    while not armReady: # Ensure virtual arm is ready to receive
-        ready, _, _ = select.select([proc_stdout], [], [], 0.0)
-        if not ready:
-            continue
-        lines = ready[0].readlines()
-        if verbose:
-            print(lines)
-        if 'READY TO RUN' in lines:
-            armReady=1
+    if not armReady: # Ensure virtual arm is ready to receive
+        waitArmReady(msmReadyTimeout)
 
     musclesExcSend = data
 
     try:
-        msmPipe.stdin.write(str(musclesExcSend)[1:-1])
-        msmPipe.stdin.write("\n")
+        if msmProtocol == 'binary':
+            msmExcFrame.pack_into(txBuffer, 0, msmMagic, MSM_EXC, len(data), packetID, simtime, *data)
+            os.write(msmStdin, txBuffer)
+        else:
+            os.write(msmStdin, (str(musclesExcSend)[1:-1]+"\n").encode())
         if verbose:
-            print("\nWriting to MSM pipe: packetID=%f"%(packetID))
+            print("\nWriting to MSM pipe: packetID=%d"%(packetID))
             print((str(musclesExcSend)))
-    except:
-        print("timeout while sending packet to msarm")
-        dataReceived = [-3]*numJoints  # error code indicating virtual arm pipe is not available
-        dataReceived2 = [0]*numMuscles
+    except OSError:
+        print("error while sending packet to msarm")
+    sendTimes.append(time())
+
+# Send motor commands and wait for reply (joint angles)
+def sendAndReceiveDataPackets(simtime, msecInterval, data1, data2, data3, data4):
+    sendDataPacket(simtime, msecInterval, data1, data2, data3, data4)
+    return receiveDataPacket(simtime, msecInterval)
 
-    #####################
-    # Receive packets
-    #####################
+# Wait for reply of oldest packet not yet received (joint angles and muscle lengths), sent at simtime; blocks until received or deadline
+# (serial mode: reply to last packet sent; pipelined mode: reply to packet sent one or more loopsteps earlier)
+def receiveDataPacket(simtime, msecInterval):
+    # input variables
+    global muscleLengthID
+    global verbose
+    global anglesReceived
+    global savedDataSent
+    global savedDataReceived
+    global jointAnglesSeq
+    global musLengthsSeq
+    global muscleLengthBranch
+    global wamForwardType
+    global jointAngleID
+    global time1
+    global msmReady
 
-    # Receive packets from MSM
+    # Receive packets from MSM (joint angles and muscle lengths, in any order)
     dataReceived = []
     dataReceived2 = []
-    dataReceivedPacked = []
-    dataReceivedPacked2 = []
-    numJoints = 2
-    numMuscles = 18
+    lastPacket = int(round(simtime/msecInterval)) >= msmNumPackets # reply to last packet of the run (simtime = time of packet being received)
+    waitStart = time() # time blocked waiting for reply (vs time already elapsed since send)
+    cpuStart = process_time()
+    deadline = waitStart + (msmLastReplyTimeout if lastPacket else msmReplyTimeout)
 
     while len(dataReceived) == 0 or len(dataReceived2) == 0:
-        buffline = inputbuffer.readline()  # read next line in buffer
-        if buffline == '':   # if buffer empty, read more lines from pipe
-            ready, _, _ = select.select([proc_stdout], [], [], 1.0)
-            if ready:
-                inputbuffer = StringIO(ready[0].readlines())
-                buffline = inputbuffer.readline()
-        if 'Totoal' in buffline: # if end of input from virtual arm, stop
+        if msmProtocol == 'binary':
+            frame = readBinaryFrame()
+            if frame:
+                [frameType, framePacketID, frameTime, values] = frame
+                if verbose:
+                    print("read from msm pipe: type=%d, packetID=%d, t=%.1f" % (frameType, framePacketID, frameTime))
+                    print(values)
+                if frameType == MSM_COORDS:
+                    dataReceived = values
+                elif frameType == MSM_LENGTHS:
+                    dataReceived2 = values
+                continue
+        else:
+            buffline = readTextLine()
+            if buffline is not None:
+                if 'Totoal' in buffline: # if end of input from virtual arm, stop
+                    break
+                try:
+                    tmp = [float(x) for x in buffline.split()]  # split line into space delimited floats
+                except ValueError: # not a data line
+                    continue
+                if verbose:
+                    print("read from msm pipe: " + str(len(buffline)))
+                    print(tmp)
+                if len(tmp) == numJoints:
+                    dataReceived = tmp
+                elif len(tmp) == numMuscles:
+                    dataReceived2 = tmp
+                continue
+
+        # no complete packet in buffer: block until more data in pipe or deadline
+        n = fillBuffer(deadline - time())
+        if n < 0: # msm exited
+            break
+        if n == 0: # deadline (eg. missing last packet)
+            msmStats['timeouts'] += 1
             break
-        tmp = [float(x) for x in buffline.split()]  # split line into space delimited floats
-
-        if verbose:
-            print("read from msm pipe: " + str(len(buffline)))
-            print(tmp)
-
-        if len(tmp) == numJoints:
-            dataReceived = tmp
-        elif len(tmp) == numMuscles:
-            dataReceived2 = tmp
 
-        if len(dataReceived) == 0 and packetID >= int(simtime/msecInterval):
-            dataReceived = [-3]*numJoints  # error code in case missing last packet
-            dataReceived2 = [0]*numMuscles
-            if verbose:
-                print("last packet: returning -3 to prevent error")
+    # I/O stats: time since send, time blocked in receive, and CPU used while blocked
+    msmStats['packets'] += 1
+    if sendTimes:
+        msmStats['latency'].append(time() - sendTimes.pop(0))
+    msmStats['wait'].append(time() - waitStart)
+    msmStats['waitCpu'] += process_time() - cpuStart
 
+    if dataReceived == []:
+        dataReceived = [-3]*numJoints  # error code in case missing last packet
+        if verbose:
+            print("last packet: returning -3 to prevent error")
     if dataReceived2 == []: dataReceived2 = [0]*numMuscles # if last message read and dataReceived2 empty, fill with 0s
 
     # store data in array required to plot msm graphs (armGraphs.py)
@@ -356,6 +442,126 @@ def sendAndReceiveDataPackets(simtime, msecInterval, data1, data2, data3, data4)
 
     return dataReceived
 
+# Block until the msm prints its ready message (any output preceding it is discarded)
+def waitArmReady(timeout):
+    global armReady
+    global rxStart
+    deadline = time() + timeout
+    while not armReady:
+        i = rxBuffer.find(b'READY TO RUN\n', rxStart, rxEnd)
+        if i >= 0:
+            if verbose:
+                print(bytes(rxBuffer[rxStart:i]).decode(errors='replace'))
+            rxStart = i + len(b'READY TO RUN\n')
+            armReady = 1
+        elif time() >= deadline:
+            print("msarm not ready after %.0f s" % (timeout))
+            break
+        elif fillBuffer(deadline - time()) < 0:
+            print("msarm exited before being ready")
+            break
+
+# Read available data from msm pipe into the preallocated buffer; blocks up to timeout; returns num bytes read (0 = timeout, -1 = pipe closed)
+def fillBuffer(timeout):
+    global rxStart
+    global rxEnd
+    ready, _, _ = select.select([msmStdout], [], [], max(timeout, 0.0))
+    if not ready:
+        return 0
+    if rxEnd > len(rxBuffer) - 4096: # move unread data to start of buffer
+        unread = rxEnd - rxStart
+        if unread > len(rxBuffer) - 4096: # buffer full of unparsable data: drop it
+            unread = 0
+            rxStart = rxEnd
+        rxBuffer[:unread] = rxBuffer[rxStart:rxEnd]
+        rxStart = 0
+        rxEnd = unread
+    n = msmStdout.readinto(rxView[rxEnd:])
+    msmStats['reads'] += 1
+    if not n:
+        return -1
+    rxEnd += n
+    return n
+
+# Return next complete binary frame in buffer as [type, packetID, simtime, values], or None if incomplete
+def readBinaryFrame():
+    global rxStart
+    while rxEnd - rxStart >= msmHeader.size:
+        magic, frameType, count, framePacketID, frameTime = msmHeader.unpack_from(rxBuffer, rxStart)
+        if magic != msmMagic or count > numMuscles: # out of sync (eg. text output at end of msm run): skip to next magic
+            i = rxBuffer.find(msmMagicBytes, rxStart+1, rxEnd)
+            rxStart = i if i >= 0 else rxEnd - len(msmMagicBytes) + 1
+            continue
+        frameEnd = rxStart + msmHeader.size + 8*count
+        if frameEnd > rxEnd:
+            return None
+        values = numpy.frombuffer(rxBuffer, numpy.float64, count, rxStart + msmHeader.size).tolist()
+        rxStart = frameEnd
+        return [frameType, framePacketID, frameTime, values]
+    return None
+
+# Return next complete text line in buffer, or None if incomplete
+def readTextLine():
+    global rxStart
+    i = rxBuffer.find(b'\n', rxStart, rxEnd)
+    if i < 0:
+        return None
+    line = bytes(rxBuffer[rxStart:i]).decode(errors='replace')
+    rxStart = i + 1
+    return line
+
+# Stop current MSM run and wait until it is finished (output files closed); MSM then waits for RESET/EXIT
+def msmStopRun():
+    global rxStart
+    try:
+        if msmProtocol == 'binary':
+            os.write(msmStdin, msmHeader.pack(msmMagic, MSM_STOP, 0, packetID, 0.0))
+        else:
+            os.write(msmStdin, b"STOP\n")
+    except OSError: # MSM already exited
+        msmShutdown()
+        return
+    deadline = time() + msmStopTimeout
+    while time() < deadline:
+        i = rxBuffer.find(b'DONE\n', rxStart, rxEnd)
+        if i >= 0:
+            rxStart = i + len(b'DONE\n')
+            return
+        if fillBuffer(deadline - time()) < 0:
+            break
+    print("msarm did not finish run; it will be restarted")
+    msmShutdown()
+
+# Terminate MSM process (registered to run at exit)
+def msmShutdown():
+    global msmPipe
+    if msmPipe is None:
+        return
+    if msmPipe.poll() is None:
+        try:
+            os.write(msmStdin, b"\nEXIT\n") # exits if waiting for a command
+            msmPipe.wait(1.0)
+        except (OSError, subprocess.TimeoutExpired):
+            try:
+                os.killpg(msmPipe.pid, signal.SIGTERM)
+            except OSError:
+                pass
+            msmPipe.wait()
+    msmPipe.stdin.close()
+    msmPipe.stdout.close()
+    msmPipe = None
+
+atexit.register(msmShutdown)
+
+# Print arm I/O stats: reply latency after send, time blocked waiting (idle), and CPU used while blocked
+def printStats():
+    if not msmStats['packets']:
+        return
+    latency = numpy.array(msmStats['latency'])*1000
+    wait = numpy.array(msmStats['wait'])*1000
+    print('  Arm I/O: %d packets (%d timeouts); reply latency: mean=%.3f ms, p99=%.3f ms; blocked waiting: total=%.1f ms, CPU while blocked=%.1f%%' % \
+        (msmStats['packets'], msmStats['timeouts'], latency.mean(), numpy.percentile(latency, 99), wait.sum(), 100*msmStats['waitCpu']/max(wait.sum()/1000, 1e-9)))
+
 # Function to close sockets, save data and plot graphs
 def closeSavePlot(secLength, msecInterval, filestem=''):
     global saveDataMuscles
@@ -371,12 +577,16 @@ def closeSavePlot(secLength, msecInterval, filestem=''):
 
 
     # delete temporal copy of xml and osim files
-    rm_str = 'rm %s %s' % (xmlFile, osimFile)
-    os.system(rm_str)
+    msmRemoveFiles([xmlFile, osimFile])
 
-    # close msm pipe
+    printStats()
+
+    # close msm pipe (persistent mode: only stop current run, process is reused by next setup)
     if msmRun:
-        os.killpg(msmPipe.pid, signal.SIGTERM)
+        if msmPersistent:
+            msmStopRun()
+        else:
+            msmShutdown()
 
     if verbose:
         print("Sockets closed")
@@ -397,7 +607,7 @@ def closeSavePlot(secLength, msecInterval, filestem=''):
         msmFolder = '' # data files saved locally
 #               # Read data from .pnt files
         jointPosSeq,musExcSeq, musActSeq, musForcesSeq = armGraphs.readPntFiles(msmFolder, pntFile, secLength, msecInterval)
-        with open("%s-muscles.p"%(filestem),'w') as f:
+        with open("%s-muscles.p"%(filestem),'wb') as f:
             pickle.dump([musExcSeq, musActSeq, musForcesSeq], f)
 
 
@@ -408,11 +618,10 @@ def closeSavePlot(secLength, msecInterval, filestem=''):
         armAnimation = 0# msmGraphs #set func argument to show arm animation
         timeRange = [0.1, secLength]
         msmFolder = '' # data files saved locally
-        armGraphs.readAndPlot(jointAnglesSeq, musLengthsSeq, msmFolder, armAnimation, saveGraphs, saveName, timeRange, msecInterval)
+        armGraphs.readAndPlot(jointAnglesSeq, musLengthsSeq, msmFolder, armAnimation, saveGraphs, saveName, timeRange, msecInterval, pntFile)
 
     # delete temporal pnt file
-    rm_str = 'rm %s' % (pntFile)
-    os.system(rm_str)
+    msmRemoveFiles([pntFile])
 
 # Time function
 def getCurrTime():
@@ -433,91 +642,53 @@ def getPacketLoss():
     else:
         return 0
 
-# Function to set joint angles by modifying the XML .osim file- also runs the MSM program in pipe
-def msmSetJointAnglesXML(shAng,elAng):
-    global simtime
-    global msmCommand
-
-    # read .osim file
-    tree = ET.parse(osimFile)
-    root = tree.getroot()
-
-    # set shoulder angle initial value
-    for shoulder_flex_tag in root.iter('Coordinate'):
-        if shoulder_flex_tag.get('name') == 'arm_flex':
-            break
-
-    init_shoulder_tag = shoulder_flex_tag.find('initial_value')
-    init_shoulder_tag.text = str(shAng);
-
-    # set elbow angle initial value
-    for elbow_flex_tag in root.iter('Coordinate'):
-        if elbow_flex_tag.get('name') == 'elbow_flex':
-            break
-
-    init_elbow_tag = elbow_flex_tag.find('initial_value')
-    init_elbow_tag.text = str(elAng);
-
-    # save xml file
-    tree.write(osimFile)
-
-def msmSetOsimFileName(xmlFile, osimTemp):
-    # read .osim file
-
-    tree = ET.parse(xmlFile)
-    root = tree.getroot()
-
+# Load .xml/.osim file as ElementTree; each original file is parsed only once and cached
+def msmLoadTemplate(fileName):
+    if fileName not in msmTemplates:
+        msmTemplates[fileName] = ET.parse(fileName)
+    return msmTemplates[fileName]
+
+# Remove temporary files (ignore missing files)
+def msmRemoveFiles(fileNames):
+    for fileName in fileNames:
+        try:
+            os.remove(fileName)
+        except OSError:
+            if verbose:
+                print("could not remove " + fileName)
+
+# Function to set joint angles in the .osim tree
+def msmSetJointAnglesXML(root, shAng, elAng):
+    # set shoulder and elbow angle initial values
+    for coordinate_tag in root.iter('Coordinate'):
+        if coordinate_tag.get('name') == 'arm_flex':
+            coordinate_tag.find('initial_value').text = str(shAng)
+        elif coordinate_tag.get('name') == 'elbow_flex':
+            coordinate_tag.find('initial_value').text = str(elAng)
+
+def msmSetOsimFileName(root, osimTemp):
     # set osim file name
     for tmp in root.iter('OsimFile'):
         tmp.set('name', osimTemp)
 
-    # save xml file
-    tree.write(xmlFile)
-
-def msmSetPntFileName(xmlFile, pntFile):
-    # read .osim file
-
-    tree = ET.parse(xmlFile)
-    root = tree.getroot()
-
-    # set osim file name
+def msmSetPntFileName(root, pntFile):
+    # set pnt file name
     for tmp in root.iter('PntOutput'):
         tmp.set('name', pntFile)
         break # exit after first appearance
 
-    # save xml file
-    tree.write(xmlFile)
-
-# set duration of arm sim in .xml file
-def msmSetDurationXML(secLength, xmlFile):
-    # read .osim file
-    tree = ET.parse(xmlFile)
-    root = tree.getroot()
-
+# set duration of arm sim in .xml tree
+def msmSetDurationXML(root, secLength):
     # set end time
     endTime = root.find('EndTime')
     endTime.text = str(secLength)
 
-    # save xml file
-    tree.write(xmlFile)
-
-def msmSetDampingXML(damping):
-    # read .osim file
-    tree = ET.parse(osimFile)
-    root = tree.getroot()
-
+def msmSetDampingXML(root, damping):
     # set damping value
     for damping_tag in root.iter('damping'):
         damping_tag.text = str(damping)
 
-    # save xml file
-    tree.write(osimFile)
-
-def msmSetTargetPositionXML(targetx, targety):
-    # read .osim file
-    tree = ET.parse(osimFile)
-    root = tree.getroot()
-
+def msmSetTargetPositionXML(root, targetx, targety):
     for Body_tag in root.iter('Body'):
         if Body_tag.get('name') == 'ground':
             break
@@ -529,26 +700,20 @@ def msmSetTargetPositionXML(targetx, targety):
 
     transform_tag.text = str(0)+' '+str(0)+' '+str(0)+' '+str(-targetx-0.06)+' '+str(-0.05)+' '+str(-targety+0.09) # y postive = x-axis right
 
-    # save xml file
-    tree.write(osimFile)
-
-
-def msmSetMaxIsometricForceXML(muscleName, value):
-    # read .osim file
-    tree = ET.parse(osimFile)
-    root = tree.getroot()
-
-    # set shoulder angle initial value
+# set max isometric force of muscles in .osim tree (muscleForces = dict muscle name -> value)
+def msmSetMaxIsometricForceXML(root, muscleForces):
     for muscle_tag in root.iter('Schutte1993Muscle'):
-        if muscle_tag.get('name') == muscleName:
-            break
-
-    muscleForce_tag = muscle_tag.find('max_isometric_force')
-    #print muscleForce_tag.text
-    muscleForce_tag.text = str(value);
-
-    # save xml file
-    tree.write(osimFile)
+        if muscle_tag.get('name') in muscleForces:
+            muscle_tag.find('max_isometric_force').text = str(muscleForces[muscle_tag.get('name')])
+
+# set pipe protocol ('text' or 'binary') of all msm event handlers in .xml tree
+def msmSetProtocolXML(root, protocol):
+    for handlers_tag in root.iter('EventHandlers'):
+        for handler_tag in handlers_tag:
+            protocol_tag = handler_tag.find('Protocol')
+            if protocol_tag is None:
+                protocol_tag = ET.SubElement(handler_tag, 'Protocol')
+            protocol_tag.text = protocol
 
 def saveEMG():
     global saveDataMuscles
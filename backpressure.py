@@ -0,0 +1,158 @@
+"""
+backpressure.py
+
+Backpressure and drop policy (dropOldest, coalesce, block) of the queue between the server worker and NEURON
+"""
+
+import time
+from queue import Full
+from collections import deque
+
+# policies when the data is ahead of the simulation by more than maxLag
+DROP_OLDEST = 'dropOldest' # queue the new item, discard the oldest queued ones (also when the queue is full)
+COALESCE = 'coalesce' # merge the new items into one held item until the simulation catches up
+BLOCK = 'block' # wait until the simulation catches up
+
+
+class Backpressure:
+    # queue: bounded queue (ringbuffer.SpscRing); simTime: function returning the current simulation time (ms)
+    # itemSpikes: function returning the number of spikes in an item; coalesce: function(pending item, new item) returning merged item
+    def __init__(self, queue, simTime, policy=DROP_OLDEST, maxLag=1000e3, itemSpikes=None, coalesce=None, wait=100e-6):
+        if policy not in (DROP_OLDEST, COALESCE, BLOCK):
+            raise ValueError('Wrong backpressure policy: %s' % policy)
+        self.queue = queue
+        self.simTime = simTime
+        self.policy = policy
+        self.maxLag = maxLag # (ms)
+        self.itemSpikes = itemSpikes if itemSpikes else (lambda item: 0)
+        self.coalesce = coalesce
+        self.wait = wait # polling interval when blocked (s)
+        self.pending = None # coalesced item not queued yet
+        self.pendingTime = 0.0 # data time of the pending item (ms)
+        self.queued = deque() # (wall time, spikes) of items in the queue, oldest first
+        self.currSimTime = 0.0 # (ms)
+        self.simLag = 0.0 # data time - simulation time of last item (ms)
+        self.wallLag = 0.0 # age of oldest queued item (s)
+        self.maxSimLag = 0.0
+        self.maxWallLag = 0.0
+        self.itemsPut = 0
+        self.itemsDropped = 0
+        self.itemsCoalesced = 0
+        self.spikesPut = 0
+        self.spikesDropped = 0
+        self.spikesLate = 0
+        self.blockedTime = 0.0 # (s)
+
+    # forget items the consumer already got, update wall lag, and queue the pending item if the simulation caught up
+    def sync(self):
+        qsize = self.queue.qsize()
+        while len(self.queued) > qsize:
+            self.queued.popleft()
+        if self.pending is not None and (qsize == 0 or self.pendingTime - self.simTime() <= self.maxLag):
+            if self.releasePending(False):
+                qsize += 1
+        self.wallLag = time.time() - self.queued[0][0] if self.queued else 0.0
+        self.maxWallLag = max(self.maxWallLag, self.wallLag)
+        return qsize
+
+    # update simulated time lag for an item with data up to itemTime (ms); returns 1 if the simulation is lagging
+    def updateLag(self, itemTime):
+        self.currSimTime = self.simTime()
+        self.simLag = itemTime - self.currSimTime
+        self.maxSimLag = max(self.maxSimLag, self.simLag)
+        return self.simLag > self.maxLag
+
+    def enqueue(self, item, block=True, timeout=None):
+        spikes = self.itemSpikes(item)
+        self.queue.put(item, block, timeout)
+        self.queued.append((time.time(), spikes))
+        self.itemsPut += 1
+        self.spikesPut += spikes
+
+    # True if a put of an item with data up to itemTime (ms) would wait now (block policy while lagging, or queue full):
+    # for producers that must not block (aioserver), which wait and try again
+    def wouldBlock(self, itemTime):
+        qsize = self.sync()
+        if self.policy == BLOCK and qsize > 0 and itemTime - self.simTime() > self.maxLag:
+            return True
+        return self.policy != DROP_OLDEST and qsize >= getattr(self.queue, 'capacity', float('inf'))
+
+    # queue the pending item (raises Full if not block or timeout); returns True if it was queued
+    def releasePending(self, block=True, timeout=None):
+        try:
+            self.enqueue(self.pending, block, timeout)
+        except Full:
+            return False
+        self.pending = None
+        return True
+
+    # end of the stream: queue the pending item, waiting at most timeout s for a free slot; otherwise it is dropped (counted)
+    def flush(self, timeout=1.0):
+        if self.pending is not None and not self.releasePending(True, timeout):
+            self.itemsDropped += 1
+            self.spikesDropped += self.itemSpikes(self.pending)
+            self.pending = None
+
+    # discard the oldest queued item (claimed from the consumer: never both got and dropped); returns False if there was none
+    def dropOldest(self):
+        item = self.queue.discardOldest()
+        if item is None:
+            return False
+        self.itemsDropped += 1
+        self.spikesDropped += self.itemSpikes(item)
+        return True
+
+    # queue item with data up to itemTime (ms); spikeTimes (ms) are used to count late spikes (default: all spikes at itemTime)
+    def put(self, item, itemTime, spikeTimes=None):
+        lagging = self.updateLag(itemTime)
+        if spikeTimes is None:
+            self.spikesLate += self.itemSpikes(item) if itemTime < self.currSimTime else 0
+        else:
+            self.spikesLate += sum(1 for t in spikeTimes if t < self.currSimTime)
+        qsize = self.sync()
+
+        if self.policy == DROP_OLDEST:
+            while qsize >= getattr(self.queue, 'capacity', float('inf')) and self.dropOldest(): # full (consumer stalled): make room
+                qsize -= 1
+            self.enqueue(item)
+            qsize += 1
+            while qsize > 1 and lagging: # simulation is slow: keep only the newest item
+                if not self.dropOldest(): # consumer got the items meanwhile
+                    break
+                qsize -= 1
+                lagging = self.updateLag(itemTime)
+            self.sync()
+
+        elif self.policy == COALESCE:
+            if self.pending is not None: # merge with held item
+                spikes = self.itemSpikes(self.pending) + self.itemSpikes(item)
+                item = self.coalesce(self.pending, item)
+                self.spikesDropped += spikes - self.itemSpikes(item) # spikes that didn't fit in the merged item (if any)
+                self.itemsCoalesced += 1
+                self.pending = None
+            if lagging and qsize > 0: # simulation is slow and has items to process: hold item
+                self.pending = list(item)
+                self.pendingTime = itemTime
+            else:
+                self.enqueue(item)
+
+        else: # BLOCK
+            start = time.time()
+            while lagging and self.sync() > 0: # wait for the simulation to catch up
+                time.sleep(self.wait)
+                lagging = self.updateLag(itemTime)
+            self.blockedTime += time.time() - start
+            self.enqueue(item)
+
+    def stats(self):
+        self.sync()
+        return {'policy': self.policy, 'itemsPut': self.itemsPut, 'itemsDropped': self.itemsDropped, 'itemsCoalesced': self.itemsCoalesced,
+                'spikesPut': self.spikesPut, 'spikesDropped': self.spikesDropped, 'spikesLate': self.spikesLate, 'simLag': self.simLag,
+                'maxSimLag': self.maxSimLag, 'wallLag': self.wallLag, 'maxWallLag': self.maxWallLag, 'blockedTime': self.blockedTime}
+
+    def report(self):
+        st = self.stats()
+        return ('[backpressure %s] items: %d queued, %d dropped, %d coalesced; spikes: %d queued, %d dropped, %d late; '
+                'lag: %.1f ms sim (max %.1f), %.1f ms wall (max %.1f); blocked %.3f s') % (st['policy'], st['itemsPut'], st['itemsDropped'],
+                st['itemsCoalesced'], st['spikesPut'], st['spikesDropped'], st['spikesLate'], st['simLag'], st['maxSimLag'],
+                st['wallLag']*1e3, st['maxWallLag']*1e3, st['blockedTime'])
@@ -0,0 +1,116 @@
+"""
+latency.py
+
+In-process log-bucketed latency histograms of the server path stages
+(receive, filter, bin, enqueue, dequeue, inject), exported to local tsv files
+"""
+
+import os
+import time
+
+STAGES = ('receive', 'filter', 'bin', 'enqueue', 'dequeue', 'inject')
+[RECEIVE, FILTER, BIN, ENQUEUE, DEQUEUE, INJECT] = range(len(STAGES))
+SUB_BITS = 2 # 2**SUB_BITS buckets per power of 2 (< 25% bucket width)
+NUM_BUCKETS = 64 << SUB_BITS
+LINEAR = 2 << SUB_BITS # durations below this (ns) have one bucket each
+
+now = time.perf_counter_ns # CLOCK_MONOTONIC: comparable across processes (dequeue stage)
+
+
+# bucket of a duration (ns): top SUB_BITS bits after the leading one, within its power of 2
+def bucketIndex(ns):
+    if ns < LINEAR:
+        return max(ns, 0)
+    bl = ns.bit_length()
+    return (bl << SUB_BITS) | ((ns >> (bl - SUB_BITS - 1)) & ((1 << SUB_BITS) - 1))
+
+
+# upper bound (ns) of the durations in a bucket
+def bucketUpper(index):
+    if index < LINEAR:
+        return index
+    bl = index >> SUB_BITS
+    sub = index & ((1 << SUB_BITS) - 1)
+    return ((((1 << SUB_BITS) | sub) + 1) << (bl - SUB_BITS - 1)) - 1
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.num = 0
+        self.total = 0 # (ns)
+        self.max = 0 # (ns)
+
+    def add(self, ns):
+        self.counts[bucketIndex(ns)] += 1
+        self.num += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    # duration (ns) below which a fraction q of the samples are (upper bound of the bucket, at most max)
+    def percentile(self, q):
+        if self.num == 0:
+            return 0
+        rank = q * self.num
+        cum = 0
+        for index in range(NUM_BUCKETS):
+            cum += self.counts[index]
+            if cum >= rank:
+                return min(bucketUpper(index), self.max)
+        return self.max
+
+    # count, mean, p50, p99, max (us)
+    def stats(self):
+        return (self.num, self.total / max(self.num, 1) * 1e-3, self.percentile(0.5) * 1e-3, self.percentile(0.99) * 1e-3, self.max * 1e-3)
+
+
+class LatencyRecorder:
+    # fileName: tsv file the stats are appended to every interval seconds (None: no export)
+    def __init__(self, fileName=None, interval=10.0, stages=STAGES):
+        self.fileName = fileName
+        self.interval = int(interval * 1e9) # (ns)
+        self.stages = stages
+        self.hists = [LatencyHistogram() for stage in stages]
+        self.start = now()
+        self.nextExport = self.start + self.interval if fileName else float('inf')
+
+    # add the duration from start (perf_counter_ns) to now to the histogram of stage; returns now (start of the next stage)
+    def record(self, stage, start):
+        t = now()
+        ns = t - start
+        hist = self.hists[stage]
+        if ns < LINEAR:
+            hist.counts[max(ns, 0)] += 1
+        else:
+            bl = ns.bit_length()
+            hist.counts[(bl << SUB_BITS) | ((ns >> (bl - SUB_BITS - 1)) & ((1 << SUB_BITS) - 1))] += 1
+        hist.num += 1
+        hist.total += ns
+        if ns > hist.max:
+            hist.max = ns
+        if t >= self.nextExport:
+            self.export()
+        return t
+
+    # append a snapshot of the stages with samples to the file
+    def export(self):
+        t = now()
+        if not self.fileName:
+            self.nextExport = float('inf')
+            return
+        self.nextExport = t + self.interval
+        newFile = not os.path.exists(self.fileName)
+        with open(self.fileName, 'a') as f:
+            if newFile:
+                f.write('time (s)\tstage\tcount\tmean (us)\tp50 (us)\tp99 (us)\tmax (us)\n')
+            for stage, hist in zip(self.stages, self.hists):
+                if hist.num:
+                    f.write('%.3f\t%s\t%d\t%.2f\t%.2f\t%.2f\t%.2f\n' % (((t - self.start) * 1e-9, stage) + hist.stats()))
+
+    def report(self):
+        lines = ['[latency] %-8s %10s %10s %10s %10s %10s' % ('stage', 'count', 'mean(us)', 'p50(us)', 'p99(us)', 'max(us)')]
+        for stage, hist in zip(self.stages, self.hists):
+            if hist.num:
+                lines.append('[latency] %-8s %10d %10.2f %10.2f %10.2f %10.2f' % ((stage,) + hist.stats()))
+        return '\n'.join(lines)
@@ -39,5 +39,6 @@ import network
 
 network.runTrainTest2targets()
 #network.runTrainTest2targetsOptim()
+#network.runCompareArmFeedbackDelay() # serial vs pipelined arm coupling
 
 #from pylab import show; show()  # needed for hpc batch sims
@@ -1,4 +1,5 @@
 #include "CoordinateOutputEventHandler.h"
+#include "MsmPacket.h"
 
 #include <Multibody/MultibodyDyna.h> 
 
@@ -7,12 +8,14 @@
 #include <stdio.h>
 #include <fcntl.h>      /* To change socket to nonblocking mode */
 #include <arpa/inet.h>  /* For inet_pton() */
+#include <algorithm>
 
 FILE_STATIC_CALLHACK(CoordinateOutputEventHandler);
 
 namespace mf_mbd
 {
 	bool verboseSend = 0;
+	bool binaryCoords = 0; // send joint angles as binary packets (see MsmPacket.h) instead of text lines
 	//double shoulderAngInput;
 	//double elbowAngInput;
 	
@@ -49,12 +52,22 @@ namespace mf_mbd
 
 		//std::cout << currTime << " ";
 
-		for(int n = 0; n < _coords.size(); ++n) {
-			Coordinate& cd = *_coords[n];
-			std::cout << " " <<  cd.getQ();// << "\t" << cd.getQd() << "\t" << cd.getQdd(); //velocity and acceleration of coordinate
+		if (binaryCoords) {
+			double coords[8];
+			int numCoords = std::min(int(_coords.size()), 8);
+			for(int n = 0; n < numCoords; ++n) {
+				coords[n] = _coords[n]->getQ();
+			}
+			msmWritePacket(MSM_COORDS, coords, numCoords, currTime*1000.0);
+		}
+		else {
+			for(int n = 0; n < _coords.size(); ++n) {
+				Coordinate& cd = *_coords[n];
+				std::cout << " " <<  cd.getQ();// << "\t" << cd.getQd() << "\t" << cd.getQdd(); //velocity and acceleration of coordinate
+			}
+
+			std::cout << std::endl;
 		}
-		
-		std::cout << std::endl;
 		
 		// send packets
 		if (verboseSend) {
@@ -82,6 +95,13 @@ namespace mf_mbd
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Interval");
 		double interval = XMLDOM::getValueAsType<double>(tmpNode);
 		this->setEventInterval(interval);
+
+		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Protocol");
+		if(tmpNode) {
+			std::string protocol = XMLDOM::getTextAsStdStringAndTrim(tmpNode);
+			boost::to_lower(protocol);
+			binaryCoords = (protocol == "binary");
+		}
 		
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"PntOutput");
 		if(tmpNode) {
@@ -0,0 +1,70 @@
+// MsmPacket.h -- binary framing for the pipe interface with the NEURON model (arminterface.py)
+//
+// Each packet = fixed-size header + 'count' float64 values (little-endian, no padding).
+// Must match msmHeader / msmMagic / MSM_* in arminterface.py
+// Selected per event handler with <Protocol>binary</Protocol> in the xml file (default: text lines)
+
+#ifndef MSM_PACKET_H
+#define MSM_PACKET_H
+
+#include <stdint.h>
+#include <cstring>
+#include <iostream>
+
+namespace mf_mbd
+{
+	static const uint32_t MSM_MAGIC = 0x314D534D; // "MSM1"
+
+	enum MsmPacketType {
+		MSM_EXC = 1,     // muscle excitations (NEURON -> msarm)
+		MSM_COORDS = 2,  // joint angles (msarm -> NEURON)
+		MSM_LENGTHS = 3, // muscle lengths (msarm -> NEURON)
+		MSM_STOP = 4     // stop current run (NEURON -> msarm), no values
+	};
+
+	// thrown from event handlers to end the current run early (caught in main)
+	struct MsmStop {};
+
+#pragma pack(push, 1)
+	struct MsmHeader {
+		uint32_t magic;
+		uint16_t type;
+		uint16_t count;    // number of float64 values following the header
+		uint32_t packetID; // ID of last excitation packet received (echoed back to NEURON)
+		double simTime;    // arm sim time (ms)
+	};
+#pragma pack(pop)
+
+	// ID of last excitation packet received (defined in MuscleExcitationSetterEventHandler_pipe.cpp)
+	extern uint32_t msmLastPacketID;
+
+	// write one packet to stdout
+	inline void msmWritePacket(uint16_t type, const double* values, uint16_t count, double simTime)
+	{
+		MsmHeader hdr;
+		hdr.magic = MSM_MAGIC;
+		hdr.type = type;
+		hdr.count = count;
+		hdr.packetID = msmLastPacketID;
+		hdr.simTime = simTime;
+		std::cout.write(reinterpret_cast<const char*>(&hdr), sizeof(hdr));
+		std::cout.write(reinterpret_cast<const char*>(values), count * sizeof(double));
+		std::cout.flush();
+	}
+
+	// read one packet from stdin (resyncs on magic); returns false if pipe closed or packet too long
+	inline bool msmReadPacket(MsmHeader& hdr, double* values, uint16_t maxCount)
+	{
+		char* p = reinterpret_cast<char*>(&hdr);
+		if(!std::cin.read(p, sizeof(hdr))) return false;
+		while(hdr.magic != MSM_MAGIC) { // slide one byte at a time until header aligned
+			memmove(p, p + 1, sizeof(hdr) - 1);
+			if(!std::cin.read(p + sizeof(hdr) - 1, 1)) return false;
+		}
+		if(hdr.count > maxCount) return false;
+		return bool(std::cin.read(reinterpret_cast<char*>(values), hdr.count * sizeof(double)));
+	}
+
+} //end namespace
+
+#endif
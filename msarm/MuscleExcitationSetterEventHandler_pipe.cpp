@@ -1,4 +1,5 @@
 #include "MuscleExcitationSetterEventHandler.h"
+#include "MsmPacket.h"
 
 #include <Multibody/MultibodyDyna.h>
 
@@ -20,6 +21,8 @@ namespace mf_mbd
 	double musclesExc[4] = {0.0,0.0,0.0,0.0};
 	static const int SIZE_OF_MSG_IN = 4 * sizeof(double);
 	bool verboseReceive = 0;
+	bool binaryExc = 0; // receive muscle excitations as binary packets (see MsmPacket.h) instead of text lines
+	uint32_t msmLastPacketID = 0;
 	
 	InitFactoryStaticMembersMacro(MuscleExcitationSetterEventHandler, PeriodicEventHandler);
 
@@ -53,20 +56,43 @@ namespace mf_mbd
 			return false;
 		PeriodicEventHandler::_setHandledTime(currTime);
 
-		string input;
-		std::getline(std::cin, input);	
-		std::string::size_type sz;     // alias of size_t
-		std::vector<std::string> strs;
-		
-		if (input.size() > 0) {
-			boost::split(strs, input, boost::is_any_of("\t "));
-			
-			for (int i = 0; i < strs.size(); i++) {
-				musclesExc[i] = double(std::atof(strs[i].c_str()));
+		if (binaryExc) {
+			MsmHeader hdr;
+			double values[4];
+			bool received = msmReadPacket(hdr, values, 4);
+			if (received && hdr.type == MSM_STOP) {
+				throw MsmStop(); // NEURON finished this run
 			}
-		} else {
-			for (int i = 0; i < strs.size(); i++) {
-				musclesExc[i] = 0.0;
+			if (received && hdr.type == MSM_EXC) {
+				for (int i = 0; i < hdr.count; i++) {
+					musclesExc[i] = values[i];
+				}
+				msmLastPacketID = hdr.packetID;
+			} else {
+				for (int i = 0; i < 4; i++) {
+					musclesExc[i] = 0.0;
+				}
+			}
+		}
+		else {
+			string input;
+			std::getline(std::cin, input);	
+			if (input == "STOP") {
+				throw MsmStop(); // NEURON finished this run
+			}
+			std::string::size_type sz;     // alias of size_t
+			std::vector<std::string> strs;
+			
+			if (input.size() > 0) {
+				boost::split(strs, input, boost::is_any_of("\t "));
+				
+				for (int i = 0; i < strs.size(); i++) {
+					musclesExc[i] = double(std::atof(strs[i].c_str()));
+				}
+			} else {
+				for (int i = 0; i < strs.size(); i++) {
+					musclesExc[i] = 0.0;
+				}
 			}
 		}
 		
@@ -134,6 +160,13 @@ namespace mf_mbd
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Interval");
 		double interval = XMLDOM::getValueAsType<double>(tmpNode);
 		this->setEventInterval(interval);
+
+		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Protocol");
+		if(tmpNode) {
+			std::string protocol = XMLDOM::getTextAsStdStringAndTrim(tmpNode);
+			boost::to_lower(protocol);
+			binaryExc = (protocol == "binary");
+		}
 	
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"LOAMuscleForceSubsystem");
 		CHK_ERR(tmpNode, "Can not find LOAMuscleForceSubsystem node");
@@ -1,4 +1,5 @@
 #include "MuscleStatusEventHandler.h"
+#include "MsmPacket.h"
 
 #include <Multibody/MultibodyDyna.h> 
 
@@ -15,6 +16,7 @@ namespace mf_mbd
 	const int numMuscles = 18;
 	double muscleLengths[numMuscles] = {0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0};
 	bool verboseSend2 = 0;
+	bool binaryLengths = 0; // send muscle lengths as binary packets (see MsmPacket.h) instead of text lines
 	
 	InitFactoryStaticMembersMacro(MuscleStatusEventHandler, PeriodicEventHandler);
 
@@ -115,10 +117,15 @@ namespace mf_mbd
 		}
 
 		// send packets
-		for(int m = 0; m < numMuscles; ++m) {
-			std::cout << muscleLengths[m] << "  ";
+		if (binaryLengths) {
+			msmWritePacket(MSM_LENGTHS, muscleLengths, numMuscles, currTime*1000.0);
+		}
+		else {
+			for(int m = 0; m < numMuscles; ++m) {
+				std::cout << muscleLengths[m] << "  ";
+			}
+			std::cout << std::endl;
 		}
-		std::cout << std::endl;
 		
 		if (verboseSend2) {
 			printf("\nSent muscle lengths to stdout\n");
@@ -144,6 +151,13 @@ namespace mf_mbd
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Interval");
 		double interval = XMLDOM::getValueAsType<double>(tmpNode);
 		this->setEventInterval(interval);
+
+		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"Protocol");
+		if(tmpNode) {
+			std::string protocol = XMLDOM::getTextAsStdStringAndTrim(tmpNode);
+			boost::to_lower(protocol);
+			binaryLengths = (protocol == "binary");
+		}
 	
 		tmpNode = XMLDOM::getFirstChildElementByTagName(node,"LOAMuscleForceSubsystem");
 		CHK_ERR(tmpNode, "Can not find LOAMuscleForceSubsystem node");
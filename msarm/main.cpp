@@ -13,6 +13,8 @@
 
 #include <FileIO/ControlledMbdSimulation.h>
 
+#include "MsmPacket.h"
+
 
 #ifdef STATIC_CALLHACK
 	Extern_Static_Call_Hack(CoordinateOutputEventHandler);
@@ -33,18 +35,48 @@ int testFwdDynXML(int argc, char** argv)
 		}
 
 		std::string filename(argv[1]);
-		
-		ControlledMbdSimulation sim;
-		//MbdSimulation sim;
-
-		// read xml file
-		sim.readFromFile(filename);
-
-		sim.initBeforeRun();
 
-		std::cout << "READY TO RUN" << std::endl;
-
-		sim.run();
+		// server mode: after each run wait for "RESET <xml file>" (run again with new params) or "EXIT" on stdin
+		bool server = (argc > 2 && std::string(argv[2]) == "--server");
+
+		while(true) {
+			{
+				ControlledMbdSimulation sim;
+				//MbdSimulation sim;
+
+				// read xml file
+				sim.readFromFile(filename);
+
+				sim.initBeforeRun();
+
+				std::cout << "READY TO RUN" << std::endl;
+
+				try {
+					sim.run();
+				}
+				catch(MsmStop&) { // run stopped early by NEURON
+				}
+			} // sim destroyed here, so output files are closed
+
+			if(!server) break;
+
+			std::cout << "DONE" << std::endl;
+
+			// wait for next command; skip anything else (eg. excitations sent after the end of the run)
+			bool reset = false;
+			std::string line;
+			while(std::getline(std::cin, line)) {
+				std::string::size_type pos = line.find("RESET ");
+				if(pos != std::string::npos) {
+					filename = line.substr(pos + 6);
+					filename.erase(filename.find_last_not_of(" \t\r") + 1);
+					reset = true;
+					break;
+				}
+				if(line.find("EXIT") != std::string::npos) break;
+			}
+			if(!reset) break;
+		}
 
 	}
 	catch(std::exception& ex) {			//in case there is an error on the sim file, Cobi will stop
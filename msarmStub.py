@@ -0,0 +1,197 @@
+"""
+msarmStub.py
+
+Local stand-in for the musculoskeletal arm executable (msarm/Run), to benchmark and test the
+pipe interface (arminterface.py) without OpenSim/msarm.
+
+Implements the same interface as the msarm pipe event handlers:
+- reads the same .xml (EndTime, event Interval, PntOutput, OsimFile, Protocol) and .osim
+  (initial joint angles, damping, max isometric forces) files
+- prints 'READY TO RUN' when ready
+- every interval: writes 18 muscle lengths, reads 4 muscle excitations, writes 2 joint angles,
+  as text lines or binary frames (msarm/MsmPacket.h)
+- writes the muscle status .pnt file (time + excitation, activation, force for each muscle)
+- stops the run early on a STOP packet/line; with --server, prints 'DONE' after each run and
+  waits for 'RESET <xml file>' (run again) or 'EXIT'
+
+Muscle/joint dynamics are simple: first-order activation, force = activation * max isometric force,
+constant moment arms, decoupled shoulder and elbow joints with damping and joint limits.
+
+Usage: python msarmStub.py [--latency ms] [--jitter ms] xmlFile [--server]
+  --latency: fixed artificial delay added to each packet reply (ms)
+  --jitter: mean of additional exponentially distributed delay (ms)
+"""
+
+import sys
+import os
+import time
+import struct
+import random
+import numpy
+import xml.etree.ElementTree as ET
+
+
+# muscle branches in the order sent to NEURON, and the excitation (0=sh ext, 1=sh flex, 2=el ext, 3=el flex) driving each one (same as MuscleExcitationSetterEventHandler_pipe.cpp)
+muscleNames = ['DELT1', 'DELT2', 'DELT3', 'Infraspinatus', 'Latissimus_dorsi_1', 'Latissimus_dorsi_2', 'Latissimus_dorsi_3', 'Teres_minor', 'PECM1', 'PECM2', 'PECM3', 'Coracobrachialis', 'TRIlong', 'TRIlat', 'TRImed', 'BIClong', 'BICshort', 'BRA']
+muscleExc = numpy.array([1, -1, 0, 0, 0, 0, 0, 0, 1, 1, 1, 1, 2, 2, 2, 3, 3, 3]) # -1 = not excited (DELT2)
+muscleJoint = numpy.array([0]*12 + [1]*6) # 0 = shoulder, 1 = elbow
+muscleSign = numpy.array([1, 1, -1, -1, -1, -1, -1, -1, 1, 1, 1, 1, -1, -1, -1, 1, 1, 1]) # flexor (+) or extensor (-)
+
+momentArm = 0.02 # muscle moment arm (m)
+restLength = 0.1 # muscle length at initial joint angles (m)
+tauAct = 0.010 # activation time constant (s)
+tauDeact = 0.040 # deactivation time constant (s)
+inertia = numpy.array([0.3, 0.06]) # shoulder and elbow moments of inertia (kg m2)
+angLimits = numpy.array([[-0.5, 2.8], [0.0, 2.8]]) # shoulder and elbow joint limits (rad)
+dt = 1e-3 # integration time step (s)
+
+# binary frame format (msarm/MsmPacket.h)
+msmMagic = 0x314D534D
+[MSM_EXC, MSM_COORDS, MSM_LENGTHS, MSM_STOP] = [1, 2, 3, 4]
+msmHeader = struct.Struct('<IHHId')
+
+
+# read simulation params from .xml and .osim files
+def readParams(xmlFile):
+    p = {}
+    root = ET.parse(xmlFile).getroot()
+    p['endTime'] = float(root.find('EndTime').text)
+    handlers = {h.tag: h for h in root.iter() if h.tag.endswith('EventHandler')}
+    p['interval'] = float(handlers['MuscleExcitationSetterEventHandler'].find('Interval').text)
+    for name, key in [('MuscleStatusEventHandler', 'binaryLengths'), ('MuscleExcitationSetterEventHandler', 'binaryExc'), ('CoordinateOutputEventHandler', 'binaryCoords')]:
+        tag = handlers[name].find('Protocol')
+        p[key] = tag is not None and tag.text.strip().lower() == 'binary'
+    p['pntFile'] = handlers['MuscleStatusEventHandler'].find('PntOutput').get('name')
+
+    osimFile = os.path.join(os.path.dirname(xmlFile), next(root.iter('OsimFile')).get('name'))
+    osim = ET.parse(osimFile).getroot()
+    p['startAng'] = numpy.zeros(2)
+    for coord in osim.iter('Coordinate'):
+        if coord.get('name') in ('arm_flex', 'elbow_flex'):
+            p['startAng'][['arm_flex', 'elbow_flex'].index(coord.get('name'))] = float(coord.find('initial_value').text)
+    p['damping'] = float(next(osim.iter('damping')).text)
+    p['maxForce'] = numpy.zeros(len(muscleNames))
+    for muscle in osim.iter('Schutte1993Muscle'):
+        if muscle.get('name') in muscleNames:
+            p['maxForce'][muscleNames.index(muscle.get('name'))] = float(muscle.find('max_isometric_force').text)
+    return p
+
+
+# run arm: handshake, then one packet exchange per interval until EndTime
+def run(xmlFile, latency=0.0, jitter=0.0):
+    p = readParams(xmlFile)
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+    pnt = open(p['pntFile'], 'w')
+
+    ang = p['startAng'].copy()
+    vel = numpy.zeros(2)
+    act = numpy.zeros(len(muscleNames))
+    exc4 = numpy.zeros(4)
+    packetID = 0
+    substeps = max(1, int(round(p['interval']/dt)))
+    numPackets = int(round(p['endTime']/p['interval']))
+    start = time.time()
+
+    stdout.write(b'READY TO RUN\n')
+    stdout.flush()
+
+    for i in range(numPackets):
+        t = (i+1) * p['interval']
+
+        # send muscle lengths
+        lengths = restLength - muscleSign * momentArm * (ang[muscleJoint] - p['startAng'][muscleJoint])
+        if p['binaryLengths']:
+            stdout.write(msmHeader.pack(msmMagic, MSM_LENGTHS, len(lengths), packetID, t*1000.0) + lengths.tobytes())
+        else:
+            stdout.write((' '.join('%g' % x for x in lengths) + '  \n').encode())
+        stdout.flush()
+
+        # read muscle excitations
+        if p['binaryExc']:
+            header = stdin.read(msmHeader.size)
+            if len(header) < msmHeader.size:
+                break
+            magic, frameType, count, packetID, frameTime = msmHeader.unpack(header)
+            values = stdin.read(8*count)
+            if frameType == MSM_STOP:
+                break
+            exc4[:] = struct.unpack('<%dd' % count, values)[:4]
+        else:
+            line = stdin.readline()
+            if not line or line.strip() == b'STOP':
+                break
+            exc4[:] = [float(x) for x in line.replace(b',', b' ').split()[:4]] if line.strip() else 0.0
+        exc = numpy.where(muscleExc >= 0, exc4[muscleExc], 0.0).clip(0, 1)
+
+        # integrate muscle and joint dynamics
+        for istep in range(substeps):
+            tau = numpy.where(exc > act, tauAct, tauDeact)
+            act += dt * (exc - act) / tau
+            force = act * p['maxForce']
+            torque = numpy.bincount(muscleJoint, muscleSign * momentArm * force, minlength=2)
+            vel += dt * (torque - p['damping'] * vel) / inertia
+            ang += dt * vel
+            atLimit = (ang < angLimits[:, 0]) | (ang > angLimits[:, 1])
+            ang = ang.clip(angLimits[:, 0], angLimits[:, 1])
+            vel[atLimit] = 0.0
+
+        # store muscle status (time, exc, act, force for each muscle)
+        pnt.write(' '.join('%g' % x for x in numpy.concatenate(([t], numpy.column_stack((exc, act, force)).flatten()))) + '\n')
+
+        # artificial processing delay
+        if latency or jitter:
+            time.sleep((latency + (random.expovariate(1.0/jitter) if jitter else 0.0)) / 1000.0)
+
+        # send joint angles
+        if p['binaryCoords']:
+            stdout.write(msmHeader.pack(msmMagic, MSM_COORDS, len(ang), packetID, t*1000.0) + ang.tobytes())
+        else:
+            stdout.write((' ' + ' '.join('%g' % x for x in ang) + '\n').encode())
+        stdout.flush()
+
+    pnt.close()
+    stdout.write(('Totoal time: %.3f s\n' % (time.time() - start)).encode())
+    stdout.flush()
+
+
+# server mode: wait for next command; returns new xml file, or None to exit
+def waitCommand():
+    for line in sys.stdin.buffer: # skip anything else (eg. excitations sent after the end of the run)
+        if b'RESET ' in line:
+            return line[line.index(b'RESET ')+6:].strip().decode()
+        if b'EXIT' in line:
+            return None
+    return None
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    latency = 0.0
+    jitter = 0.0
+    server = False
+    xmlFile = None
+    while args:
+        if args[0] == '--latency':
+            latency = float(args[1])
+            args = args[1:]
+        elif args[0] == '--jitter':
+            jitter = float(args[1])
+            args = args[1:]
+        elif args[0] == '--server':
+            server = True
+        else:
+            xmlFile = args[0]
+        args = args[1:]
+    if xmlFile is None:
+        print(__doc__)
+        sys.exit(1)
+    print('msarm stand-in ' + xmlFile)
+    sys.stdout.flush()
+    while xmlFile:
+        run(xmlFile, latency, jitter)
+        if not server:
+            break
+        sys.stdout.buffer.write(b'DONE\n')
+        sys.stdout.flush()
+        xmlFile = waitCommand()
@@ -28,12 +28,15 @@ Version: 2014feb21 by cliffk
 from pylab import seed, rand, sqrt, exp, transpose, ceil, concatenate, array, zeros, ones, vstack, show, disp, mean, inf, concatenate, unique, delete
 from time import time, sleep
 from datetime import datetime
-from scipy.io import savemat, loadmat
+from scipy.io import savemat
 import pickle
+import os
+import traceback
 
 from neuron import h, init, run # Import NEURON
 import shared as s # Import all shared variables and parameters
 import analysis
+import spikestore # PMd trial library (cached pmdData.mat)
 from arm import Arm # Class with arm methods and variables
 
 
@@ -92,7 +95,7 @@ def runTrainTest2targets():
     #saveData()
     plotData()
 
-    # test target 0
+    # test targets 0 and 1
     s.backgroundrate=s.backgroundrateTest # 300
     s.cmdmaxrate=s.cmdmaxrateTest # 15
     addBackground()
@@ -102,44 +105,79 @@ def runTrainTest2targets():
     s.duration = s.testTime # testing time
     s.armMinimalSave = 0 # save only arm related data
 
-    s.targetid = 0
-    setupSim()
-    runSim()
-    finalizeSim()
-    #saveData()
-    plotData()
+    runTestTargets([0, 1], parallel=0, plot=1) # sequential so test graphs are shown interactively
 
-    if s.rank == 0: # save error to file
-        error0 = mean(s.arm.errorAll)
-        print('Target error for target ',s.targetid,' is:', error0)
-        s.arm.plotTraj(s.outfilestem+'_t0.png')
+    ## Wrapping up
+    s.pc.runworker() # MPI: Start simulations running on each host
+    s.pc.done() # MPI: Close MPI
+    totaltime = time()-verystart # See how long it took in total
+    print(('\nDone; total time = %0.1f s.' % totaltime))
+    if (s.plotraster==False and s.plotconn==False and s.plotweightchanges==False): h.quit() # Quit extra processes, or everything if plotting wasn't requested (since assume non-interactive)
+
+
+# train once, then test 2 targets with serial and pipelined arm coupling (s.armFeedbackDelay); compares reaching error and real-time ratio
+# arm from shared.py (useArm): pipelining only overlaps arm and network integration with the musculoskeletal arm (separate process)
+def runCompareArmFeedbackDelay(delays=(0, 1)):
+    s.numTrials = ceil(s.trainTime/1000)
+    s.trialTargets = [i%2 for i in range(int(s.numTrials+1))] # set target for each trial
+    s.targetid=s.trialTargets[0]
+
+    verystart=time() # store initial time
 
-    # test target 1
-    s.targetid = 1
+    s.plotraster = 0 # set plotting params
+    s.plotconn = 0
+    s.plotweightchanges = 0
+    s.plot3darch = 0
+    s.graphsArm = 0
+    s.animArm = 0
+    s.savemat = 0
+    s.armMinimalSave = 1
+
+    # initialize network
+    createNetwork()
+    addStimulation()
+    addBackground()
+
+    # train (serial coupling)
+    s.armFeedbackDelay = 0
+    s.usestdp = 1 # Whether or not to use STDP
+    s.useRL = 1 # Where or not to use RL
+    s.explorMovs = 1 # enable exploratory movements
+    s.duration = s.trainTime # train time
     setupSim()
     runSim()
     finalizeSim()
-    saveData()
-    plotData()
 
-    if s.rank == 0: # save error to file
-        error1 = mean(s.arm.errorAll)
-        print('Target error for target 0=', error0, '; target 1=', error1)
-        s.arm.plotTraj(s.outfilestem+'_t1.png')
-
-        errorMean = (error0+error1)/2
-        errorFitness = errorMean + abs(error0-error1)  # fitness penalizes difference between target errors
-        errorDic = {}
-        errorDic['error0'] = error0
-        errorDic['error1'] = error1
-        errorDic['meanError'] = errorMean
-        errorDic['errorFitness'] = errorFitness
-
-        print('Mean error = %.4f ; Mean error + difference (fitness) = %.4f'%(errorMean, errorFitness))
+    # test both targets for each feedback delay
+    s.usestdp = 0 # Whether or not to use STDP
+    s.useRL = 0 # Where or not to use RL
+    s.explorMovs = 0 # disable exploratory movements
+    s.duration = s.testTime # testing time
+    addBackground()
+    results = {}
+    for delay in delays:
+        s.armFeedbackDelay = delay
+        errors = []
+        runtimes = []
+        for targetid in [0, 1]:
+            s.targetid = targetid
+            setupSim()
+            runSim()
+            finalizeSim()
+            if s.rank == 0:
+                errors.append(mean(s.arm.errorAll))
+                runtimes.append(s.runtime)
+        if s.rank == 0:
+            results[delay] = {'error0': errors[0], 'error1': errors[1], 'meanError': mean(errors), 'realTimeRatio': 2*s.duration/1000/sum(runtimes)}
 
-        s.targetid = 0 # so saves to correct file name (error of both targets saved to single file ending in target_0_error)
-        with open('%s_target_%d_error'% (s.outfilestem,s.targetid), 'wb') as f: # save avg error over targets to outfilestem
-            pickle.dump(errorDic, f)
+    if s.rank == 0:
+        print('\nArm feedback delay comparison (%s arm, loopstep = %d ms):' % (s.useArm, s.loopstep))
+        for delay in delays:
+            r = results[delay]
+            print('  delay = %d loopsteps (%s): mean error = %.4f (target 0 = %.4f, target 1 = %.4f); real-time ratio = %.2f' % \
+                (delay, 'serial' if delay == 0 else 'pipelined', r['meanError'], r['error0'], r['error1'], r['realTimeRatio']))
+        with open('%s_armFeedbackDelay'% (s.outfilestem), 'wb') as f: # save comparison to outfilestem
+            pickle.dump(results, f)
 
     ## Wrapping up
     s.pc.runworker() # MPI: Start simulations running on each host
@@ -210,46 +248,7 @@ def runTrainTest2targetsOptim():
         s.duration = s.testTime # testing time
         s.armMinimalSave = 0 # save only arm related data
 
-        s.targetid = 0
-        setupSim()
-        runSim()
-        finalizeSim()
-        saveData()
-        #plotData()
-
-        if s.rank == 0: # save error to file
-            error0 = mean(s.arm.errorAll)
-            print('Target error for target ',s.targetid,' is:', error0)
-            s.arm.plotTraj(s.outfilestem+'_t0.png')
-            analysis.plotraster(s.outfilestem+'_t0_raster.png')
-
-        # test target 1
-        s.targetid = 1
-        setupSim()
-        runSim()
-        finalizeSim()
-        saveData()
-        #plotData()
-
-        if s.rank == 0: # save error to file
-            error1 = mean(s.arm.errorAll)
-            print('Target error for target 0=', error0, '; target 1=', error1)
-            s.arm.plotTraj(s.outfilestem+'_t1.png')
-            analysis.plotraster(s.outfilestem+'_t1_raster.png')
-
-            errorMean = (error0+error1)/2
-            errorFitness = errorMean + abs(error0-error1)  # fitness penalizes difference between target errors
-            errorDic = {}
-            errorDic['error0'] = error0
-            errorDic['error1'] = error1
-            errorDic['meanError'] = errorMean
-            errorDic['errorFitness'] = errorFitness
-
-            print('Mean error = %.4f ; Mean error + difference (fitness) = %.4f'%(errorMean, errorFitness))
-
-            s.targetid = 0 # so saves to correct file name (error of both targets saved to single file ending in target_0_error)
-            with open('%s_target_%d_error'% (s.outfilestem,s.targetid), 'wb') as f: # save avg error over targets to outfilestem
-                pickle.dump(errorDic, f)
+        runTestTargets([0, 1]) # targets evaluated concurrently (s.testParallel)
 
     ## Wrapping up
     s.pc.runworker() # MPI: Start simulations running on each host
@@ -259,6 +258,87 @@ def runTrainTest2targetsOptim():
     if (s.plotraster==False and s.plotconn==False and s.plotweightchanges==False): h.quit() # Quit extra processes, or everything if plotting wasn't requested (since assume non-interactive)
 
 
+# test network (already trained, test params set) on each target; targets run concurrently in forked processes if s.testParallel
+# saves per-target errors (error<i>), meanError and errorFitness (mean + max difference between target errors) to outfilestem_target_0_error;
+# data (saveData) only saved after the last target
+def runTestTargets(targets, parallel=None, plot=0):
+    if parallel is None: parallel = s.testParallel
+    if parallel and s.nhosts == 1 and len(targets) > 1 and hasattr(os, 'fork') and s.PMdinput != 'Plexon':
+        # fork one process per target from the current (trained) state; each returns its error through a pipe
+        children = []
+        for targetid in targets:
+            rfd, wfd = os.pipe()
+            pid = os.fork()
+            if pid == 0: # child
+                os.close(rfd)
+                error = None
+                try:
+                    import matplotlib.pyplot
+                    matplotlib.pyplot.switch_backend('Agg') # no display in child: figures only saved to file
+                    import arminterface
+                    arminterface.msmPipe = None # don't share parent's arm process; child starts its own
+                    s.animArm = 0
+                    error = testTarget(targetid, plot, save=(targetid == targets[-1]))
+                    arminterface.msmShutdown()
+                except:
+                    traceback.print_exc()
+                finally:
+                    with os.fdopen(wfd, 'wb') as f:
+                        pickle.dump(error, f)
+                    os._exit(0)
+            os.close(wfd)
+            children.append((targetid, pid, rfd))
+        print('\nTesting targets %s in parallel (pids %s)...' % (targets, [pid for targetid, pid, rfd in children]))
+        errors = []
+        for targetid, pid, rfd in children:
+            with os.fdopen(rfd, 'rb') as f:
+                try:
+                    error = pickle.load(f)
+                except EOFError:
+                    error = None
+            os.waitpid(pid, 0)
+            if error is None:
+                print('Test of target %d failed' % targetid)
+                error = inf
+            errors.append(error)
+    else: # sequential (eg. multiple hosts)
+        errors = [testTarget(targetid, plot, save=(targetid == targets[-1])) for targetid in targets]
+
+    if s.rank == 0: # save error to file
+        print('Target errors: ' + '; '.join(['target %d = %s' % (targetid, error) for targetid, error in zip(targets, errors)]))
+        errorMean = mean(errors)
+        errorFitness = errorMean + (max(errors)-min(errors))  # fitness penalizes difference between target errors
+        errorDic = {}
+        for targetid, error in zip(targets, errors):
+            errorDic['error%d' % targetid] = error
+        errorDic['meanError'] = errorMean
+        errorDic['errorFitness'] = errorFitness
+
+        print('Mean error = %.4f ; Mean error + difference (fitness) = %.4f'%(errorMean, errorFitness))
+
+        s.targetid = 0 # so saves to correct file name (error of all targets saved to single file ending in target_0_error)
+        with open('%s_target_%d_error'% (s.outfilestem,s.targetid), 'wb') as f: # save avg error over targets to outfilestem
+            pickle.dump(errorDic, f)
+        return errorDic
+
+
+# test network on a single target, saving its data if save; returns mean error (rank 0)
+def testTarget(targetid, plot=0, save=1):
+    s.targetid = targetid
+    setupSim()
+    runSim()
+    finalizeSim()
+    if save: saveData()
+    if plot: plotData()
+
+    if s.rank == 0: # save error to file
+        error = mean(s.arm.errorAll)
+        print('Target error for target ',s.targetid,' is:', error)
+        s.arm.plotTraj(s.outfilestem+'_t%d.png' % targetid)
+        if not plot: analysis.plotraster(s.outfilestem+'_t%d_raster.png' % targetid)
+        return error
+
+
 ###############################################################################
 ### Create Network
 ###############################################################################
@@ -308,8 +388,13 @@ def createNetwork():
         gid = c
         if s.cellnames[gid] == 'PMd':
             if s.PMdinput == 'Plexon':
-                cell = celltypes[gid](cellid = gid) # create an NSLOC
-                s.inncl.append(h.NetCon(None, cell))  # This netcon receives external spikes
+                if s.server.injectMode == 'vector': # plays the spike times appended by the server (nrn_py_appendSpikes)
+                    cell = h.VecStim()
+                    s.innvec.append(h.Vector())
+                    cell.play(s.innvec[-1])
+                else:
+                    cell = celltypes[gid](cellid = gid) # create an NSLOC
+                s.inncl.append(h.NetCon(None, cell))  # This netcon receives external spikes (injectMode 'vector': restarts an idle VecStim)
                 s.innclDic[gid - s.ncells - s.server.numPMd] = ninnclDic # This dictionary works in case that PMd's gid starts from 0.
                 ninnclDic += 1
             elif s.PMdinput == 'targetSplit':
@@ -705,7 +790,7 @@ def setupSim():
                 #serverManager = s.server.Manager() # isDp in confis.py = 0
                 s.server.Manager.start() # launch sever process
                 print("Server process completed and callback function initalized")
-            e = s.server.Manager.Event() # Queue callback function in the NEURON queue
+            s.serverEvent = s.server.Manager.Event() # Queue callback function in the NEURON queue
 
 
         # Wait for external spikes for PMd from Plexon
@@ -719,41 +804,58 @@ def setupSim():
 
     ## Play back raw spikes from recorded PMd neurons, into model PMd population
     elif s.PMdinput == 'spikes':
-        # if s.rank == 0:
-        rawSpikesPMd = loadmat(s.spikesPMdFile)['pmdData'] # load raw data
-        numrawcells = len(rawSpikesPMd[0][0])
+        if s.rank == 0:
+            spikestore.updateLibrary(s.spikesPMdFile) # convert raw data once (cached next to the mat file)
+        s.pc.barrier()
+        libPMd = spikestore.PmdLibrary(spikestore.libraryFile(s.spikesPMdFile)) # memory-mapped by all ranks
+        numrawcells = libPMd.numCells
 
         # implement lesion
+        numLesionedCells = 0
         if s.PMdlesion > 0:
-            numLesionedCells = int(round(s.PMdlesion*numrawcells))
+            numLesionedCells = int(round(s.PMdlesion*numrawcells)) # spike times of the last lesion % of cells are removed
             if s.rank==0: print("Lesioning PMd input... removed spike times of %d (%d%%) cells"%(numLesionedCells, s.PMdlesion*100))
-            for itarget in range(len(rawSpikesPMd)):
-                for itrial in range(len(rawSpikesPMd[0])):
-                    for icell in range(numLesionedCells):
-                        rawSpikesPMd[itarget][itrial][numrawcells-1-icell]['spkt'] = [array([])]  # remove spike times of lesion % of cells
 
         # generate spike vectors based on training time, trial duration, and target presentation (eg. alternating trials)
         if s.duration == 1e3: # if sim duration=1sec, assume its the test trial and select PMd spikes based on targetid
-            spktPMd = [rawSpikesPMd[s.targetid][s.repeatSingleTrials[s.targetid]][icell]['spkt'][0] for icell in range(numrawcells)]
+            trialSeq = [s.targetid]
         elif s.repeatSingleTrials[0] > -1: # use single trials for each target during training
-            spktPMd = []
-            for icell in range(numrawcells):
-                spkt = []
-                [spkt.extend(list(rawSpikesPMd[itarget][s.repeatSingleTrials[itarget]][icell]['spkt'][0] + (1000*itrial))) \
-                    for itrial,itarget in enumerate(s.trialTargets[:-1])] # replicate spike times over trials
-                spktPMd.append(spkt)
+            trialSeq = s.trialTargets[:-1] # replicate spike times over trials
         else: # use all available trials for each target during training
             pass
+        gids = [i for i in s.gidVec if i in range(s.popGidStart[s.PMd], s.popGidEnd[s.PMd])] # calcualate gids in this node
+        rawcells = sorted(set(icell%numrawcells for icell in gids)) # raw cells played back in this node
+        rawcellIndex = dict((rawcell, i) for i, rawcell in enumerate(rawcells))
+        if s.streamPMd: # only the spikes of the next streamPMdWnd ms, refilled every loopstep (streamPMdSpikes)
+            s.pmdStream = spikestore.PmdStream(libPMd, trialSeq, s.repeatSingleTrials, rawcells, 1000.0, numLesionedCells)
+            s.pmdStreamGids = gids
+            s.pmdStreamCells = [rawcellIndex[icell%numrawcells] for icell in gids] # stream cell of each vecstim
+            spktPMd = [s.pmdStream.take(i, s.streamPMdWnd) for i in range(len(rawcells))]
+        else:
+            spktOffsets, spktTimes = libPMd.schedule(trialSeq, [s.repeatSingleTrials[itarget] for itarget in trialSeq], rawcells, 1000.0, numLesionedCells)
+            spktPMd = [spktTimes[spktOffsets[i]:spktOffsets[i+1]] for i in range(len(rawcells))]
         # play back PMd spikes using VecStims
         s.tvecPMdlist = []
-        gids = [i for i in s.gidVec if i in range(s.popGidStart[s.PMd], s.popGidEnd[s.PMd])] # calcualate gids in this node
         for icell in gids: # for each unique cell/vecstim
-            spkcell = spktPMd[icell%numrawcells]
+            spkcell = spktPMd[rawcellIndex[icell%numrawcells]]
             tvecPMd = h.Vector().from_python(spkcell) # find spikes for that vecstim
             s.tvecPMdlist.append(tvecPMd)  # store vector to avoid runtime error
             s.cells[s.gidDic[icell]].play(tvecPMd)  # play back sequence of spikes
 
 
+## Refill the PMd VecStims of this node with their spikes up to tUntil (PMdinput = 'spikes' with streamPMd):
+## each vector keeps its unread spikes plus the next ones from the trial library and is read again from the start
+def streamPMdSpikes(tUntil):
+    spktPMd = [s.pmdStream.take(i, tUntil) for i in range(len(s.pmdStream.cells))] # same spikes for all vecstims of a raw cell
+    for icell, i, tvecPMd in zip(s.pmdStreamGids, s.pmdStreamCells, s.tvecPMdlist):
+        vecstim = s.cells[s.gidDic[icell]]
+        index = int(vecstim.index) # next spike read by the vecstim (-1: all spikes played)
+        if index < 0 or (index == tvecPMd.size() and len(spktPMd[i]) == 0):
+            continue
+        tvecPMd.from_python(concatenate((tvecPMd.to_python()[index:], spktPMd[i])))
+        vecstim.index = 0
+
+
 ###############################################################################
 ### Run Simulation
 ###############################################################################
@@ -761,6 +863,7 @@ def runSim():
     if s.rank == 0:
         print('\nRunning...')
         runstart = time() # See how long the run takes
+        s.armtime = 0 # time spent in arm step (incl. waiting for arm), to compare serial vs pipelined arm (s.armFeedbackDelay)
 
     # set cache_efficient on
     h('objref cvode')
@@ -772,6 +875,7 @@ def runSim():
 
     while round(h.t) < s.duration:
         run(min(s.duration,h.t+s.loopstep)) # MPI: Get ready to run the simulation (it isn't actually run until pc.runworker() is called I think)
+        if s.PMdinput == 'spikes' and s.streamPMd: streamPMdSpikes(h.t + s.streamPMdWnd) # PMd spikes of the next window
         if s.server.simMode == 0:
             if s.rank==0 and (round(h.t) % s.progupdate)==0: print(('  t = %0.1f s (%i%%; time consumed: %0.1f s)' % (h.t/1e3, int(h.t/s.duration*100), (time()-runstart))))
         else:
@@ -825,7 +929,7 @@ def runSim():
                         #print 'stdp_after: ', stdp.synweight
             # Synaptic scaling?
 
-            #print(' Arm time = %0.4f s') % (time() - armStart)
+            if s.rank == 0: s.armtime += time() - armStart
 
         ## Time adjustment for online mode simulation
         if s.PMdinput == 'Plexon' and s.server.simMode == 1:
@@ -847,7 +951,7 @@ def runSim():
 
     if s.rank==0:
         s.runtime = time()-runstart # See how long it took
-        print(('  Done; run time = %0.1f s; real-time ratio: %0.2f.' % (s.runtime, s.duration/1000/s.runtime)))
+        print(('  Done; run time = %0.1f s; real-time ratio: %0.2f; arm time = %0.1f s.' % (s.runtime, s.duration/1000/s.runtime, s.armtime)))
     s.pc.barrier() # Wait for all hosts to get to this point
 
 
@@ -948,6 +1052,13 @@ def finalizeSim():
     if s.PMdinput == 'Plexon':
         if s.isOriginal == 0:
             s.server.Manager.stop()
+            if s.rank == 0 and s.server.isDp == 0: # spike delivery stats
+                print(s.serverEvent.commReport())
+                print('[server] spike injection: %d spikes, %.3f us/spike' % (s.serverEvent.injectedSpikes, s.serverEvent.injectionCost()))
+                print(s.serverEvent.scheduler.report())
+            if s.rank == 0: # dequeue/inject latency (server worker stages are printed by the worker)
+                s.serverEvent.latency.export()
+                print(s.serverEvent.latency.report())
 
 
     ## Print statistics
@@ -1016,12 +1127,16 @@ def saveData():
             targetidAll = s.arm.targetidAll
             errorAll = s.arm.errorAll
             criticAll = s.arm.criticAll
+            motorCmdRawAll = s.arm.motorCmdRawAll # raw motor commands (spike counts) and arm params to replay arm without network (armReplay.py)
+            armParams = {'useArm': s.useArm, 'loopstep': s.loopstep, 'initArmMovement': s.initArmMovement, 'testTime': s.testTime, 'trialReset': int(s.trialReset), \
+                'startAng': s.startAng, 'armLen': s.armLen, 'minPval': s.minPval, 'maxPval': s.maxPval, 'cmdmaxrate': s.cmdmaxrate, 'antagInh': s.antagInh, \
+                'armFriction': s.armFriction, 'armDamping': s.armDamping, 'armMuscleGains': s.armMuscleGains, 'armFeedbackDelay': s.armFeedbackDelay}
             if not hasattr(s, 'phase'): s.phase = ''
             s.filename = s.outfilestem+'_target_'+str(s.arm.targetid)+s.phase
             if s.armMinimalSave: # save only data related to arm reaching (for evol alg)
-                variablestosave = ['targetPos', 'angAll', 'motorCmdAll', 'errorAll']
+                variablestosave = ['targetPos', 'angAll', 'motorCmdAll', 'errorAll', 'motorCmdRawAll', 'targetidAll', 'armParams']
             else:
-                variablestosave = ['info', 'targetPos', 'angAll', 'motorCmdAll', 'errorAll', 'simcode', 'spikedata', 's.cellpops', 's.cellnames', 's.cellclasses', 's.xlocs', 's.ylocs', 's.zlocs', 'connections', 'distances', 'delays', 'weights', 's.EorI']
+                variablestosave = ['info', 'targetPos', 'angAll', 'motorCmdAll', 'errorAll', 'motorCmdRawAll', 'targetidAll', 'armParams', 'simcode', 'spikedata', 's.cellpops', 's.cellnames', 's.cellclasses', 's.xlocs', 's.ylocs', 's.zlocs', 'connections', 'distances', 'delays', 'weights', 's.EorI']
 
             if s.savelfps:
                 variablestosave.extend(['s.lfptime', 's.lfps'])
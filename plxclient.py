@@ -0,0 +1,207 @@
+"""
+plxclient.py
+
+Synthetic high-rate Plexon client (same handshake and LWC/HWC packet formats as the Plexon client) to load-test
+the server workers; packets that can't be sent within maxLag s are dropped (client-side drops)
+
+Usage:
+    python plxclient.py [host] [param=value] ...
+    eg. python plxclient.py 127.0.0.1 rate=100000 numChannels=192 burstSize=5 packetMs=5 duration=10
+"""
+
+import sys
+import time
+import struct
+import socket
+import numpy as np
+
+# same as server.py
+NODATA = 0
+ALIVE = 3
+ACK = 4
+INITDATA = 5
+initPort = 7869
+EXIT_MSG = b'exit'
+TS_RESOLUTION = 25e-6 # Plexon timestamp resolution (s)
+MAX_DATAGRAM = 65507 # max UDP payload (bytes)
+
+
+# handshake with the server on initPort; returns the INITDATA parameters as a dict (waits for the server up to timeout s)
+def handshake(host, port=initPort, timeout=60.0):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.settimeout(0.2)
+    start = time.time()
+    try:
+        while 1:
+            sock.sendto(struct.pack('H', ALIVE), (host, port))
+            try:
+                data, addr = sock.recvfrom(4096)
+                break
+            except socket.timeout: # server not listening yet: send ALIVE again
+                if time.time() - start > timeout:
+                    raise
+        cdata = struct.unpack('H' * (len(data) // 2), data)
+        if cdata[0] != INITDATA:
+            raise IOError('Unexpected handshake message: %s' % (cdata,))
+        sock.sendto(struct.pack('H', ACK), addr)
+    finally:
+        sock.close()
+    names = ['comPort', 'isUdp', 'isDp', 'isLwc', 'binWnd', 'timeOut', 'unsortedSpkFilter', 'syncSpkFilter', 'verbose']
+    return dict(zip(names, cdata[1:]))
+
+
+# bursty spike trains: rows of |1|ch#|unit#|TS| in consecutive time windows
+class SpikeSource:
+    def __init__(self, numChannels=96, rate=10000.0, burstSize=1.0, burstWidth=5e-3, numUnits=5, seed=None):
+        self.numChannels = numChannels
+        self.rate = rate # spikes/s, all channels
+        self.burstSize = max(burstSize, 1.0) # mean spikes per burst
+        self.burstWidth = burstWidth # (s)
+        self.numUnits = numUnits # unit ids 0 (unsorted) ... numUnits-1
+        self.rng = np.random.default_rng(seed)
+        self.pending = np.zeros((0, 4)) # spikes of bursts that continue in the next windows
+
+    # spikes with tStart <= TS < tEnd (s), sorted by TS
+    def spikes(self, tStart, tEnd):
+        rng = self.rng
+        numBursts = rng.poisson(self.rate / self.burstSize * (tEnd - tStart))
+        sizes = rng.geometric(1.0 / self.burstSize, numBursts) if self.burstSize > 1 else np.ones(numBursts, dtype=int)
+        numSpikes = int(sizes.sum())
+        rows = np.empty((numSpikes, 4))
+        rows[:, 0] = 1 # spikes
+        rows[:, 1] = np.repeat(rng.integers(1, self.numChannels + 1, numBursts), sizes) # one channel per burst
+        rows[:, 2] = rng.integers(0, self.numUnits, numSpikes)
+        offsets = rng.random(numSpikes) * self.burstWidth if self.burstSize > 1 else 0.0
+        rows[:, 3] = np.repeat(tStart + rng.random(numBursts) * (tEnd - tStart), sizes) + offsets
+        rows[:, 3] = np.round(rows[:, 3] / TS_RESOLUTION) * TS_RESOLUTION
+        rows = np.concatenate((self.pending, rows))
+        later = rows[:, 3] >= tEnd
+        self.pending = rows[later]
+        rows = rows[~later]
+        return rows[np.argsort(rows[:, 3], kind='stable')]
+
+
+class PlxClient:
+    # source: SpikeSource; packetMs: time window sent in each packet (LWC); packetSpikes: max spike rows per send
+    def __init__(self, source, packetMs=10.0, packetSpikes=2000, maxLag=0.1):
+        self.source = source
+        self.packetMs = packetMs
+        self.packetSpikes = packetSpikes
+        self.maxLag = maxLag # (s)
+        self.params = None
+        self.sock = None
+        self.addr = None
+        self.startTime = None # perf_counter at data time 0
+        self.packetsSent = 0
+        self.spikesSent = 0
+        self.packetsDropped = 0
+        self.spikesDropped = 0
+        self.bytesSent = 0
+        self.maxBehind = 0.0 # max delay of a send after its packet time (s)
+        self.wall = 0.0 # duration of the run (s)
+        self.sentTimeline = [] # (data time (s), spikes sent up to that time) after each packet
+
+    # handshake and connect the data socket
+    def connect(self, host='127.0.0.1', port=initPort, timeout=60.0):
+        self.params = handshake(host, port, timeout)
+        self.addr = (host, self.params['comPort'])
+        if self.params['isUdp']:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            start = time.time()
+            while 1:
+                self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                try:
+                    self.sock.connect(self.addr)
+                    break
+                except ConnectionRefusedError: # server not listening yet
+                    self.sock.close()
+                    if time.time() - start > timeout:
+                        raise
+                    time.sleep(0.01)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return self.params
+
+    def send(self, data):
+        if self.params['isUdp']:
+            self.sock.sendto(data, self.addr)
+        else:
+            self.sock.sendall(data)
+        self.bytesSent += len(data)
+
+    # send spike rows in sends of at most packetSpikes rows (and one datagram each for UDP)
+    def sendRows(self, rows):
+        step = self.packetSpikes
+        if self.params['isUdp']:
+            step = min(step, MAX_DATAGRAM // 32)
+        for i in range(0, len(rows), step):
+            self.send(np.ascontiguousarray(rows[i:i+step], dtype='<f8').tobytes())
+
+    # wait until wall time of data time t (s); returns False if the packet is too late and must be dropped
+    def waitFor(self, t):
+        behind = time.perf_counter() - (self.startTime + t)
+        if behind < 0:
+            time.sleep(-behind)
+            return True
+        self.maxBehind = max(self.maxBehind, behind)
+        return behind <= self.maxLag
+
+    # generate and send duration s of data in real time from startTime (perf_counter, default now), then 'exit'; returns stats
+    def run(self, duration, startTime=None):
+        hwc = self.params['isDp'] == 1 and self.params['isLwc'] == 0
+        window = self.params['binWnd'] / 1000.0 if hwc else self.packetMs / 1000.0
+        numPackets = int(round(duration / window))
+        self.startTime = time.perf_counter() if startTime is None else startTime
+        for k in range(numPackets):
+            rows = self.source.spikes(k * window, (k + 1) * window)
+            if not self.waitFor((k + 1) * window):
+                self.packetsDropped += 1
+                self.spikesDropped += len(rows)
+                continue
+            if hwc:
+                mua = np.zeros(self.source.numChannels + 1)
+                mua[:-1] = np.bincount(rows[:, 1].astype(int) - 1, minlength=self.source.numChannels)
+                mua[-1] = k + 1 # binning window
+                self.send(mua.astype('<f8').tobytes())
+            elif len(rows):
+                self.sendRows(rows)
+            else:
+                self.send(struct.pack('<HH', NODATA, max(int(self.packetMs), 1)))
+            self.packetsSent += 1
+            self.spikesSent += len(rows)
+            self.sentTimeline.append(((k + 1) * window, self.spikesSent))
+        self.wall = time.perf_counter() - self.startTime
+        self.send(EXIT_MSG)
+        return self.stats()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def stats(self):
+        return {'packetsSent': self.packetsSent, 'spikesSent': self.spikesSent, 'packetsDropped': self.packetsDropped,
+                'spikesDropped': self.spikesDropped, 'bytesSent': self.bytesSent, 'maxBehind': self.maxBehind}
+
+    def report(self):
+        st = self.stats()
+        return '[plxclient] %d spikes sent in %d packets (%.0f spikes/s), %d spikes dropped in %d late packets; max %.1f ms behind' % (
+            st['spikesSent'], st['packetsSent'], st['spikesSent'] / max(self.wall, 1e-9), st['spikesDropped'], st['packetsDropped'], st['maxBehind'] * 1e3)
+
+
+if __name__ == '__main__':
+    host = '127.0.0.1'
+    params = {'rate': 10000.0, 'numChannels': 96, 'burstSize': 1.0, 'burstWidth': 5e-3, 'packetMs': 10.0, 'packetSpikes': 2000, 'maxLag': 0.1, 'duration': 10.0}
+    for arg in sys.argv[1:]:
+        if '=' in arg:
+            name, value = arg.split('=')
+            params[name] = float(value)
+        else:
+            host = arg
+    source = SpikeSource(int(params['numChannels']), params['rate'], params['burstSize'], params['burstWidth'])
+    client = PlxClient(source, params['packetMs'], int(params['packetSpikes']), params['maxLag'])
+    print('Connecting to the server at %s:%d...' % (host, initPort))
+    print('Server parameters: %s' % client.connect(host))
+    client.run(params['duration'])
+    client.close()
+    print(client.report())
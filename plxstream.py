@@ -0,0 +1,86 @@
+"""
+plxstream.py
+
+Zero-copy receive path for the Plexon client messages (recv_into a preallocated buffer, numpy views)
+"""
+
+import struct
+import numpy as np
+
+EXIT_MSG = b'exit'
+NODATA_MSG = struct.Struct('<HH') # header ID, time interval
+CTRL_SIZE = 4 # size of NODATA and 'exit' messages
+
+
+# messages are returned as views into the buffer, valid until the next fill() (or reserve()/feed())
+class PlxStream:
+    def __init__(self, sock, rowValues, isUdp=0, size=1<<20):
+        self.sock = sock
+        self.isUdp = isUdp
+        self.rowValues = rowValues # float64 values per data row
+        self.rowSize = 8 * rowValues
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0 # unread data = buf[start:end]
+        self.end = 0
+        self.bytesReceived = 0
+
+    # free space for the next read; returns a writable view of the buffer after the unread data
+    def reserve(self):
+        if self.start == self.end: # all data consumed: restart at beginning of buffer
+            self.start = self.end = 0
+        elif self.end > len(self.buf) - max(self.rowSize, 65536): # move unread partial message to start of buffer
+            unread = self.end - self.start
+            self.buf[:unread] = self.buf[self.start:self.end]
+            self.start = 0
+            self.end = unread
+        return self.view[self.end:]
+
+    # n bytes were written into the view returned by reserve(); returns n
+    def commit(self, n):
+        self.end += n
+        self.bytesReceived += n
+        return n
+
+    # read available data from socket into buffer (blocks until some data); returns num bytes read (0 = connection closed)
+    def fill(self):
+        if self.isUdp:
+            n, addr = self.sock.recvfrom_into(self.reserve())
+        else:
+            n = self.sock.recv_into(self.reserve())
+        return self.commit(n)
+
+    # add received bytes (eg. a datagram received by an event loop) to the buffer
+    def feed(self, data):
+        self.reserve()[:len(data)] = data
+        return self.commit(len(data))
+
+    # return next message in buffer: ('data', rows x rowValues float64 view with all complete consecutive rows, at most maxRows),
+    # ('nodata', (header ID, time interval)), ('exit', None), or (None, None) if no complete message yet
+    def nextMessage(self, maxRows=None):
+        avail = self.end - self.start
+        if avail < CTRL_SIZE:
+            return None, None
+        head = self.buf[self.start:self.start+CTRL_SIZE]
+        if head == EXIT_MSG:
+            self.start += CTRL_SIZE
+            return 'exit', None
+        if head != b'\x00\x00\x00\x00': # control message (NODATA); a data row starts with the low bytes of a small float64 (data type or MUA count)
+            msg = NODATA_MSG.unpack_from(self.buf, self.start)
+            self.start += CTRL_SIZE
+            return 'nodata', msg
+        # data rows: all complete rows up to the next control message or partial row
+        numRows = avail // self.rowSize
+        if maxRows is not None:
+            numRows = min(numRows, maxRows)
+        if numRows == 0:
+            return None, None
+        rows = np.frombuffer(self.buf, np.float64, numRows * self.rowValues, self.start).reshape(numRows, self.rowValues)
+        if numRows > 1: # stop at first row that doesn't look like data (control message in between)
+            rowHeads = np.frombuffer(self.buf, np.uint32, numRows * self.rowSize // 4, self.start)[::self.rowSize // 4]
+            ctrl = np.flatnonzero(rowHeads != 0)
+            if len(ctrl):
+                numRows = int(ctrl[0])
+                rows = rows[:numRows]
+        self.start += numRows * self.rowSize
+        return 'data', rows
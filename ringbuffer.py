@@ -0,0 +1,170 @@
+"""
+ringbuffer.py
+
+Single-producer/single-consumer shared-memory ring buffer, the queue between the server worker and NEURON
+(same interface as the queue it replaces: put, get, get_nowait, qsize, empty)
+"""
+
+import os
+import time
+import atexit
+import numpy as np
+from queue import Empty, Full
+from multiprocessing import shared_memory, Lock
+
+# shared memory: counters (int64, each written by one process only) then capacity slots of |item length|put time (ns)|values|
+# (float64). The oldest item is claimed (under the lock) either by get or by discardOldest, never both
+HEAD = 0 # items written (producer)
+TAIL = 8 # items read (consumer); counters on separate cache lines (int64 index)
+DROP = 16 # items before it were discarded (producer)
+HEADER_SIZE = 24 * 8
+
+
+class SpscRing:
+    # lock: claim lock shared with the ring created by another process (create=False); new lock if None
+    def __init__(self, maxLen, capacity=1024, name=None, create=True, lock=None):
+        self.maxLen = maxLen # max values per item
+        self.capacity = capacity
+        self.slotLen = maxLen + 2
+        size = HEADER_SIZE + capacity * self.slotLen * 8
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=size if create else 0)
+        self.name = self.shm.name
+        self.counters = np.ndarray((HEADER_SIZE // 8,), np.int64, self.shm.buf, 0)
+        self.slots = np.ndarray((capacity, self.slotLen), np.float64, self.shm.buf, HEADER_SIZE)
+        self.lock = lock if lock is not None else Lock() # claim of the oldest item (get or discardOldest)
+        if create:
+            self.counters[:] = 0
+            self.owner = os.getpid() # only the creating process unlinks the shared memory
+            atexit.register(self.close)
+        self.lastStamp = 0 # put time of last item got (ns)
+
+    # add item (sequence of numbers) at the head; if the ring is full, waits for a slot to be freed by the consumer
+    # or by discardOldest (raises Full if not block or timeout)
+    def put(self, item, block=True, timeout=None):
+        head = int(self.counters[HEAD])
+        start = time.time()
+        while head - max(int(self.counters[TAIL]), int(self.counters[DROP])) >= self.capacity: # slots of got or discarded items are free
+            if not block or (timeout is not None and time.time() - start >= timeout):
+                raise Full
+            time.sleep(50e-6)
+        slot = self.slots[head % self.capacity]
+        slot[0] = len(item)
+        slot[1] = time.perf_counter_ns()
+        slot[2:2+len(item)] = item
+        self.counters[HEAD] = head + 1 # publish item
+
+    # remove and return oldest item as a list; blocks until an item is available (polling, yielding the cpu)
+    def get(self, block=True, timeout=None):
+        start = time.time()
+        spins = 0
+        while 1:
+            if int(self.counters[HEAD]) > max(int(self.counters[TAIL]), int(self.counters[DROP])):
+                with self.lock:
+                    tail = max(int(self.counters[TAIL]), int(self.counters[DROP]))
+                    if int(self.counters[HEAD]) > tail: # not discarded meanwhile
+                        slot = self.slots[tail % self.capacity]
+                        item = slot[2:2+int(slot[0])].tolist()
+                        self.lastStamp = int(slot[1])
+                        self.counters[TAIL] = tail + 1 # free slot
+                        return item
+            if not block or (timeout is not None and time.time() - start >= timeout):
+                raise Empty
+            spins += 1
+            if spins < 1000:
+                os.sched_yield() # let the producer run if it shares the core
+            else:
+                time.sleep(50e-6)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    # oldest item as a list without removing it (None if empty)
+    def peek(self):
+        with self.lock:
+            tail = max(int(self.counters[TAIL]), int(self.counters[DROP]))
+            if int(self.counters[HEAD]) > tail:
+                slot = self.slots[tail % self.capacity]
+                return slot[2:2+int(slot[0])].tolist()
+        return None
+
+    # producer side: discard the oldest item (the consumer skips it, its slot is free); returns the item, or None
+    # if there is none (the consumer got them meanwhile)
+    def discardOldest(self):
+        with self.lock:
+            tail = max(int(self.counters[TAIL]), int(self.counters[DROP]))
+            if int(self.counters[HEAD]) > tail:
+                slot = self.slots[tail % self.capacity]
+                item = slot[2:2+int(slot[0])].tolist()
+                self.counters[DROP] = tail + 1
+                return item
+        return None
+
+    def qsize(self):
+        return int(self.counters[HEAD]) - max(int(self.counters[TAIL]), int(self.counters[DROP]))
+
+    def empty(self):
+        return self.qsize() <= 0
+
+    def close(self):
+        if self.shm is None:
+            return
+        self.counters = self.slots = None
+        self.shm.close()
+        if getattr(self, 'owner', None) == os.getpid():
+            self.shm.unlink()
+        self.shm = None
+
+
+# several rings read as one queue by the consumer (one ring per producer process), same consumer interface as SpscRing
+class RingSet:
+    # itemTime: function returning the data time of an item, to merge the rings in time order (None: round robin)
+    def __init__(self, rings, itemTime=None):
+        self.rings = rings
+        self.itemTime = itemTime
+        self.next = 0 # ring tried first by the next get (round robin)
+        self.lastStamp = 0
+
+    # ring whose oldest item has the earliest time (None if all are empty)
+    def oldest(self):
+        best = None
+        for ring in self.rings:
+            head = ring.peek()
+            if head is not None:
+                headTime = self.itemTime(head)
+                if best is None or headTime < bestTime:
+                    best, bestTime = ring, headTime
+        return best
+
+    def get(self, block=True, timeout=None):
+        start = time.time()
+        numRings = len(self.rings)
+        while 1:
+            if self.itemTime: # oldest item first
+                ring = self.oldest()
+                order = [ring] if ring is not None else []
+            else: # round robin
+                order = [self.rings[(self.next + i) % numRings] for i in range(numRings)]
+            for ring in order:
+                try:
+                    item = ring.get(False)
+                except Empty: # discarded by the producer meanwhile
+                    continue
+                self.next = (self.rings.index(ring) + 1) % numRings
+                self.lastStamp = ring.lastStamp
+                return item
+            if not block or (timeout is not None and time.time() - start >= timeout):
+                raise Empty
+            time.sleep(50e-6)
+
+    def get_nowait(self):
+        return self.get(False)
+
+    def qsize(self):
+        return sum(ring.qsize() for ring in self.rings)
+
+    def empty(self):
+        return self.qsize() <= 0
+
+    def close(self):
+        for ring in self.rings:
+            ring.close()
@@ -10,25 +10,28 @@ Version: 2015feb14 modified by salvadord
 from glob import glob
 from socket import *
 from neuron import h # for working with DP cells
-from multiprocessing import Process, Manager, Queue, Value, Lock
+from multiprocessing import Process, Value, Array, Lock
 from threading import Thread
 
 import struct
 import time
 import os
 import sys
-import queue
+from queue import Empty
 import array
 import math
 import numpy as np
 import traceback
 import shared as s
+from plxstream import PlxStream # zero-copy receive path for client messages
+from ringbuffer import SpscRing, RingSet # shared-memory queue between the server and NEURON
+from backpressure import Backpressure # drop policy when the simulation lags
+from latency import LatencyRecorder, RECEIVE, FILTER, BIN, ENQUEUE, DEQUEUE, INJECT, now as latencyNow # per-stage latency histograms
+import spikestore # binary indexed spike files for offline replay
 
 
 ### Copied plexon config here
 
-# a queue between the server and the virtual arm model
-queue = Manager().Queue()
 currNeuronTime = Value('d', 0.0) # for NEURON time exchange
 currQueueTime = Value('d', 0.0) # for queue time exchange
 newCurrTime = Value('d', 0.0)
@@ -61,12 +64,6 @@ DATA_SIZE = (CH_END + 1) * 8 # 1 for binning window. 8 is double in Matlab
 EXIT_SIZE   = 2  # only header ID
 ACK_SIZE    = 2  # only header ID
 
-# For Latency measure
-O_END = 1
-O_SND = 2
-O_RCV = 3
-O_FLT = 4
-
 
 #####################################################################
 #                Variables user may modify                          #
@@ -86,11 +83,12 @@ numPMd = CH_END
 isCommunication = 1 # 0: read spikes from a file by the server, 1: get spikes through the queue
 localFileRead = 1 # 0: real communication and spikes delivery through the queue
                 # 1:  the queue test reading spikes in a file at the serer side
+replaySpeed = 0 # offline replay (localFileRead = 1) from the spike store- 0: legacy pacing (DP: one binWnd per 100 ms, NSLOC: as fast as possible), x > 0: x times real time
+replayWnd = 10 # (ms) spikes injected ahead by each callback when isCommunication = 0
 # 0: No output, 1: print information to stdout as well as files
 verbose = 0
-timeMeasure = 0
-#ackServerIP = "10.244.18.233" # windows at the ACIS Lab.
-ackServerIP = "138.5.98.28" # windows at the Francis Lab. (XPC64)
+latencyStats = 1 # 1: export per-stage latency histograms (receive, filter, bin, enqueue, dequeue, inject) to dir/latency*.tsv, 0: no export
+latencyInterval = 10.0 # export interval (s)
 
 isUdp = 0    # 0: TCP, 1: UDP
 simMode = 0 # simMode- Offline mode(0),  online mode(1)
@@ -103,10 +101,28 @@ SPKNUM = 20 # number of spikes in a chunk
 SPKSZ = 3 * SPKNUM + 1 # size of a List to store SPKNUM (CH_ID, UNIT_ID, TS), 1 for spikes in the chunk, and 1 for flag to indicate if spike remains in a chunk
 TIMEOUT = 20 * 0.001 # it should be second
 syncWnd = 0.001
-
-# For latency measure
-qTimeList = []
-deqTimeList = []
+binCatchUp = 1 # 1: a message completing several binning windows (client fell behind) sends all of them at once, 0: one window per message
+queueCapacity = 4096 # max items in the queue between the server and NEURON (the server waits when it is full)
+adaptiveInvl = 1 # NSLOC callback interval- 0: fixed (minInvl), 1: adapts to the incoming data rate (backs off when idle, up to maxInvl)
+minInvl = 0.025 # (ms)
+maxInvl = 1.0 # (ms) also limited to LR / 10
+injectMode = 'event' # PMd input (NSLOC model)- 'event': one NetCon event per spike into the PMd NSLOCs, 'vector': spike times appended to the vector of a PMd VecStim per channel (network.py)
+injectBatch = 32 # max queue items injected by one NSLOC callback (the items queued behind the first one are injected with it)
+injectRelaySpikes = 4 # injectMode 'vector': a channel with fewer spikes in a callback gets one relay event per spike instead of a vector update
+injectCompact = 1000 # injectMode 'vector': played times dropped from a VecStim vector once its index passes this
+queuePolicy = 'dropOldest' # when the simulation lags more than LR: 'dropOldest' (discard queued items), 'coalesce' (merge new items), 'block' (wait)
+isAsync = 0 # 0: one blocking worker for one client, 1: asyncio server (aioserver.py) for several clients (NSLOC only)
+numArrays = 1 # clients/recording arrays (isAsync); array i sends on channels 1..arrayChannels, mapped to i * arrayChannels + 1 ... (CH_END should cover all of them)
+arrayChannels = 96 # channels per array
+numServerProcs = 1 # server processes sharing the arrays (isAsync), one queue each
+
+# a queue between the server and the virtual arm model (items: binned MUA or spike chunks);
+# with several server processes, one queue per process (single producer) read as one by NEURON, oldest item first
+if isAsync and isDp == 0 and numServerProcs > 1:
+    queue = RingSet([SpscRing(max(CH_END + 1, SPKSZ + 1), queueCapacity) for i in range(numServerProcs)], lambda qItem: queueItemTime(qItem)) # merged in time order
+else:
+    queue = SpscRing(max(CH_END + 1, SPKSZ + 1), queueCapacity)
+arraysInUse = Array('b', numArrays) # arrays assigned to a client by the handshake (isAsync), released when the client exits
 
 if verbose:
     fdtime = open('SpikeTimeStamp.tsv', 'w')
@@ -134,11 +150,22 @@ else: # NSLOC
 if simMode == 0:
     LR = 1000e3
 
+if isDp == 1: # binning of several arrays is not supported
+    isAsync = 0
+
 if unsortedSpkFilter == 0:
     UNIT_START = 0
 else :
     UNIT_START = 1
 
+# latency histograms of the stages in this process, exported to dir/latency<name>.tsv every latencyInterval
+def nrn_py_latencyRecorder(dir, name):
+    if not latencyStats:
+        return LatencyRecorder(None)
+    if not os.path.exists(dir):
+        os.mkdir(dir)
+    return LatencyRecorder(dir + "/latency" + name + ".tsv", latencyInterval)
+
 # Print out server's information
 def getServerInfo():
     if simMode == 1:
@@ -183,31 +210,204 @@ def checkLocalIndexbyKey(dicName, key):
         index = -1
     return index
 
-def feedQueue(qItem, theVerbose = 0):
+# channel -> local index of PMd NetCon lookup table (same as checkLocalIndexbyKey(innclDic, ch - 1); -1: not in this worker),
+# and event methods of the NetCons in inncl (hoc List)
+def nrn_py_injectionTable(inncl, innclDic):
+    chan2local = [-1] * CH_END
+    for key, localIndex in innclDic.items():
+        if 0 <= key < CH_END:
+            chan2local[key] = localIndex
+    ncEvents = [inncl.o(i).event for i in range(int(inncl.count()))]
+    return chan2local, ncEvents
+
+# queue NetCon events for the spikes (|CH_ID|Unit_ID|Time_stamp (s)| x spkNum) with a local PMd and time in [tStart, tEnd] (ms)
+# (injectMode 'event': one event per spike). Returns number of injected spikes
+def nrn_py_injectSpikes(spk, spkNum, chan2local, ncEvents, tStart, tEnd):
+    numInjected = 0
+    for i in range(0, 3 * spkNum, 3):
+        channel = int(spk[i]) - 1
+        timeStamp = spk[i + 2] * 1000 # second -> ms
+        if 0 <= channel < CH_END and tStart <= timeStamp <= tEnd:
+            localIndex = chan2local[channel]
+            if localIndex >= 0:
+                ncEvents[localIndex](timeStamp, 1)
+                numInjected += 1
+    return numInjected
+
+# append the spikes (same format) with a local PMd and time in [tStart, tEnd] (ms) to the spike time vectors played by the PMd
+# VecStims (injectMode 'vector'): one vector update per channel instead of one event per spike. A playing VecStim reads on
+# into the appended times; an idle one (index -1) gets only the new times and is restarted by an event at tStart. Spikes
+# before the last time of the vector, and those of channels with few spikes (injectRelaySpikes), are relayed by one event
+# (flag 2) per spike (vecevent.mod).
+# Returns number of injected spikes
+def nrn_py_appendSpikes(spk, spkNum, chan2local, vecStims, vecs, restarts, tStart, tEnd):
+    times = {} # local PMd index -> spike times (ms)
+    for i in range(0, 3 * spkNum, 3):
+        channel = int(spk[i]) - 1
+        timeStamp = spk[i + 2] * 1000 # second -> ms
+        if 0 <= channel < CH_END and tStart <= timeStamp <= tEnd:
+            localIndex = chan2local[channel]
+            if localIndex >= 0:
+                if localIndex in times:
+                    times[localIndex].append(timeStamp)
+                else:
+                    times[localIndex] = [timeStamp]
+    numInjected = 0
+    for localIndex, spikeTimes in times.items():
+        if len(spikeTimes) < injectRelaySpikes:
+            for timeStamp in spikeTimes:
+                restarts[localIndex](timeStamp, 2)
+            numInjected += len(spikeTimes)
+            continue
+        spikeTimes.sort()
+        vec = vecs[localIndex]
+        index = int(vecStims[localIndex].index) # next time read by the VecStim (-1: all played)
+        if index < 0:
+            vec.from_python(spikeTimes)
+            restarts[localIndex](tStart)
+        else:
+            last = vec.x[int(vec.size()) - 1]
+            numLate = 0
+            while numLate < len(spikeTimes) and spikeTimes[numLate] < last: # would be out of order in the vector: relay them
+                restarts[localIndex](spikeTimes[numLate], 2)
+                numLate += 1
+            numInjected += numLate
+            spikeTimes = spikeTimes[numLate:]
+            if not spikeTimes:
+                continue
+            if index > injectCompact: # drop the played times now and then (as network.streamPMdSpikes)
+                vec.from_python(vec.to_python()[index:] + spikeTimes)
+                vecStims[localIndex].index = 0
+            else:
+                vec.append(*spikeTimes)
+        numInjected += len(spikeTimes)
+    return numInjected
+
+# time (ms) of the last data in a queue item
+def queueItemTime(qItem):
     if isDp: # DP model
-        currQTime = qItem[CH_END] * binWnd
+        return qItem[CH_END] * binWnd
     else:    # NSLOC model
-        spkNum = qItem[SPKSZ - 1]
+        spkNum = int(qItem[SPKSZ - 1])
         if spkNum == 0: # timeout item
-            currQTime = qItem[SPKSZ - 2] * 1000 # sec -> ms
+            return qItem[SPKSZ - 2] * 1000 # sec -> ms
         else:
-            currQTime = qItem[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
-    queue.put(qItem)
-    while 1:
-        qsize = queue.qsize()
-        if qsize <= 1:
-            break
-        with lock:
-            currSimTime = currNeuronTime.value
-        if verbose:
-            print("[feedQueue] currQTime:", currQTime, "currSimTime: ", currSimTime, "LR: ", LR)
-        if (currQTime - currSimTime) > LR:   # Simulation is slow
-            if qsize == queue.qsize():       # callback doesn't get an item in Q so far
-                queue.get()                  # discard an item
-                if verbose:
-                    print("[feedQueue] An item is discared in Q")
-        else:                                # simulation is fast
-            break
+            return qItem[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
+
+# array of a NSLOC queue item (isAsync): from the channel of its first spike (timeout items carry a channel of their array)
+def queueItemArray(qItem):
+    return int((qItem[0] - 1) // arrayChannels)
+
+# data time (ms) the simulation can move to with several arrays (isAsync): the oldest of the latest item times of the
+# arrays, so that the spikes of an array slightly behind the others are not older than the simulation when they arrive.
+# Arrays more than LR behind the newest one (eg. not connected or exited) are not waited for
+class ArrayClock:
+    def __init__(self, numArrays):
+        self.times = [0.0] * numArrays # latest item time of each array (ms)
+
+    def update(self, qItem, itemTime):
+        i = queueItemArray(qItem)
+        if 0 <= i < len(self.times):
+            self.times[i] = max(self.times[i], itemTime)
+        newest = max(self.times + [itemTime])
+        return min(t for t in self.times + [newest] if t >= newest - LR)
+
+# number of spikes in a queue item
+def queueItemSpikes(qItem):
+    if isDp: # binned MUA (timeout item: -1)
+        return int(sum(qItem[:CH_END])) if qItem[0] != -1 else 0
+    else:
+        return int(qItem[SPKSZ - 1])
+
+# merge two queue items (coalesce policy): MUA counts are summed into the newest bin;
+# spike chunks are concatenated, keeping the newest SPKNUM spikes
+def coalesceQueueItems(pending, qItem):
+    if isDp:
+        if pending[0] == -1: # timeout item
+            return list(qItem)
+        merged = list(pending)
+        merged[CH_END] = qItem[CH_END]
+        if qItem[0] != -1:
+            for i in range(CH_END):
+                merged[i] += qItem[i]
+        return merged
+    else:
+        n1 = int(pending[SPKSZ - 1])
+        n2 = int(qItem[SPKSZ - 1])
+        if n1 == 0: # timeout item
+            return list(qItem)
+        if n2 == 0:
+            return list(pending)
+        spikes = (list(pending[:3 * n1]) + list(qItem[:3 * n2]))[-3 * SPKNUM:]
+        merged = spikes + [0] * (SPKSZ + 1 - len(spikes))
+        merged[SPKSZ - 1] = len(spikes) // 3
+        merged[SPKSZ] = qItem[SPKSZ] # serial number
+        return merged
+
+# policy of the server (producer side of the queue) when the simulation doesn't keep up with LR
+backpressure = Backpressure(queue, lambda: currNeuronTime.value, queuePolicy, LR, queueItemSpikes, coalesceQueueItems)
+
+def feedQueue(qItem, theVerbose = 0):
+    currQTime = queueItemTime(qItem)
+    spikeTimes = None if isDp else [qItem[3 * i + 2] * 1000 for i in range(int(qItem[SPKSZ - 1]))]
+    backpressure.put(qItem, currQTime, spikeTimes)
+    if verbose:
+        print("[feedQueue] currQTime:", currQTime, "currSimTime: ", backpressure.currSimTime, "LR: ", LR, "dropped: ", backpressure.itemsDropped)
+
+# queue items of SPKNUM spikes from an array of |CH_ID|Unit_ID|Time_stamp| rows; serial numbers from SN
+def nrn_py_spikeItems(spikes, SN):
+    for i in range(0, len(spikes), SPKNUM):
+        chunk = spikes[i:i + SPKNUM]
+        item = chunk.ravel().tolist() + [0] * (SPKSZ + 1 - chunk.size)
+        item[SPKSZ - 1] = len(chunk)
+        item[SPKSZ] = SN + i // SPKNUM
+        yield item
+
+# Interval (ms) of the NSLOC callback polling the queue: tightens to minInvl while items arrive or are queued,
+# otherwise follows the data rate (a fraction of the mean time between items) and backs off exponentially when idle
+class AdaptiveInterval:
+    def __init__(self, minInvl, maxInvl):
+        self.minInvl = minInvl
+        self.maxInvl = maxInvl
+        self.invl = minInvl
+        self.lastItemTime = None
+        self.meanGap = None # mean simulation time between items (ms)
+        self.callbacks = 0
+        self.dataCallbacks = 0
+        self.invlSum = 0.0
+        self.items = 0
+        self.latencySum = 0.0 # delivery latency: simulation time at delivery - time of first spike in item (ms)
+        self.maxLatency = 0.0
+        self.ignoredSpikes = 0 # spikes older than the simulation time when delivered
+
+    # next interval after a callback at time t (ms) that got an item (gotItem) and left backlog items in the queue
+    def update(self, gotItem, backlog, t):
+        self.callbacks += 1
+        if gotItem:
+            self.dataCallbacks += 1
+            if self.lastItemTime is not None:
+                gap = t - self.lastItemTime
+                self.meanGap = gap if self.meanGap is None else 0.9 * self.meanGap + 0.1 * gap
+            self.lastItemTime = t
+            invl = self.minInvl if backlog > 0 or self.meanGap is None else self.meanGap / 4
+        elif backlog > 0:
+            invl = self.minInvl
+        else:
+            invl = self.invl * 2 # idle: back off
+        self.invl = min(max(invl, self.minInvl), self.maxInvl)
+        self.invlSum += self.invl
+        return self.invl
+
+    # delivery statistics of an item
+    def delivered(self, latency, ignoredSpikes):
+        self.items += 1
+        self.latencySum += latency
+        self.maxLatency = max(self.maxLatency, latency)
+        self.ignoredSpikes += ignoredSpikes
+
+    def report(self):
+        return '[server] callbacks: %d (%d with data), mean interval %.3f ms; delivery latency: mean %.3f ms, max %.3f ms; %d spikes ignored (late)' % (
+            self.callbacks, self.dataCallbacks, self.invlSum / max(self.callbacks, 1), self.latencySum / max(self.items, 1), self.maxLatency, self.ignoredSpikes)
 
 #class Event(object):
 class Event:
@@ -219,24 +419,91 @@ class Event:
             self.vec = h.mua # mua : vector in Hoc
         else:    # spikes
             self.qItem = [0] * (SPKSZ + 1) # = 3 * SPKNUM + 1 + Serial Number
-            self.invl = 0.025
+            self.invl = minInvl
+        self.scheduler = AdaptiveInterval(minInvl, min(maxInvl, LR / 10.0) if adaptiveInvl else minInvl)
+        self.arrayClock = ArrayClock(numArrays) if isAsync and numArrays > 1 else None # simulation time follows the array behind
         if pc.id() == 0:
             self.fih = h.FInitializeHandler(1, self.callback)
         else:
             self.fih = h.FInitializeHandler(1, self.callbackSlave)
-        # for timing measurement
-        self.num = 0
-        self.write = 1
+        # latency histograms of dequeue and inject stages (rank 0)
+        self.latency = nrn_py_latencyRecorder(self.dir, "Neuron") if pc.id() == 0 else None
+        # spike injection into PMd NSLOCs (NSLOC model)
+        self.chan2local = None # local index of PMd NetCon of each channel (-1: not in this worker); built on first use
+        self.qItems = [] # items of the last NSLOC callback (up to injectBatch, oldest first)
+        self.injectedSpikes = 0
+        self.injectTime = 0.0 # (s)
+        # rank 0 sends each rank only the spikes of its PMd channels (NSLOC model)
+        if isDp == 0 and isCommunication == 1:
+            self.buildScatterTable()
+        self.sentValues = [0] * s.nhosts # values sent to each rank
+        self.broadcastValues = 0 # values that broadcasting whole items would have sent to each rank
 
         # for opto
-        if isCommunication == 0 and pc.id == 0:
-            if isDp == 0: # read spikes from a file by the server w/o communication
+        self.store = None
+        if isCommunication == 0 and pc.id() == 0:
+            if isDp == 0: # replay spikes from a file by the server w/o communication
                 self.fname = self.dir + "/spikePMd-6sec.tsv"
-                self.fd = open(self.fname, "r")
-                print("[Open ", self.fname, " for test]")
+                self.store = spikestore.openStore(self.fname) # converted to a spike store once
+                self.replayTime = 0.0 # (ms) spikes before it are injected
+                print("[Open ", self.store.fileName, " for test]")
             else: # DP
                 pass
 
+    # inject spikes into the PMd NSLOCs or VecStims (injectMode) of this worker (spikes older than h.t are ignored); returns number of injected spikes
+    def injectSpikes(self, spk, spkNum):
+        start = time.time()
+        if self.chan2local is None:
+            self.chan2local, self.ncEvents = nrn_py_injectionTable(s.inncl, s.innclDic)
+            self.vecStims = [s.inncl.o(i).syn() for i in range(int(s.inncl.count()))] if injectMode == 'vector' else None
+        if injectMode == 'vector':
+            numInjected = nrn_py_appendSpikes(spk, spkNum, self.chan2local, self.vecStims, s.innvec, self.ncEvents, h.t, s.duration)
+        else:
+            numInjected = nrn_py_injectSpikes(spk, spkNum, self.chan2local, self.ncEvents, h.t, s.duration)
+        self.injectedSpikes += numInjected
+        self.injectTime += time.time() - start
+        return numInjected
+
+    # event injection cost per spike (us)
+    def injectionCost(self):
+        return self.injectTime / max(self.injectedSpikes, 1) * 1e6
+
+    # channel -> rank owning its PMd NSLOC (-1: none), from the innclDic of all ranks (collective: called by all ranks)
+    def buildScatterTable(self):
+        self.chan2rank = np.full(CH_END, -1, dtype=int)
+        rankKeys = s.pc.py_allgather(list(s.innclDic.keys())) if s.nhosts > 1 else [list(s.innclDic.keys())]
+        for rank in range(len(rankKeys)):
+            for key in rankKeys[rank]:
+                if 0 <= key < CH_END:
+                    self.chan2rank[key] = rank
+
+    # rank 0 splits the queue items of a callback by owning rank of each spike's channel and sends each rank its part:
+    # [next callback interval (ms), time of the last item (ms), CH_ID, Unit_ID, Time_stamp, ...]; no item: [next interval].
+    # Collective: called by all ranks every callback (qItems, nextInvl only used on rank 0). Returns the part of this rank
+    def exchangeSpikes(self, qItems = None, nextInvl = None):
+        parts = [[nextInvl]] * s.nhosts
+        if s.rank == 0 and qItems:
+            qItem = qItems[-1]
+            spkNum = int(qItem[SPKSZ - 1])
+            if spkNum == 0: # timeout item
+                itemTime = qItem[SPKSZ - 2] * 1000 + h.t # sec -> ms
+            else:
+                itemTime = qItem[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
+            spk = np.concatenate([np.asarray(item[:3 * int(item[SPKSZ - 1])], dtype=float) for item in qItems]).reshape(-1, 3)
+            channel = spk[:, 0].astype(int) - 1
+            owner = np.where((channel >= 0) & (channel < CH_END), self.chan2rank[channel.clip(0, CH_END - 1)], -1)
+            for rank in range(s.nhosts):
+                parts[rank] = [nextInvl, itemTime] + spk[owner == rank].flatten().tolist()
+                self.sentValues[rank] += len(parts[rank])
+            self.broadcastValues += (SPKSZ + 1) * len(qItems)
+        if s.nhosts == 1:
+            return parts[0]
+        return s.pc.py_alltoall(parts)[0] # part sent by rank 0
+
+    # communication volume per rank (rank 0), compared to broadcasting whole items
+    def commReport(self):
+        return '[server] values sent per rank: %s (broadcast: %d per rank)' % (self.sentValues, self.broadcastValues)
+
     # callback function for the DP (isDp = 1) and NSLOC (isDp = 0) model
     def callbackSlave(self):
         try:
@@ -254,52 +521,22 @@ class Event:
                     if isDp == 1:
                         self.qItem = queue.get()
                     else:
-                        n = pc.broadcast(s.vec, 0)
+                        spk = self.exchangeSpikes() # next interval and spikes of the PMd channels of this rank
+                        nextInvl = spk[0]
                 #except Queue.Empty as e:  # No item in Q
                 except:  # No item in Q
                     if verbose:
                         print("[callbackSlave] No item in Q")
                 else:
-                    if isDp == 0 and not n == 0: #NSLOC
+                    if isDp == 0 and len(spk) > 1: #NSLOC
                         #self.qItem = vec.to_python()
-                        if timeMeasure and self.write:
-                            deqTimeList.append(time.time() - timer)
-                            self.num += 1
-                            if self.num == iteration:
-                                self.write = 0
-                                if not os.path.exists(self.dir):
-                                    os.mkdir(self.dir)
-                                fname = self.dir + "/NslocPullTimefile"
-                                f1 = open(fname, "w+")
-                                for item in deqTimeList:
-                                    f1.write("%s\n" % item)
-                                f1.close()
-                                print("=======NslocPulltime printed!!!")
-                        spkNum = int(s.vec[SPKSZ - 1])
-                        # update current neuron time
-                        if spkNum == 0: # timeout item
-                            currSimTime = self.qItem[SPKSZ - 2] * 1000 + h.t # sec -> ms
-                        else:
-                            #currSimTime = self.qItem[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
-                            currSimTime = s.vec[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
+                        spkNum = (len(spk) - 2) // 3
+                        # update current neuron time (item time computed by rank 0)
+                        currSimTime = spk[1]
                         # [0]:CH_ID, [1]:Unit_ID, [2]: Time_stamp
-                        for i in range(spkNum):
-                            #timeStamp = self.qItem[3 * i + 2] * 1000  # second -> ms
-                            timeStamp = s.vec[3 * i + 2] * 1000  # second -> ms
-                            if h.t <= timeStamp and timeStamp <= duration: # queue spikes in the NEURON queue and ignore old spikes
-                                # Queue netcon event. CH_START = 1, CH_END = 96
-                                #localIndex = checkLocalIndexbyKey(int(self.qItem[3 * i] - 1), innclDic)
-                                localIndex = checkLocalIndexbyKey(s.innclDic, int(vec[3 * i] - 1))
-                                if not localIndex == -1:
-                                    #h.s.inncl.o(localIndex).event(timeStamp, 1)
-                                    s.inncl[localIndex].event(timeStamp, 1)
-                                if verbose:
-                                    print("[CallbackSlave] ChID:", self.qItem[3 * i], "UnitID:", self.qItem[3 * i + 1], "Time:", self.qItem[3 * i + 2] * 1000, "t: ", h.t)
-                                    #fdtime.write(str(int(self.qItem[3*i])) + '\t' +str(int(self.qItem[3*i+1])) + '\t' +str('{:g}'.format(self.qItem[3*i+2])) + '\n')
-                            else: # spike ignored. For dubug
-                                if verbose:
-                                    print("[CallbackSlave] ChID:", self.qItem[3 * i], "UnitID:", self.qItem[3 * i + 1], "Time:", self.qItem[3 * i + 2], "t: ", h.t)
-                                #fdtime2.write(str(int(self.qItem[3*i])) + '\t' +str(int(self.qItem[3*i+1])) + '\t' +str('{:g}'.format(self.qItem[3*i+2])) + '\t' + str(h.t/1000) + '\n')
+                        numInjected = self.injectSpikes(spk[2:], spkNum) # queue spikes in the NEURON queue and ignore old spikes
+                        if verbose:
+                            print("[CallbackSlave] spikes:", spkNum, "injected:", numInjected, "t: ", h.t)
                     # move t to currSimTime
                     #if currSimTime > h.t and currSimTime < duration:
                     if currSimTime > h.t:
@@ -312,8 +549,6 @@ class Event:
                     if verbose:
                         print("[CallbackSlave] currNeuronTime: ", currSimTime)
         except:
-            if isCommunication == 0:
-                self.fd.close()
             if verbose:
                 print("[CallbackSlave] exception occurs:", traceback.print_exc())
         finally: # update current neuron time
@@ -330,18 +565,17 @@ class Event:
         try:
             if isCommunication == 0: # No queue in the server process
                 if isDp == 0: # NSLOC and spikes from a file w/o communication
-                    #for locals in self.fd:
-                    for locals in self.fd:
-                        localts = locals.split()
-                        if localts[0] == '1': # spikes
-                            if unsortedSpkFilter and localts[2] == '0': # filter unsorted spikes
-                                continue
-                            else:
-                                tt = float(localts[3]) * 1000
-                                if tt > h.t:
-                                    s.inncl[int(localts[1]) - 1].event(tt, 1)
-                                    if verbose:
-                                        fdtime.write(str(1) + '\t' + str(int(localts[1])) + '\t' +str(int(localts[2])) + '\t' +str('{:g}'.format(float(localts[3]))) + '\n')
+                    # spikes of the next replayWnd ms from the spike store (no parsing)
+                    tEnd = h.t + replayWnd
+                    spikes = self.store.window(self.replayTime / 1000, tEnd / 1000) # ms -> sec
+                    self.replayTime = tEnd
+                    if unsortedSpkFilter: # filter unsorted spikes
+                        spikes = spikes[spikes['unit'] != 0]
+                    spk = np.column_stack((spikes['ch'], spikes['unit'], spikes['ts'])).ravel()
+                    numInjected = self.injectSpikes(spk, len(spikes))
+                    if verbose:
+                        for ch, unit, ts in spikes:
+                            fdtime.write(str(1) + '\t' + str(ch) + '\t' + str(unit) + '\t' + str('{:g}'.format(ts)) + '\n')
                 else: # DP
                     pass
             # get an item from the queue. Raise exception when it fails
@@ -350,32 +584,27 @@ class Event:
                     nextInvl = self.invl
                     currSimTime = h.t
                     newCurrTime.value = currSimTime
-                    if timeMeasure:
-                        timer = time.time()
                     if isDp == 1:
                         self.qItem = queue.get()
+                        stageTime = self.latency.record(DEQUEUE, queue.lastStamp)
                     else:
-                        self.qItem = queue.get(False) # Q has an item?
-                        n = pc.broadcast(s.vec.from_python(self.qItem), 0) # convert python list to hoc vector
-                except queue.Empty as e:  # No item in Q
-                    n = pc.broadcast(s.emptyVec, 0)
+                        self.qItems = []
+                        try:
+                            while len(self.qItems) < injectBatch: # Q has an item? (and those queued behind it)
+                                self.qItems.append(queue.get(False))
+                                stageTime = self.latency.record(DEQUEUE, queue.lastStamp)
+                        except Empty:
+                            pass
+                        nextInvl = self.scheduler.update(len(self.qItems) > 0, queue.qsize(), h.t)
+                        spk = self.exchangeSpikes(self.qItems, nextInvl) # send each rank the spikes of its PMd channels and the next interval
+                        if not self.qItems:
+                            raise Empty
+                        self.qItem = self.qItems[-1]
+                except Empty as e:  # No item in Q
                     if verbose:
                         print("[callback] No item in Q")
                 else:
                     if isDp == 1:
-                        if timeMeasure and self.write:
-                            deqTimeList.append(time.time() - timer)
-                            self.num += 1
-                            if self.num == iteration:
-                                self.write = 0
-                                if not os.path.exists(self.dir):
-                                    os.mkdir(self.dir)
-                                fname = self.dir + "/DpPullTimefile"
-                                f1 = open(fname, "w+")
-                                for item in deqTimeList:
-                                    f1.write("%s\n" % item)
-                                f1.close()
-                                print("=======DpPull time printed!!!")
                         # for debug
                         #if 0 and row > 0:#verbose:
                         #    f_handle = file('spk_rcv.txt', 'a')
@@ -391,41 +620,28 @@ class Event:
                             # Convert the python list to the hoc vector (h.mua)
                             self.vec = self.vec.from_python(self.qItem)
                             h.updateDpWithMua()
+                        self.latency.record(INJECT, stageTime)
                     else: #NSLOC
-                        if timeMeasure and self.write:
-                            deqTimeList.append(time.time() - timer)
-                            self.num += 1
-                            if self.num == iteration:
-                                self.write = 0
-                                if not os.path.exists(self.dir):
-                                    os.mkdir(self.dir)
-                                fname = self.dir + "/NslocPullTimefile"
-                                f1 = open(fname, "w+")
-                                for item in deqTimeList:
-                                    f1.write("%s\n" % item)
-                                f1.close()
-                                print("=======NslocPulltime printed!!!")
-                        spkNum = self.qItem[SPKSZ - 1]
-                        # update current neuron time
-                        if spkNum == 0: # timeout item
-                            currSimTime = self.qItem[SPKSZ - 2] * 1000 + h.t # sec -> ms
-                        else:
-                            currSimTime = self.qItem[(spkNum - 1) * 3 + 2] * 1000 # sec -> ms
+                        spkNum = 0
+                        for qItem in self.qItems: # oldest first
+                            # update current neuron time
+                            if int(qItem[SPKSZ - 1]) == 0: # timeout item
+                                currSimTime = qItem[SPKSZ - 2] * 1000 + h.t # sec -> ms
+                            else:
+                                currSimTime = qItem[(int(qItem[SPKSZ - 1]) - 1) * 3 + 2] * 1000 # sec -> ms
+                                if spkNum == 0:
+                                    firstTime = qItem[2] * 1000 # sec -> ms
+                            if self.arrayClock is not None: # several arrays: not ahead of any of them
+                                currSimTime = self.arrayClock.update(qItem, currSimTime)
+                            spkNum += int(qItem[SPKSZ - 1])
                         # [0]:CH_ID, [1]:Unit_ID, [2]: Time_stamp
-                        for i in range(spkNum):
-                            timeStamp = self.qItem[3 * i + 2] * 1000  # second -> ms
-                            if h.t <= timeStamp and timeStamp <= duration: # queue spikes in the NEURON queue and ignore old spikes
-                                # Queue netcon event. CH_START = 1, CH_END = 96
-                                localIndex = checkLocalIndexbyKey(s.innclDic, int(self.qItem[3 * i] - 1))
-                                if not localIndex == -1:
-                                    s.inncl[localIndex].event(timeStamp, 1)
-                                if verbose:
-                                    print("[Callback] ChID:", self.qItem[3 * i], "UnitID:", self.qItem[3 * i + 1], "Time:", self.qItem[3 * i + 2] * 1000, "t: ", h.t)
-                                    #fdtime.write(str(int(self.qItem[3*i])) + '\t' +str(int(self.qItem[3*i+1])) + '\t' +str('{:g}'.format(self.qItem[3*i+2])) + '\n')
-                            else: # spike ignored. For dubug
-                                if verbose:
-                                    print("[Callback] ChID:", self.qItem[3 * i], "UnitID:", self.qItem[3 * i + 1], "Time:", self.qItem[3 * i + 2], "t: ", h.t)
-                                    #fdtime.write(str(int(self.qItem[3*i])) + '\t' +str(int(self.qItem[3*i+1])) + '\t' +str('{:g}'.format(self.qItem[3*i+2])) + '\t' + str('{:g}'.format(h.t/1000)) + '\n')
+                        numLocal = (len(spk) - 2) // 3
+                        numInjected = self.injectSpikes(spk[2:], numLocal) # queue spikes of this rank in the NEURON queue and ignore old spikes
+                        self.latency.record(INJECT, stageTime) # includes sending the other ranks their spikes
+                        if spkNum > 0:
+                            self.scheduler.delivered(h.t - firstTime, numLocal - numInjected)
+                        if verbose:
+                            print("[Callback] spikes:", spkNum, "injected:", numInjected, "t: ", h.t)
                     # move t to currSimTime
                     if currSimTime > h.t:# and currSimTime < duration:
                         if simMode == 1: # online mode
@@ -440,12 +656,13 @@ class Event:
                             print("[Callback] currNeuronTime: ", currSimTime, nextInvl)
         except:
             if isCommunication == 0:
-                self.fd.close()
+                self.store = None # stop the replay
             if verbose:
                 print("[Callback] exception occurs:", traceback.print_exc())
         finally: # update current neuron time
             if isCommunication == 0:
-                pass
+                if self.store is not None and h.t + replayWnd <= s.duration:
+                    h.cvode.event(h.t + replayWnd, self.callback)
             else:
                 if newCurrTime.value + nextInvl <= duration:
                     h.cvode.event(newCurrTime.value + nextInvl, self.callback)
@@ -471,7 +688,7 @@ def nrn_py_connectPlxClient():
         data, addr = Sock.recvfrom(buf)
         print(data)
         dataLen = len(data)
-        dlen = dataLen / 2
+        dlen = dataLen // 2
         if dataLen == 2:
             cdata = struct.unpack('H' * dlen, data)
             if cdata[0] == ALIVE:
@@ -480,12 +697,12 @@ def nrn_py_connectPlxClient():
                 # send INITDATA to the client
                 a = array.array('H')
                 a.extend([INITDATA, comPort, isUdp, isDp, isLwc, binWnd, timeOut, unsortedSpkFilter, syncSpkFilter, verbose])
-                Sock.sendto(a.tostring(), addr)
+                Sock.sendto(a.tobytes(), addr)
                 if verbose:
                     print("I sent INITDATA")
                 data, addr = Sock.recvfrom(buf)
                 dataLen = len(data)
-                dlen = dataLen / 2
+                dlen = dataLen // 2
                 cdata = struct.unpack('H' * dlen, data)
                 if cdata[0] == ACK:
                     print("Connection success!!!")
@@ -582,45 +799,28 @@ def nrn_py_filterSyncSpk(spkArr):
         if syncSpkFilter == 1:
             row, col = spkArr.shape
             if row > 0:
-                if row == 1: # one element in spkArr
-                    newFltdArr = spkArr
-                else: # more than one in spkArr
-                    sync = 0
-                    baseValue = np.array(spkArr[0], ndmin = 2) # first elem in spkArr
-                    for ii in range(1, row): # 1, 2, 3, ..., m-1
-                        if baseValue[0][3] != spkArr[ii][3]:
-                            if sync == 0:
-                                newFltdArr = np.concatenate((newFltdArr, baseValue), axis = 0)
-                            else:
-                                sync = 0
-                        else:
-                            sync = 1
-                        baseValue = np.array(spkArr[ii], ndmin = 2)
-                    if sync == 0:
-                        newFltdArr = np.concatenate((newFltdArr, baseValue), axis = 0)
+                # keep spikes whose timestamp differs from both neighbours (runs of length 1)
+                newTS = np.diff(spkArr[:, 3]) != 0
+                keep = np.concatenate(([True], newTS)) & np.concatenate((newTS, [True]))
+                newFltdArr = spkArr[keep]
         else:
             # filtering spikes in a same sync window greater than 0.00025 (ms)
             if syncSpkFilter == 2:
                 newArr = np.concatenate((nrn_py_filterSyncSpk.FRem, spkArr), axis = 0)
                 row, col = newArr.shape
                 if row > 0:
-                    # sync window size is syncWnd
-                    # find the biggest "j"
-                    maxTS = newArr[row - 1][3]
-                    newJ = nrn_py_filterSyncSpk.jValue + 1
-                    while 1:
-                        if syncWnd * (newJ - 1) <= maxTS and maxTS < (syncWnd * newJ):
-                            break
-                        else:
-                            newJ += 1
-                    nrn_py_filterSyncSpk.FRem = newArr[newArr[:, 3] >= syncWnd * (newJ - 1)]
-                    for ii in range(nrn_py_filterSyncSpk.jValue, newJ - 1):
-                        newArr = newArr[newArr[:, 3] >= syncWnd * ii]
-                        temp = newArr[newArr[:, 3] < syncWnd * (ii + 1)]
-                        row, col = temp.shape
-                        if row == 1:
-                            newFltdArr = np.concatenate((newFltdArr, temp), axis = 0)
-                    nrn_py_filterSyncSpk.jValue = newJ - 1
+                    # sync window of each spike: j such that syncWnd * j <= TS < syncWnd * (j + 1)
+                    timeStamp = newArr[:, 3]
+                    j = nrn_py_syncWindow(timeStamp)
+                    # the window of the last spike may still get spikes: keep it for the next packet
+                    lastJ = max(int(j[row - 1]), nrn_py_filterSyncSpk.jValue)
+                    nrn_py_filterSyncSpk.FRem = newArr[timeStamp >= syncWnd * lastJ]
+                    # complete windows since the last packet with a single spike
+                    complete = (j >= nrn_py_filterSyncSpk.jValue) & (j < lastJ)
+                    j = j[complete]
+                    windows, index, counts = np.unique(j, return_index = True, return_counts = True)
+                    newFltdArr = newArr[complete][index[counts == 1]]
+                    nrn_py_filterSyncSpk.jValue = lastJ
             else:
                 print("Wrong filtering options")
     except:
@@ -628,6 +828,12 @@ def nrn_py_filterSyncSpk(spkArr):
     finally:
         return newFltdArr
 
+# sync window index of each timestamp (j such that syncWnd * j <= timeStamp < syncWnd * (j + 1))
+def nrn_py_syncWindow(timeStamp):
+    j = np.floor(timeStamp / syncWnd)
+    j -= syncWnd * j > timeStamp # correct floor division rounding at window edges
+    j += syncWnd * (j + 1) <= timeStamp
+    return j.astype(int)
 
 def nrn_py_filterUnsortedSpk(spkArr):
     try:
@@ -640,6 +846,18 @@ def nrn_py_filterUnsortedSpk(spkArr):
     finally:
         return newFltdArr
 
+# spike counts per channel (CH_END + 1 values, last one unused) of spike rows with valid channel and unit,
+# in each of numBins bins (bins = bin index of each row); returns (numBins x (CH_END + 1) counts, number of counted spikes)
+def nrn_py_countSpk(spkArr, bins = None, numBins = 1):
+    channelID = spkArr[:, 1]
+    unitID = spkArr[:, 2]
+    valid = (CH_START <= channelID) & (channelID <= CH_END) & (UNIT_START <= unitID) & (unitID <= UNIT_END)
+    index = channelID[valid].astype(int) - 1
+    if bins is not None:
+        index += bins[valid] * (CH_END + 1)
+    counts = np.bincount(index, minlength = numBins * (CH_END + 1)).reshape(numBins, CH_END + 1)
+    return counts, len(index)
+
 ##
 # mua, binningComplete = nrn_py_binSpk(spkArr, binStart, timeoutFlag)
 # Here mua is a numpy array, so it should be converted to python list.
@@ -653,11 +871,6 @@ def nrn_py_binSpk(spkArr, binStart, timeoutFlag):
         if not hasattr(nrn_py_binSpk, "BRem"):
             nrn_py_binSpk.BRem = np.zeros((0, 4)) # spikes
 
-        #if unsortedSpkFilter == 0:
-        #    UNIT_START = 0
-        #else:
-        #    UNIT_START = 1
-
         newBinnedMsg = np.zeros((CH_END + 1, 1))
         binningComplete = 0
         binEnd = (binStart + binWnd)/1000.0
@@ -665,24 +878,12 @@ def nrn_py_binSpk(spkArr, binStart, timeoutFlag):
 
         # concatenate
         newArr = np.concatenate((nrn_py_binSpk.BRem, spkArr), axis = 0)
-        nrn_py_binSpk.BRem = np.zeros((0, 4))
-        row, col = newArr.shape
-        if row > 0:
-            nrn_py_binSpk.BRem = newArr[newArr[:, 3] >= binEnd]
-            newArr = newArr[newArr[:, 3]< binEnd]
-            row, col = newArr.shape
-            if row > 0:
-                for j in range(row):
-                    channelID = newArr[j][1]
-                    unitID = newArr[j][2]
-                    timeStamp = newArr[j][3] #(ms)
-                    #Timestamp is in the current time interval
-                    if binStart <= timeStamp and timeStamp < binEnd:
-                        if CH_START <= channelID and channelID <= CH_END:
-                            if UNIT_START <= unitID and unitID <= UNIT_END:
-                                nrn_py_binSpk.dataHave += 1
-                                # Update spike counts/ch (MUA)
-                                nrn_py_binSpk.binnedMsg[channelID - 1] += 1
+        timeStamp = newArr[:, 3]
+        nrn_py_binSpk.BRem = newArr[timeStamp >= binEnd]
+        # Update spike counts/ch (MUA) with spikes in the current time interval
+        counts, numSpk = nrn_py_countSpk(newArr[(binStart <= timeStamp) & (timeStamp < binEnd)])
+        nrn_py_binSpk.binnedMsg[:, 0] += counts[0]
+        nrn_py_binSpk.dataHave += numSpk
         row, col = nrn_py_binSpk.BRem.shape
         if row > 0 or timeoutFlag == 1:
             binningComplete = 1
@@ -695,6 +896,47 @@ def nrn_py_binSpk(spkArr, binStart, timeoutFlag):
     finally:
         return (newBinnedMsg, binningComplete)
 
+##
+# muaBins = nrn_py_binSpkBins(spkArr, binStart, timeoutFlag)
+# Bins spikes into all the time intervals completed by spkArr at once (when the client falls behind,
+# a message can complete several intervals; nrn_py_binSpk completes one interval per message).
+# Returns a numpy array with the MUA of each completed interval (rows), starting at binStart; same
+# counts as calling nrn_py_binSpk for each interval. Shares the binning state of nrn_py_binSpk.
+def nrn_py_binSpkBins(spkArr, binStart, timeoutFlag):
+    muaBins = np.zeros((0, CH_END + 1))
+    try:
+        if not hasattr(nrn_py_binSpk, "binnedMsg"):
+            nrn_py_binSpk.binnedMsg = np.zeros((CH_END + 1, 1))
+            nrn_py_binSpk.dataHave = 0
+            nrn_py_binSpk.BRem = np.zeros((0, 4))
+
+        newArr = np.concatenate((nrn_py_binSpk.BRem, spkArr), axis = 0)
+        nrn_py_binSpk.BRem = np.zeros((0, 4))
+        timeStamp = newArr[:, 3]
+        # completed intervals: those ending at or before the last timestamp (at least one on timeout)
+        numBins = 0
+        if len(timeStamp) > 0:
+            maxTS = timeStamp.max()
+            numEnds = max(int((maxTS * 1000.0 - binStart) // binWnd), 0) + 2
+            binEnds = (binStart + binWnd * np.arange(1, numEnds + 1))/1000.0 # same values as binEnd in nrn_py_binSpk
+            numBins = int(np.searchsorted(binEnds, maxTS, 'right'))
+        if numBins == 0 and timeoutFlag == 1:
+            numBins = 1
+        binEnds = (binStart + binWnd * np.arange(1, numBins + 1))/1000.0
+        # interval of each spike (numBins = current incomplete interval); spikes before binStart are dropped
+        keep = timeStamp >= binStart/1000.0
+        bins = np.searchsorted(binEnds, timeStamp[keep], 'right')
+        counts, numSpk = nrn_py_countSpk(newArr[keep], bins, numBins + 1)
+        counts = counts.astype(float)
+        counts[0] += nrn_py_binSpk.binnedMsg[:, 0] # spikes of the current interval from previous messages
+        muaBins = counts[:numBins]
+        nrn_py_binSpk.binnedMsg = counts[numBins].reshape(CH_END + 1, 1).copy()
+        nrn_py_binSpk.dataHave = int(counts[numBins].sum())
+    except:
+        print("[nrn_py_binSpkBins] exception occurs:", sys.exc_info()[0])
+    finally:
+        return muaBins
+
 
 ##
 # The LWC server with the Lightweight client which sends raw data to the server
@@ -707,7 +949,6 @@ def nrn_py_interfaceDpLwc(dir):
 
     # MUA per channel in a binWnd: [spikes in ch0, spikes in ch1, ..., spikes in ch96, timeInterval]
     mua = [0] * (CH_END + 1)
-    buf = 4096
     if verbose:
         # Remove previous data files
         if isUdp:
@@ -732,38 +973,33 @@ def nrn_py_interfaceDpLwc(dir):
 
     # connect to Plexon client
     Sock, conn, addr = nrn_py_connectPlxClient()
+    stream = PlxStream(Sock if isUdp else conn, 4, isUdp) # rows of |data type|ch#|unit#|TS|
     SN = 1 # serial number
     lastEndTS = 0.0 # second
     binStart = 0
-
-    if timeMeasure:
-        mAddr0 = (ackServerIP, measurePort0)
-        mAddr1 = (ackServerIP, measurePort1)
-        mAddr2 = (ackServerIP, measurePort2)
-        mAddr3 = (ackServerIP, measurePort3)
-        totalMUA = 0
-
-        mSock = socket(AF_INET, SOCK_DGRAM)
-        mSock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        mA = array.array('H')
-        mA.extend([0])
-        fTimeNum = 1
-        bTimeList = []
+    latency = nrn_py_latencyRecorder(dir, "DpLwc")
+    recvTime = latencyNow() # when the buffered data was received
 
     # Rcv messages from the client
     while 1:
-        if verbose:
-            getTime1 = time.time()
-        if isUdp:
-            data, addr = Sock.recvfrom(buf)
-        else:
-            data = conn.recv(buf)
-        if verbose:
-            f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+        msgType, msg = stream.nextMessage()
+        if msgType is None: # no complete message in buffer
+            if verbose:
+                getTime1 = time.time()
+            if stream.fill() == 0: # connection closed
+                msgType = 'exit'
+            recvTime = latencyNow()
+            if verbose:
+                f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+            if msgType is None:
+                continue
         dataHave = 0
-        dataLen = len(data)
-        if data == 'exit':
+        if msgType == 'exit':
             print("Client has exited!")
+            backpressure.flush() # queue the item held by the coalesce policy
+            print(backpressure.report())
+            latency.export()
+            print(latency.report())
             if verbose:
                 print("Total spikes: ", totalSpikeCnt, "Valid spikes: ", validSpikeCnt)
                 f1.write('Total spikes: ' + str(totalSpikeCnt) + '\tValid spikes: ' + str(validSpikeCnt) + '\n')
@@ -773,85 +1009,46 @@ def nrn_py_interfaceDpLwc(dir):
             # close socket & generating exit and queue it
             Sock.close()
             sys.exit(0)
-        # The client sends data (>4) or a "NODATA" message when timeout occurs (==4)
-        elif dataLen >= 4:
+        # The client sends data rows or a "NODATA" message when timeout occurs
+        else:
             if verbose:
                 getTime2 = time.time()
             timeoutFlag = 0
-            if dataLen == 4:
+            if msgType == 'nodata':
                 cdataNp = np.zeros((0, 4))
                 timeoutFlag = 1
                 if verbose:
-                    print("No data")
+                    print("Client sends a NODATA message!")
+                    totalRcvBytes += NODATA_SIZE
             else:
-                if not isUdp:
-                    while dataLen % 32 != 0: # For avoiding errors because of MSS in TCP
-                        data += conn.recv(buf)
-                        dataLen = len(data)
-                dlen = dataLen / 8 # double : 8 bytes
-                drows = dlen / 4   # 4 fields : |data type|ch#|unit#|TS|
-                cdata = struct.unpack('d' * dlen, data)
-                cdataNp = np.asarray(cdata).reshape(drows, 4) # convert tuple to 2D numpy array
-            if timeMeasure:
-                mA[0] = O_RCV
-                mSock.sendto(mA.tostring(), mAddr3)
-
-                #### for filtering
-                mA[0] = O_SND
-                mSock.sendto(mA.tostring(), mAddr1)
-                ####
+                cdataNp = msg # 2D numpy view (rows of |data type|ch#|unit#|TS|) into the receive buffer
+            stageTime = latency.record(RECEIVE, recvTime)
             # filtering
             if syncSpkFilter > 0 and isLwc == 1:
                 cdataNp = nrn_py_filterSyncSpk(cdataNp)
             if unsortedSpkFilter == 1 and isLwc == 1:
                 cdataNp = nrn_py_filterUnsortedSpk(cdataNp);
-            if timeMeasure:
-                #### for filtering
-                mA[0] = O_RCV
-                mSock.sendto(mA.tostring(), mAddr1)
-                ####
+            stageTime = latency.record(FILTER, stageTime)
             # binning (Lwc)
             if isDp == 1 and isLwc == 1: # binning in the DP model with the HWC mode
-                if timeMeasure:
-                    mA[0] = O_SND
-                    mSock.sendto(mA.tostring(), mAddr2)
-                mua, binningComplete = nrn_py_binSpk(cdataNp, binStart, timeoutFlag)
-                if binningComplete == 1:
-                    row, col = mua.shape
-                    mua = mua[:, 0].tolist() # [[],[],..,[]] -> [, , ,..., ]
-                    if row == 0:
-                        mua = [-1] * (CH_END + 1) # for no mua data
+                if binCatchUp:
+                    muaBins = nrn_py_binSpkBins(cdataNp, binStart, timeoutFlag)
+                else:
+                    mua, binningComplete = nrn_py_binSpk(cdataNp, binStart, timeoutFlag)
+                    muaBins = mua.T[:binningComplete]
+                stageTime = latency.record(BIN, stageTime)
+                for mua in muaBins: # completed binning windows
+                    mua = mua.tolist()
                     mua[CH_END] = (binStart + binWnd) / binWnd # binning window
                     binStart = binStart + binWnd;
                     if verbose:
-                        print("Client sends a NODATA message!")
-                        timeStamp = cdata[1]
-                        totalRcvBytes += NODATA_SIZE
+                        timeStamp = binStart # end of the binning window (second)
                         f1.write(str(timeStamp) + '\n')
                         f2.write(str(timeStamp) + '\t' + str(spikePerTS) + '\t' + str(totalSpikeCnt) + '\t' + str(NODATA_SIZE) + '\n')
                         qtime = time.time()
-                    if timeMeasure:
-                        mA[0] = O_RCV
-                        mSock.sendto(mA.tostring(), mAddr2)
-                        #mA[0] = O_END
-                        #mSock.sendto(mA.tostring(), mAddr)
-                        timer = time.time()
 
                     feedQueue(mua, verbose) # add 0 + timeStamp to the queue
-
-                    if timeMeasure: # timing measure
-                        totalMUA +=1
-                        if totalMUA <= iteration:
-                            qTimeList.append(time.time() - timer)
-                        if totalMUA == iteration + 1:
-                            if not os.path.exists(dir):
-                                os.mkdir(dir)
-                            fname = dir + "/LwcDpPushTimeFile"
-                            f1 = open(fname, "w+")
-                            for item in qTimeList:
-                                f1.write("%s\n" % item)
-                            f1.close()
-                            print("====LwcDp push")
+                    stageTime = latency.record(ENQUEUE, stageTime)
 
                     if verbose:
                         a = time.time() - qtime
@@ -866,7 +1063,6 @@ def nrn_py_interfaceDpHwc(dir):
     print("nrn_py_interfaceDpHwc running...")
     # MUA per channel in a binWnd: [spikes in ch0, spikes in ch1, ..., spikes in ch96, timeInterval]
     mua = [0] * (CH_END + 1)
-    buf = 4096
 
     if verbose:
         # Remove previous data files
@@ -890,34 +1086,32 @@ def nrn_py_interfaceDpHwc(dir):
 
     # connect to Plexon client
     Sock, conn, addr = nrn_py_connectPlxClient()
+    stream = PlxStream(Sock if isUdp else conn, CH_END + 1, isUdp) # messages of DATA_SIZE bytes
     SN = 1 # serial number
     lastEndTS = 0.0 # second
+    latency = nrn_py_latencyRecorder(dir, "DpHwc")
+    recvTime = latencyNow() # when the buffered data was received
 
     # Rcv messages from the client
-    if timeMeasure:
-        totalMUA = 0
-        mAddr0 = (ackServerIP, measurePort0)
-        mAddr1 = (ackServerIP, measurePort1)
-        mAddr2 = (ackServerIP, measurePort2)
-        mAddr3 = (ackServerIP, measurePort3)
-        mSock = socket(AF_INET, SOCK_DGRAM)
-        mSock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        mA = array.array('H')
-        mA.extend([0])
-        number = 1
     while 1:
-        if verbose:
-            getTime1 = time.time()
-        if isUdp:
-            data, addr = Sock.recvfrom(buf)
-        else:
-            data = conn.recv(buf)
-        if verbose:
-            f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+        msgType, msg = stream.nextMessage(1) # one DATA_SIZE message at a time
+        if msgType is None: # no complete message in buffer
+            if verbose:
+                getTime1 = time.time()
+            if stream.fill() == 0: # connection closed
+                msgType = 'exit'
+            recvTime = latencyNow()
+            if verbose:
+                f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+            if msgType is None:
+                continue
         dataHave = 0
-        dataLen = len(data)
-        if data == 'exit':
+        if msgType == 'exit':
             print("Client has exited!")
+            backpressure.flush() # queue the item held by the coalesce policy
+            print(backpressure.report())
+            latency.export()
+            print(latency.report())
             if verbose:
                 print("Total spikes: ", totalSpikeCnt, "Valid spikes: ", validSpikeCnt)
                 f1.write('Total spikes: ' + str(totalSpikeCnt) + '\tValid spikes: ' + str(validSpikeCnt) + '\n')
@@ -927,13 +1121,13 @@ def nrn_py_interfaceDpHwc(dir):
             # close socket & generating exit and queue it
             Sock.close()
             sys.exit(0)
-        # The client sends data (>4) or a "NODATA" message when timeout occurs (==4)
-        elif dataLen >= 4:
+        # The client sends data rows or a "NODATA" message when timeout occurs
+        else:
             if verbose:
                 getTime2 = time.time()
-            if dataLen == 4:
-                #'H': unsigned short (2bytes)
-                cdata = struct.unpack('H' * 2, data)
+            stageTime = latency.record(RECEIVE, recvTime)
+            if msgType == 'nodata':
+                cdata = msg # (header ID, time interval)
                 mua = [-1] * (CH_END + 1)
                 mua[CH_END] = cdata[1] # binning window
                 if verbose:
@@ -944,52 +1138,27 @@ def nrn_py_interfaceDpHwc(dir):
                     f2.write(str(timeStamp) + '\t' + str(spikePerTS) + '\t' + str(totalSpikeCnt) + '\t' + str(NODATA_SIZE) + '\n')
                     qtime = time.time()
                 feedQueue(mua, verbose) # add 0 + timeStamp to the queue
+                latency.record(ENQUEUE, stageTime)
                 if verbose:
                     a = time.time() - qtime
                 if 0:
                     print("No data")
             else:
-                if not isUdp:
-                    # DATA_SIZE = (CH_END + 1) * 8 # 1 for binning window. 8 is double in Matlab
-                    while dataLen < DATA_SIZE: # For avoiding errors because of MSS in TCP
-                        data += conn.recv(buf)
-                        dataLen = len(data)
-                dlen = dataLen / 8 # double : 8 bytes # [ch1|ch2|...|ch96|binning window]
-                mua = struct.unpack('d' * dlen, data)
-
-                if timeMeasure:
-                    mA[0] = O_RCV
-                    mSock.sendto(mA.tostring(), mAddr3)
-                    timer = time.time()
+                mua = msg[0].tolist() # [ch1|ch2|...|ch96|binning window]
 
                 feedQueue(mua, verbose)
-
-                if timeMeasure: # timing measure
-                    totalMUA +=1
-                    if totalMUA <= iteration:
-                        qTimeList.append(time.time() - timer)
-                    if totalMUA == iteration + 1:
-                        if not os.path.exists(dir):
-                            os.mkdir(dir)
-                        fname = dir + "/HwcDpPushTimeFile"
-                        f1 = open(fname, "w+")
-                        for item in qTimeList:
-                            f1.write("%s\n" % item)
-                        f1.close()
-                        print("==========HwcDpPushTimeFile")
+                latency.record(ENQUEUE, stageTime)
 
                 if verbose:
                     totalRcvBytes += DATA_SIZE
                     # for verification between client and server
-                    timeStamp = cdata[dataOffset + 1 + CH_END * 6] * binWnd
-                    f3.write(str(timeStamp))
+                    timeStamp = mua[CH_END] * binWnd # binning window -> end of the window
+                    f3.write(str(timeStamp)) # per-unit counts are not in the message (MUA per channel only)
                     # print MUA/ch only
                     f1.write(str(timeStamp))
                     for i in range(CH_END):
                         spikePerTS += mua[i]
-                        f1.write('\t' + str(mua[i])) # 6=> ch:unit0:unit1:unit2:unit3:unit4
-                        for j in range(UNIT_END + 1):
-                            f3.write('\t' + str(cdata[dataOffset + 1 + i * 6 + 1 + j]))
+                        f1.write('\t' + str(mua[i]))
                     f1.write('\n')
                     f3.write('\n')
                     totalSpikeCnt += spikePerTS
@@ -1004,7 +1173,6 @@ def nrn_py_interfaceNsloc(dir):
     print("[nrn_py_interfaceNsloc running...]")
     # Monkey spike: [Channel ID, Unit ID, timestamp]
     spk = [0] * (SPKSZ + 1) # = 3 * SPKNUM + 1 + Serial Number
-    buf = 4096
 
     if verbose:
         # Remove previous data files
@@ -1027,35 +1195,32 @@ def nrn_py_interfaceNsloc(dir):
 
     # connect to Plexon client
     Sock, conn, addr = nrn_py_connectPlxClient()
+    stream = PlxStream(Sock if isUdp else conn, 4, isUdp) # rows of |data type|ch#|unit#|TS|
     SN = 1 # serial number
     lastEndTS = 0.0 # second
+    latency = nrn_py_latencyRecorder(dir, "Nsloc")
+    recvTime = latencyNow() # when the buffered data was received
 
-    if timeMeasure:
-        totalMUA = 0
-        mAddr0 = (ackServerIP, measurePort0)
-        mAddr1 = (ackServerIP, measurePort1)
-        mAddr2 = (ackServerIP, measurePort2)
-        mAddr3 = (ackServerIP, measurePort3)
-        mSock = socket(AF_INET, SOCK_DGRAM)
-        mSock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        mA = array.array('H')
-        mA.extend([0])
-        bTimeList = []
-        number = 1
     # Rcv messages from the client
     while 1:
-        if verbose:
-            getTime1 = time.time()
-        if isUdp:
-            data, addr = Sock.recvfrom(buf)
-        else:
-            data = conn.recv(buf)
-        if verbose:
-            f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+        msgType, msg = stream.nextMessage()
+        if msgType is None: # no complete message in buffer
+            if verbose:
+                getTime1 = time.time()
+            if stream.fill() == 0: # connection closed
+                msgType = 'exit'
+            recvTime = latencyNow()
+            if verbose:
+                f3.write("gTime1: " + str(time.time() - getTime1) + "\t")
+            if msgType is None:
+                continue
         dataHave = 0
-        dataLen = len(data)
-        if data == 'exit':
+        if msgType == 'exit':
             print("Client has exited!")
+            backpressure.flush() # queue the item held by the coalesce policy
+            print(backpressure.report())
+            latency.export()
+            print(latency.report())
             if verbose:
                 print("Total spikes: ", totalSpikeCnt, "Valid spikes: ", validSpikeCnt)
                 f1.write('Total spikes: ' + str(totalSpikeCnt) + '\tValid spikes: ' + str(validSpikeCnt) + '\n')
@@ -1065,52 +1230,27 @@ def nrn_py_interfaceNsloc(dir):
             # close socket & generating exit and queue it
             Sock.close()
             sys.exit(0)
-        # The client sends data (>4) or a "NODATA" message when timeout occurs (==4)
-        elif dataLen >= 4:
+        # The client sends data rows or a "NODATA" message when timeout occurs
+        else:
             if verbose:
                 getTime2 = time.time()
             timeoutFlag = 0
-            if dataLen == 4:
+            if msgType == 'nodata':
                 cdataNp = np.zeros((0, 4))
                 timeoutFlag = 1
                 if 0:
                     print("No data")
             else:
-                if not isUdp:
-                    while dataLen % 32 != 0: # For avoiding errors because of MSS in TCP
-                        data += conn.recv(buf)
-                        dataLen = len(data)
-                dlen = dataLen / 8 # double : 8 bytes
-                drows = dlen / 4   # 4 fields : |data type|ch#|unit#|TS|
-                cdata = struct.unpack('d' * dlen, data)
-                cdataNp = np.asarray(cdata).reshape(drows, 4) # convert tuple to 2D numpy array
-            if timeMeasure:
-                mA[0] = O_RCV
-                mSock.sendto(mA.tostring(), mAddr3)
-                #number += 1
+                cdataNp = msg # 2D numpy view (rows of |data type|ch#|unit#|TS|) into the receive buffer
+            stageTime = latency.record(RECEIVE, recvTime)
             if isLwc == 1:
-                if timeMeasure:
-                    #### ack_rcv1 for filtering
-                    mA[0] = O_SND
-                    mSock.sendto(mA.tostring(), mAddr1)
-
                 if syncSpkFilter > 0:
                     cdataNp = nrn_py_filterSyncSpk(cdataNp)
                 if unsortedSpkFilter == 1:
                     cdataNp = nrn_py_filterUnsortedSpk(cdataNp);
-
-            if timeMeasure:
-                #### ack_rcv1 for filtering
-                mA[0] = O_RCV
-                mSock.sendto(mA.tostring(), mAddr1)
+            stageTime = latency.record(FILTER, stageTime)
 
             drows, col = cdataNp.shape
-            if timeMeasure:
-                #mA[0] = O_FLT
-                #mSock.sendto(mA.tostring(), mAddr)
-                #### ack_rcv2 for buffering
-                mA[0] = O_SND
-                mSock.sendto(mA.tostring(), mAddr2)
             # "NODATA" message
             if drows == 0 and timeoutFlag == 1:
                 if verbose:
@@ -1128,6 +1268,7 @@ def nrn_py_interfaceNsloc(dir):
                     f3.write("loopTime: " + str(time.time()- a) + "\t")
                     qtime = time.time()
                 feedQueue(spk, verbose) #queue.put(spk)
+                latency.record(ENQUEUE, stageTime)
                 if verbose:
                     f3.write("qTime: " + str(time.time()- qtime) + "\n")
                     a = time.time()
@@ -1169,35 +1310,11 @@ def nrn_py_interfaceNsloc(dir):
                             f3.write("loopTime: " + str(time.time()- a) + "\t")
                             qtime = time.time()
 
-                        if timeMeasure:
-                            #### ack_rcv2 for buffering
-                            mA[0] = O_RCV
-                            mSock.sendto(mA.tostring(), mAddr2)
-                            #### ack_rcv2 for buffering
-                            mA[0] = O_SND
-                            mSock.sendto(mA.tostring(), mAddr2)
-                            #mA[0] = O_END
-                            #mSock.sendto(mA.tostring(), mAddr)
-
-                            timer = time.time()
-
+                        stageTime = latency.record(BIN, stageTime) # packing spikes into the item
                         feedQueue(spk, verbose) #queue.put(spk)
+                        stageTime = latency.record(ENQUEUE, stageTime)
                         dataHave = 0
 
-                        if timeMeasure: # timing measure
-                            totalMUA +=1
-                            if totalMUA <= iteration:
-                                qTimeList.append(time.time() - timer)
-                            if totalMUA == iteration + 1:
-                                if not os.path.exists(dir):
-                                    os.mkdir(dir)
-                                fname = dir + "/NslocPushTimeFile"
-                                f1 = open(fname, "w+")
-                                for item in qTimeList:
-                                    f1.write("%s\n" % item)
-                                f1.close()
-                                print("Nsloc push")
-                            btime = time.time()
                         if verbose:
                             f3.write("qTime: " + str(time.time()- qtime) + "\n")
                             a = time.time()
@@ -1211,57 +1328,34 @@ def serverNoComm(dir):
     try:
         if isDp == 1: # inputs through DP cells
             mua = [0] * (CH_END + 1)
-            fname = dir + "/StoredMua.tsv"
-            fd = open(fname, 'r')
-            for ii in range(1000): # 1000 binned data sets for 100 s
-                line = fd.readline()
-                binnedMUA = line.split()
+            storedMua = spikestore.loadMua(dir + "/StoredMua.tsv", CH_END) # |bin end (ms)|MUA ch1|...|, memory-mapped
+            for binnedMUA in storedMua[:1000]: # 1000 binned data sets for 100 s
                 mua[CH_END] = int(binnedMUA[0])/binWnd
-                for i in range(CH_END): # index: 0 ~ 96
-                    mua[i] = int(binnedMUA[i+1])
+                mua[:CH_END] = binnedMUA[1:CH_END + 1].astype(int).tolist()
                 feedQueue(mua, verbose)
-                time.sleep(0.1) # emulating 100 ms delay
-                #print "%s" % (line)
+                time.sleep(binWnd / 1000.0 / replaySpeed if replaySpeed > 0 else 0.1) # emulating 100 ms delay
         else: # inputs through NSLOC units
             # Monkey spike: [Channel ID, Unit ID, timestamp]
-            spk = [0] * (SPKSZ + 1) # = 3 * SPKNUM + 1 + Serial Number
-            dataHave = 0
+            store = spikestore.openStore(dir + "/spikePMd-6sec.tsv") # converted to a spike store once
+            start = time.time()
             SN = 1
-            fname = dir + "/spikePMd-6sec.tsv"
-            #fname = dir + "/4.tsv"
-            fd = open(fname, 'r')
-            for locals in fd:
-                localts = locals.split()
-                if localts[0] == '1': # spikes
-                    channelID = int(localts[1])
-                    unitID = int(localts[2])
-                    timeStamp = float(localts[3])  # (second)
-                    #if unsortedSpkFilter and unitID == 0: # filter unsorted spikes
-                    #    continue
-                    #else:
-                    if True:
-                        if CH_START <= channelID and channelID <= CH_END:
-                            if UNIT_START <= unitID and unitID <= UNIT_END:
-                                spk[dataHave * 3] = channelID
-                                spk[dataHave * 3 + 1] = unitID
-                                spk[dataHave * 3 + 2] = timeStamp
-                                dataHave += 1
-                        if dataHave == SPKNUM:
-                            spk[SPKSZ - 1] = dataHave
-                            spk[SPKSZ] = SN # serial number from 1
-                            SN += 1
-                            feedQueue(spk, verbose) #queue.put(spk)
-                            dataHave = 0
-            if dataHave > 0:
-                spk[SPKSZ - 1] = dataHave
-                spk[SPKSZ] = SN # serial number from 1
-                feedQueue(spk, verbose) #queue.put(spk)
-                dataHave = 0
+            for records in store.chunks(SPKNUM * 100):
+                valid = (CH_START <= records['ch']) & (records['ch'] <= CH_END) & (UNIT_START <= records['unit']) & (records['unit'] <= UNIT_END)
+                records = records[valid]
+                spikes = np.column_stack((records['ch'], records['unit'], records['ts'])) # |CH_ID|Unit_ID|Time_stamp| (second)
+                for spk in nrn_py_spikeItems(spikes, SN):
+                    if replaySpeed > 0: # wait for the time of the last spike of the item
+                        delay = (spk[(spk[SPKSZ - 1] - 1) * 3 + 2] - store.tStart) / replaySpeed - (time.time() - start)
+                        if delay > 0:
+                            time.sleep(delay)
+                    feedQueue(spk, verbose) #queue.put(spk)
+                SN += (len(spikes) + SPKNUM - 1) // SPKNUM
     except:
         print("[serverNoComm] exception occurs:", sys.exc_info()[0])
     finally:
         print("[ServerNoComm is terminated!!!]")
-        fd.close()
+        backpressure.flush() # queue the item held by the coalesce policy
+        print(backpressure.report())
         sys.exit(0)
 
 
@@ -1272,7 +1366,11 @@ class Manager:
 
     def start(self):
         if localFileRead == 0: # spikes delivered through network
-            if isDp == 1: # DP
+            if isAsync: # several clients in numServerProcs processes
+                import aioserver
+                for proc in range(numServerProcs):
+                    self.workers.append(Process(target=aioserver.serve, args = (self.dir, proc)))
+            elif isDp == 1: # DP
                 if isLwc == 0: # Hwc mode
                     self.workers.append(Process(target=nrn_py_interfaceDpHwc, args = (self.dir, ) ))
                 else:          # Lwc mode
@@ -0,0 +1,589 @@
+"""
+serverBenchmark.py
+
+Benchmarks of the server path: spike ingestion (previous receive loop vs plxstream, TCP loopback), binning,
+sync filtering, queue latency (Manager queue vs ringbuffer), backpressure policies, spike injection (needs NEURON),
+latency histograms, load test of a server worker with plxclient (needs NEURON) and the asyncio server (multi)
+
+Usage: python serverBenchmark.py [numSpikes] [spikesPerChunk]
+       python serverBenchmark.py binning [packetMs] [duration]
+       python serverBenchmark.py filtering
+       python serverBenchmark.py queue [numItems] [intervalUs]
+       python serverBenchmark.py backpressure [numItems]
+       python serverBenchmark.py inject [numSpikes]
+       python serverBenchmark.py latency [numSamples]
+       python serverBenchmark.py load [nsloc|dplwc|dphwc] [tcp|udp] [startRate] [duration] [burstSize] [packetMs]
+       python serverBenchmark.py multi [numClients] [rate per client] [duration] [tcp|udp]
+"""
+
+import os
+import sys
+import time
+import struct
+import socket
+import numpy as np
+from multiprocessing import Process, Manager, Value, Array, Queue
+from plxstream import PlxStream
+from ringbuffer import SpscRing, RingSet
+from backpressure import Backpressure
+import latency
+
+port = 9998
+
+
+# client: send numSpikes rows in chunks of spikesPerChunk, then 'exit'
+def client(numSpikes, spikesPerChunk):
+    rows = np.zeros((numSpikes, 4))
+    rows[:, 0] = 1 # spikes
+    rows[:, 1] = np.random.randint(1, 97, numSpikes) # channel
+    rows[:, 2] = np.random.randint(0, 5, numSpikes) # unit
+    rows[:, 3] = np.cumsum(np.random.exponential(1e-4, numSpikes)) # timestamp (s)
+    data = rows.tobytes()
+    chunkSize = 32 * spikesPerChunk
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    for i in range(0, len(data), chunkSize):
+        sock.sendall(data[i:i+chunkSize])
+    time.sleep(0.2) # so 'exit' is received separately (legacy receiver needs it)
+    sock.sendall(b'exit')
+    sock.close()
+
+
+# previous receive path; returns number of spikes decoded
+def receiveLegacy(conn):
+    buf = 4096
+    numSpikes = 0
+    while 1:
+        data = conn.recv(buf)
+        dataLen = len(data)
+        if data == b'exit' or dataLen == 0:
+            return numSpikes
+        elif dataLen >= 4:
+            while dataLen % 32 != 0: # For avoiding errors because of MSS in TCP
+                data += conn.recv(buf)
+                dataLen = len(data)
+            dlen = dataLen // 8 # double : 8 bytes
+            drows = dlen // 4   # 4 fields : |data type|ch#|unit#|TS|
+            cdata = struct.unpack('d' * dlen, data)
+            cdataNp = np.asarray(cdata).reshape(drows, 4) # convert tuple to 2D numpy array
+            numSpikes += int((cdataNp[:, 0] == 1).sum())
+
+
+# new receive path; returns number of spikes decoded
+def receiveStream(conn):
+    stream = PlxStream(conn, 4)
+    numSpikes = 0
+    while 1:
+        msgType, cdataNp = stream.nextMessage()
+        if msgType is None:
+            if stream.fill() == 0:
+                return numSpikes
+        elif msgType == 'exit':
+            return numSpikes
+        elif msgType == 'data':
+            numSpikes += int((cdataNp[:, 0] == 1).sum())
+
+
+# run client and one receiver; returns (spikes received, wall time, receiver CPU time)
+def benchmark(receiver, numSpikes, spikesPerChunk):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', port))
+    server.listen(1)
+    proc = Process(target=client, args=(numSpikes, spikesPerChunk))
+    proc.start()
+    conn, addr = server.accept()
+    start = time.time()
+    cpuStart = time.process_time()
+    received = receiver(conn)
+    cpu = time.process_time() - cpuStart
+    wall = time.time() - start - 0.2 # exclude client pause before 'exit'
+    proc.join()
+    conn.close()
+    server.close()
+    return received, wall, cpu
+
+
+# previous binning stage (per-spike loop); same interface and state handling as server.nrn_py_binSpk
+def binSpkLegacy(spkArr, binStart, timeoutFlag, server):
+    if not hasattr(binSpkLegacy, "BRem"):
+        binSpkLegacy.binnedMsg = np.zeros((server.CH_END + 1, 1))
+        binSpkLegacy.dataHave = 0
+        binSpkLegacy.BRem = np.zeros((0, 4))
+    newBinnedMsg = np.zeros((server.CH_END + 1, 1))
+    binningComplete = 0
+    binEnd = (binStart + server.binWnd)/1000.0
+    binStart = binStart/1000.0
+    newArr = np.concatenate((binSpkLegacy.BRem, spkArr), axis = 0)
+    binSpkLegacy.BRem = newArr[newArr[:, 3] >= binEnd]
+    newArr = newArr[newArr[:, 3] < binEnd]
+    for j in range(len(newArr)):
+        channelID = newArr[j][1]
+        unitID = newArr[j][2]
+        timeStamp = newArr[j][3]
+        if binStart <= timeStamp and timeStamp < binEnd:
+            if server.CH_START <= channelID and channelID <= server.CH_END:
+                if server.UNIT_START <= unitID and unitID <= server.UNIT_END:
+                    binSpkLegacy.dataHave += 1
+                    binSpkLegacy.binnedMsg[int(channelID) - 1] += 1
+    if len(binSpkLegacy.BRem) > 0 or timeoutFlag == 1:
+        binningComplete = 1
+        if binSpkLegacy.dataHave:
+            newBinnedMsg = binSpkLegacy.binnedMsg
+            binSpkLegacy.dataHave = 0
+            binSpkLegacy.binnedMsg = np.zeros((server.CH_END + 1, 1))
+    return (newBinnedMsg, binningComplete)
+
+
+# synthetic messages of the lightweight client: rows of |data type|ch#|unit#|TS| at rate spikes/s, one message per packetMs
+def spikeMessages(rate, duration, packetMs):
+    numSpikes = int(rate * duration)
+    rows = np.zeros((numSpikes, 4))
+    rows[:, 0] = 1 # spikes
+    rows[:, 1] = np.random.randint(0, 100, numSpikes) # channel (incl. invalid channels)
+    rows[:, 2] = np.random.randint(0, 6, numSpikes) # unit (incl. invalid units)
+    rows[:, 3] = np.sort(np.random.uniform(0, duration, numSpikes)) # timestamp (s)
+    edges = np.searchsorted(rows[:, 3], np.arange(0, duration, packetMs/1000.0)[1:])
+    return np.split(rows, edges)
+
+
+# run binning stage over messages as the DP-LWC worker does; returns (list of MUA of completed windows, CPU time)
+def runBinning(binSpk, messages, server, catchUp):
+    binStart = 0
+    muaAll = []
+    cpuStart = time.process_time()
+    for spkArr in messages + [np.zeros((0, 4))] * (0 if catchUp else 10 * len(messages)): # flush remaining windows
+        if catchUp:
+            muaBins = binSpk(spkArr, binStart, 0)
+        else:
+            mua, binningComplete = binSpk(spkArr, binStart, 0)
+            muaBins = mua.T[:binningComplete]
+            if binningComplete == 0 and len(spkArr) == 0:
+                break
+        for mua in muaBins:
+            muaAll.append(np.array(mua[:server.CH_END]))
+            binStart += server.binWnd
+    return muaAll, time.process_time() - cpuStart
+
+
+def benchmarkBinning(packetMs, duration):
+    import server
+    print('Binning (%d ms windows), messages of %g ms of spikes, %g s of spikes:' % (server.binWnd, packetMs, duration))
+    for rate in [1e4, 1e5, 1e6]:
+        messages = spikeMessages(rate, duration, packetMs)
+        results = []
+        for name, binSpk, catchUp in [('legacy', lambda *args: binSpkLegacy(*args, server=server), 0), ('vectorized', server.nrn_py_binSpk, 0), ('catch-up', server.nrn_py_binSpkBins, 1)]:
+            for func in [binSpkLegacy, server.nrn_py_binSpk]: # reset binning state
+                for attr in ['binnedMsg', 'dataHave', 'BRem']:
+                    if hasattr(func, attr):
+                        delattr(func, attr)
+            muaAll, cpu = runBinning(binSpk, messages, server, catchUp)
+            results.append(muaAll)
+            same = len(muaAll) == len(results[0]) and all(np.array_equal(a, b) for a, b in zip(muaAll, results[0]))
+            print('  %.0e spikes/s, %s: %d windows; CPU %.3f us/spike (%.0f spikes/s); same as legacy: %s' % (rate, name, len(muaAll), cpu/len(np.concatenate(messages))*1e6, len(np.concatenate(messages))/max(cpu, 1e-9), same))
+
+
+# previous sync spike filters (loops); same state handling as server.nrn_py_filterSyncSpk
+def filterSyncSpkLegacy(spkArr, syncSpkFilter, syncWnd):
+    if not hasattr(filterSyncSpkLegacy, "FRem"):
+        filterSyncSpkLegacy.FRem = np.zeros((0, 4))
+        filterSyncSpkLegacy.jValue = 0
+    newFltdArr = np.zeros((0, 4))
+    if syncSpkFilter == 1:
+        row = len(spkArr)
+        if row == 1:
+            newFltdArr = spkArr
+        elif row > 1:
+            sync = 0
+            baseValue = np.array(spkArr[0], ndmin = 2)
+            for ii in range(1, row):
+                if baseValue[0][3] != spkArr[ii][3]:
+                    if sync == 0:
+                        newFltdArr = np.concatenate((newFltdArr, baseValue), axis = 0)
+                    else:
+                        sync = 0
+                else:
+                    sync = 1
+                baseValue = np.array(spkArr[ii], ndmin = 2)
+            if sync == 0:
+                newFltdArr = np.concatenate((newFltdArr, baseValue), axis = 0)
+    else:
+        newArr = np.concatenate((filterSyncSpkLegacy.FRem, spkArr), axis = 0)
+        row = len(newArr)
+        if row > 0:
+            maxTS = newArr[row - 1][3]
+            newJ = filterSyncSpkLegacy.jValue + 1
+            while not (syncWnd * (newJ - 1) <= maxTS and maxTS < (syncWnd * newJ)):
+                newJ += 1
+            filterSyncSpkLegacy.FRem = newArr[newArr[:, 3] >= syncWnd * (newJ - 1)]
+            for ii in range(filterSyncSpkLegacy.jValue, newJ - 1):
+                newArr = newArr[newArr[:, 3] >= syncWnd * ii]
+                temp = newArr[newArr[:, 3] < syncWnd * (ii + 1)]
+                if len(temp) == 1:
+                    newFltdArr = np.concatenate((newFltdArr, temp), axis = 0)
+            filterSyncSpkLegacy.jValue = newJ - 1
+    return newFltdArr
+
+
+def benchmarkFiltering():
+    import server
+    print('Sync spike filters (sync window %g s):' % server.syncWnd)
+    for mode in [1, 2]:
+        server.syncSpkFilter = mode
+        for packetSize in [100, 1000, 10000]:
+            rows = np.zeros((20 * packetSize, 4))
+            rows[:, 0] = 1
+            rows[:, 1] = np.random.randint(1, 97, len(rows))
+            if mode == 1: # 1e6 spikes/s, 1 us timestamp resolution: some identical timestamps
+                rows[:, 3] = np.sort(np.round(np.random.uniform(0, len(rows) * 1e-6, len(rows)), 6))
+            else: # one spike per sync window on average
+                rows[:, 3] = np.sort(np.random.uniform(0, len(rows) * server.syncWnd, len(rows)))
+            messages = np.split(rows, np.arange(packetSize, len(rows), packetSize))
+            cpu = []
+            outputs = []
+            for func in [lambda spkArr: filterSyncSpkLegacy(spkArr, mode, server.syncWnd), server.nrn_py_filterSyncSpk]:
+                for stateFunc in [filterSyncSpkLegacy, server.nrn_py_filterSyncSpk]: # reset filter state
+                    for attr in ['FRem', 'jValue']:
+                        if hasattr(stateFunc, attr):
+                            delattr(stateFunc, attr)
+                cpuStart = time.process_time()
+                outputs.append(np.concatenate([func(spkArr) for spkArr in messages]))
+                cpu.append(time.process_time() - cpuStart)
+            print('  syncSpkFilter %d, %6d spikes/message: legacy %.3f us/spike, vectorized %.3f us/spike; %d of %d spikes kept; same as legacy: %s' % (mode, packetSize, cpu[0]/len(rows)*1e6, cpu[1]/len(rows)*1e6, len(outputs[1]), len(rows), np.array_equal(outputs[0], outputs[1])))
+
+
+# queue producer: put numItems items of itemLen values every intervalUs, item[0] = send time
+def queueProducer(queue, numItems, itemLen, intervalUs):
+    item = [0.0] * itemLen
+    for i in range(numItems):
+        sendTime = time.perf_counter()
+        item[0] = sendTime
+        item[1] = i
+        queue.put(item)
+        time.sleep(max(intervalUs * 1e-6 - (time.perf_counter() - sendTime), 0))
+
+
+# returns item latencies (s) of queue between producer process and consumer (this process)
+def queueLatency(queue, numItems, itemLen, intervalUs):
+    latency = np.zeros(numItems)
+    proc = Process(target=queueProducer, args=(queue, numItems, itemLen, intervalUs))
+    proc.start()
+    for i in range(numItems):
+        item = queue.get()
+        latency[i] = time.perf_counter() - item[0]
+    proc.join()
+    return latency
+
+
+def benchmarkQueue(numItems, intervalUs):
+    itemLen = 97 # binned MUA: CH_END + 1
+    print('Queue latency, %d items of %d values every %g us:' % (numItems, itemLen, intervalUs))
+    for name, queue in [('Manager().Queue()', Manager().Queue()), ('SpscRing', SpscRing(itemLen))]:
+        latency = queueLatency(queue, numItems, itemLen, intervalUs) * 1e6
+        print('  %s: median %.1f us, 99th percentile %.1f us, max %.1f us' % (name, np.median(latency), np.percentile(latency, 99), latency.max()))
+
+
+# consumer of binned MUA items: simulates each item in simWall s and updates simulation time (ms) to the item's bin end; returns at item with bin -1
+def mockSimulation(queue, simTime, simWall):
+    while 1:
+        item = queue.get()
+        if item[-1] < 0:
+            return
+        time.sleep(simWall)
+        simTime.value = item[-1]
+
+
+def benchmarkBackpressure(numItems, binMs=10.0, lagMs=50.0):
+    print('Backpressure: %d MUA bins of %g ms, one per ms (wall), simulation 2x slower than the input, LR = %g ms:' % (numItems, binMs, lagMs))
+    for policy in ['dropOldest', 'coalesce', 'block']:
+        queue = SpscRing(97)
+        simTime = Value('d', 0.0)
+        consumer = Process(target=mockSimulation, args=(queue, simTime, 2e-3 * binMs / 10.0))
+        consumer.start()
+        mua = [0.0] * 97
+        bp = Backpressure(queue, lambda: simTime.value, policy, lagMs, lambda item: int(sum(item[:-1])), lambda a, b: [x + y for x, y in zip(a[:-1], b[:-1])] + [b[-1]])
+        start = time.time()
+        for i in range(numItems):
+            mua[:96] = np.random.poisson(1.0, 96)
+            mua[96] = (i + 1) * binMs
+            bp.put(mua, mua[96])
+            time.sleep(max(start + (i + 1) * 1e-3 - time.time(), 0))
+        wall = time.time() - start
+        bp.flush()
+        queue.put([-1.0])
+        consumer.join()
+        print('  %s (%.2f s): %s' % (policy, wall, bp.report()))
+
+
+def benchmarkInjection(numSpikes):
+    import server
+    from neuron import h
+    h.load_file('stdrun.hoc')
+    # queue items: |CH_ID|Unit_ID|Time_stamp| x SPKNUM, spike count; item k has spikes in ms k + 1 .. k + 2
+    chunks = []
+    for i in range(0, numSpikes, server.SPKNUM):
+        spk = np.zeros((server.SPKNUM, 3))
+        spk[:, 0] = np.random.randint(1, server.CH_END + 1, server.SPKNUM)
+        spk[:, 2] = (np.sort(np.random.uniform(0, 1, server.SPKNUM)) + i // server.SPKNUM + 1) * 1e-3
+        chunks.append(spk.flatten().tolist() + [server.SPKNUM])
+    numSpikes = len(chunks) * server.SPKNUM
+    tEnd = 1e9
+
+    # PMd targets: every other channel in this worker (eg. 2 workers); NSLOCs relaying events, or VecStims (injectMode 'vector')
+    def pmd(vector):
+        inncl = h.List()
+        innclDic = {}
+        vecs = []
+        recs = []
+        tvec = h.Vector()
+        for i in range(0, server.CH_END, 2):
+            if vector:
+                cell = h.VecStim()
+                vecs.append(h.Vector())
+                cell.play(vecs[-1])
+            else:
+                cell = h.NSLOC()
+                cell.start = -1 # off: only relays the injected events
+            innclDic[i] = int(inncl.count())
+            inncl.append(h.NetCon(None, cell))
+            recs.append(h.NetCon(cell, None))
+            recs[-1].record(tvec)
+        chan2local, ncEvents = server.nrn_py_injectionTable(inncl, innclDic)
+        vecStims = [inncl.o(i).syn() for i in range(int(inncl.count()))]
+        return inncl, innclDic, chan2local, ncEvents, vecStims, vecs, recs, tvec
+
+    # the callback takes batch items at time (ms) of the first one; only the injection is timed
+    def measure(name, batch, vector, inject):
+        cells = pmd(vector)
+        tvec = cells[-1]
+        h.finitialize()
+        injectTime = 0.0
+        injected = 0
+        for k in range(0, len(chunks), batch):
+            h.continuerun(k)
+            spk = [v for qItem in chunks[k:k + batch] for v in qItem[:3 * server.SPKNUM]]
+            start = time.process_time()
+            injected += inject(cells, spk, len(spk) // 3)
+            injectTime += time.process_time() - start
+        h.continuerun(len(chunks) + 2)
+        print('  %-26s %.3f us/spike (%d injected, %d PMd spikes)' % (name, injectTime / numSpikes * 1e6, injected, tvec.size()))
+
+    def legacy(cells, spk, spkNum):
+        inncl, innclDic = cells[:2]
+        numInjected = 0
+        for i in range(spkNum):
+            timeStamp = spk[3 * i + 2] * 1000
+            if h.t <= timeStamp and timeStamp <= tEnd:
+                localIndex = server.checkLocalIndexbyKey(innclDic, int(spk[3 * i] - 1))
+                if not localIndex == -1:
+                    inncl.o(localIndex).event(timeStamp, 1)
+                    numInjected += 1
+        return numInjected
+
+    def event(cells, spk, spkNum):
+        chan2local, ncEvents = cells[2:4]
+        return server.nrn_py_injectSpikes(spk, spkNum, chan2local, ncEvents, h.t, tEnd)
+
+    def vector(cells, spk, spkNum):
+        chan2local, ncEvents, vecStims, vecs = cells[2:6]
+        return server.nrn_py_appendSpikes(spk, spkNum, chan2local, vecStims, vecs, ncEvents, h.t, tEnd)
+
+    print('Spike injection, %d spikes in items of %d spikes (1 item per ms):' % (numSpikes, server.SPKNUM))
+    measure('legacy loop, 1 item', 1, False, legacy)
+    measure('event, 1 item', 1, False, event)
+    measure('event, %d items' % server.injectBatch, server.injectBatch, False, event)
+    measure('vector, 1 item', 1, True, vector)
+    measure('vector, %d items' % server.injectBatch, server.injectBatch, True, vector)
+
+
+def benchmarkLatency(numSamples):
+    print('Latency instrumentation, %d samples:' % numSamples)
+    recorder = latency.LatencyRecorder()
+    start = time.perf_counter()
+    for i in range(numSamples):
+        pass
+    loop = time.perf_counter() - start # loop overhead, not counted
+    start = time.perf_counter()
+    stageTime = latency.now()
+    for i in range(numSamples):
+        stageTime = recorder.record(latency.FILTER, stageTime)
+    print('  LatencyRecorder.record: %.3f us/sample' % ((time.perf_counter() - start - loop) / numSamples * 1e6))
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    mark = struct.pack('H', 3) # O_RCV
+    start = time.perf_counter()
+    for i in range(numSamples):
+        sock.sendto(mark, ('127.0.0.1', port))
+    print('  UDP probe (sendto): %.3f us/sample' % ((time.perf_counter() - start - loop) / numSamples * 1e6))
+    sock.close()
+    numItems = min(numSamples, 10000)
+    queue = SpscRing(97)
+    proc = Process(target=queueProducer, args=(queue, numItems, 97, 100))
+    proc.start()
+    for i in range(numItems):
+        queue.get()
+        recorder.record(latency.DEQUEUE, queue.lastStamp)
+    proc.join()
+    print(recorder.report())
+
+
+# load test client process: handshake, then send duration s of spikes at rate from startTime.value (perf_counter; 0: after the handshake);
+# puts client stats and sent timeline into results
+def loadClient(rate, duration, numChannels, numUnits, burstSize, packetMs, startTime, results):
+    import plxclient
+    client = plxclient.PlxClient(plxclient.SpikeSource(numChannels, rate, burstSize, numUnits=numUnits), packetMs)
+    client.connect('127.0.0.1')
+    if startTime.value == 0:
+        startTime.value = time.perf_counter() + 0.05
+    start = startTime.value
+    stats = client.run(duration, start)
+    client.close()
+    results.put((stats, client.sentTimeline, client.report()))
+
+
+# one load test run at rate (spikes/s); returns dict of results
+def loadRun(server, worker, rate, duration, burstSize, packetMs):
+    server.currNeuronTime.value = 0.0
+    proc = Process(target=worker, args=('data',))
+    proc.start()
+    startTime = Value('d', 0.0)
+    results = Queue()
+    client = Process(target=loadClient, args=(rate, duration, server.CH_END, server.UNIT_END + 1, burstSize, packetMs, startTime, results))
+    client.start()
+    hist = latency.LatencyHistogram()
+    delivered = 0
+    lastItemTime = 0.0 # (s)
+    while proc.is_alive() or not server.queue.empty():
+        try:
+            item = server.queue.get(timeout=0.05)
+        except Exception: # Empty
+            continue
+        now = time.perf_counter()
+        itemTime = server.queueItemTime(item) / 1000.0 # data time (s)
+        spikes = server.queueItemSpikes(item)
+        server.currNeuronTime.value = itemTime * 1000 # simulation keeps up with the data
+        if spikes > 0:
+            delivered += spikes
+            lastItemTime = max(lastItemTime, itemTime)
+            hist.add(int((now - (startTime.value + itemTime)) * 1e9))
+    stats, timeline, report = results.get()
+    client.join()
+    proc.join()
+    # spikes sent up to the data time of the last delivered item (the last bin/chunk may not be complete)
+    expected = max([n for t, n in timeline if t <= lastItemTime + packetMs / 1000.0] + [0])
+    generated = expected + stats['spikesDropped']
+    dropped = stats['spikesDropped'] + max(expected - delivered, 0)
+    return {'rate': rate, 'delivered': delivered / duration, 'dropped': dropped, 'dropFraction': dropped / max(generated, 1),
+            'latency': hist.stats(), 'maxBehind': stats['maxBehind'], 'client': report}
+
+
+def benchmarkLoad(mode, transport, startRate, duration, burstSize, packetMs, maxRate=1e7, dropThreshold=1e-3):
+    import server
+    server.isDp, server.isLwc = {'nsloc': (0, 1), 'dplwc': (1, 1), 'dphwc': (1, 0)}[mode]
+    server.isUdp = int(transport == 'udp')
+    server.latencyStats = 0 # stage histograms are printed by the worker at exit
+    worker = {'nsloc': server.nrn_py_interfaceNsloc, 'dplwc': server.nrn_py_interfaceDpLwc, 'dphwc': server.nrn_py_interfaceDpHwc}[mode]
+    print('Load test of %s over %s: %d channels, burst size %g, %g ms packets, %g s per rate:' % (mode, transport, server.CH_END, burstSize, packetMs, duration))
+    sustained = None
+    rate = startRate
+    while rate <= maxRate:
+        res = loadRun(server, worker, rate, duration, burstSize, packetMs)
+        count, mean, p50, p99, maxLat = res['latency']
+        print('  offered %9.0f spikes/s: delivered %9.0f spikes/s, dropped %d (%.3f%%); latency p50 %.2f ms, p99 %.2f ms, max %.2f ms; client max %.1f ms behind' % (
+            rate, res['delivered'], res['dropped'], res['dropFraction'] * 100, p50 * 1e-3, p99 * 1e-3, maxLat * 1e-3, res['maxBehind'] * 1e3))
+        if res['dropFraction'] > dropThreshold:
+            break
+        sustained = res
+        rate *= 2
+    if sustained is not None:
+        print('Sustained: %.0f spikes/s with latency p50 %.2f ms, p99 %.2f ms' % (sustained['delivered'], sustained['latency'][2] * 1e-3, sustained['latency'][3] * 1e-3))
+    if rate <= maxRate:
+        print('Drops begin at %.0f spikes/s offered: latency p50 %.2f ms, p99 %.2f ms' % (rate, res['latency'][2] * 1e-3, res['latency'][3] * 1e-3))
+
+
+# multi-client throughput of aioserver: numClients synthetic clients (one array each) at rate spikes/s each, served by numProcs processes
+def multiRun(server, numClients, numProcs, rate, duration, transport):
+    import aioserver
+    server.isAsync, server.isDp, server.isLwc = 1, 0, 1
+    server.isUdp = int(transport == 'udp')
+    server.numArrays = numClients
+    server.numServerProcs = numProcs
+    server.arraysInUse = Array('b', numClients)
+    server.queue = RingSet([SpscRing(server.SPKSZ + 1, server.queueCapacity) for i in range(numProcs)], server.queueItemTime)
+    server.currNeuronTime.value = 0.0
+    procs = [Process(target=aioserver.serve, args=('data', proc)) for proc in range(numProcs)]
+    for proc in procs:
+        proc.start()
+    startTime = Value('d', time.perf_counter() + 1.0) # common start after all handshakes
+    results = Queue()
+    clients = [Process(target=loadClient, args=(rate, duration, server.arrayChannels, server.UNIT_END + 1, 1, 10, startTime, results)) for i in range(numClients)]
+    for client in clients:
+        client.start()
+    hist = latency.LatencyHistogram()
+    clock = server.ArrayClock(numClients)
+    delivered = 0
+    sent = []
+    lastItem = time.perf_counter()
+    while len(sent) < numClients or time.perf_counter() - lastItem < 0.5: # until the servers are idle after the clients are done
+        if len(sent) < numClients and not results.empty():
+            sent.append(results.get()[0]['spikesSent'])
+        try:
+            item = server.queue.get(timeout=0.05)
+        except Exception: # Empty
+            continue
+        lastItem = time.perf_counter()
+        now = time.perf_counter()
+        itemTime = server.queueItemTime(item) / 1000.0 # data time (s)
+        spikes = server.queueItemSpikes(item)
+        server.currNeuronTime.value = max(server.currNeuronTime.value, clock.update(item, itemTime * 1000)) # simulation keeps up with the array behind
+        if spikes > 0:
+            delivered += spikes
+            hist.add(int((now - (startTime.value + itemTime)) * 1e9))
+    for client in clients:
+        client.join()
+    for proc in procs:
+        proc.terminate()
+        proc.join()
+    server.queue.close()
+    return sum(sent), delivered, hist.stats()
+
+
+def benchmarkMulti(numClients, rate, duration, transport):
+    import server
+    server.latencyStats = 0
+    print('aioserver: %d clients (%d channels each) at %g spikes/s each over %s, %g s:' % (numClients, server.arrayChannels, rate, transport, duration))
+    numProcs = 1
+    while numProcs <= min(numClients, os.cpu_count()):
+        sent, delivered, (count, mean, p50, p99, maxLat) = multiRun(server, numClients, numProcs, rate, duration, transport)
+        print('  %d server processes: %d spikes sent, %d delivered (%.0f spikes/s); latency p50 %.2f ms, p99 %.2f ms, max %.2f ms' % (
+            numProcs, sent, delivered, delivered / duration, p50 * 1e-3, p99 * 1e-3, maxLat * 1e-3))
+        numProcs *= 2
+
+
+# spike ingestion of the receive paths
+def benchmarkIngestion(numSpikes, spikesPerChunk):
+    print('Spike ingestion, %d spikes in chunks of %d spikes (TCP loopback):' % (numSpikes, spikesPerChunk))
+    for name, receiver in [('legacy', receiveLegacy), ('stream', receiveStream)]:
+        received, wall, cpu = benchmark(receiver, numSpikes, spikesPerChunk)
+        print('  %s: %d spikes received; %.0f spikes/s; CPU %.3f us/spike' % (name, received, received/wall, cpu/max(received, 1)*1e6))
+
+
+# command -> (benchmark, (type, default) of each argument); no command: spike ingestion
+commands = {
+    'ingestion': (benchmarkIngestion, [(int, 1000000), (int, 20)]),
+    'binning': (benchmarkBinning, [(float, 10), (float, 2)]),
+    'filtering': (benchmarkFiltering, []),
+    'queue': (benchmarkQueue, [(int, 10000), (float, 100)]),
+    'backpressure': (benchmarkBackpressure, [(int, 2000)]),
+    'inject': (benchmarkInjection, [(int, 100000)]),
+    'latency': (benchmarkLatency, [(int, 1000000)]),
+    'load': (benchmarkLoad, [(str, 'nsloc'), (str, 'tcp'), (float, 10000), (float, 5), (float, 1), (float, 10)]),
+    'multi': (benchmarkMulti, [(int, 4), (float, 100000), (float, 5), (str, 'tcp')]),
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] in commands:
+        command, args = sys.argv[1], sys.argv[2:]
+    else:
+        command, args = 'ingestion', sys.argv[1:]
+    func, params = commands[command]
+    func(*[convert(args[i]) if i < len(args) else default for i, (convert, default) in enumerate(params)])
@@ -219,6 +219,8 @@ limitmemory = False # Whether or not to limit RAM usage
 
 
 
+testParallel = 1 # evaluate test targets concurrently (one forked process per target from the trained state); only single host, sequential otherwise
+
 ## Saving and plotting parameters
 outfilestem = '' # filestem to save fitness result
 savemat = True # Whether or not to write spikes etc. to a .mat file
@@ -294,11 +296,17 @@ backgroundreceptor = NMDA # Which receptor to stimulate
 ## Virtual arm parameters
 useArm =  'dummyArm' # what type of arm to use: 'randomOutput', 'dummyArm' (simple python arm), 'musculoskeletal' (C++ full arm model)
 animArm = False # shows arm animation
+animArmFps = 25 # arm animation frame rate (renderer runs in separate process and drops frames if it falls behind)
+animArmVideo = '' # if set (eg. 'arm.mp4'), render arm animation headless and save to this video file (batch runs)
+armFeedbackDelay = 0 # arm feedback delay in loopsteps: 0 = serial (network waits for arm every loopstep); n>0 = pipelined (arm integrates step k while network integrates steps k+1..k+n using proprioceptive state from step k-n)
 graphsArm = False # shows graphs (arm trajectory etc) when finisheds
 targetid = 1 # initial target
 minRLerror = 0.002 # minimum error change for RL (m)
 armLen = [0.4634 - 0.173, 0.7169 - 0.4634] # elbow - shoulder from MSM;radioulnar - elbow from MSM;
 nMuscles = 4 # number of muscles
+armFriction = 0.5 # dummyArm joint friction coefficient
+armDamping = 1 # musculoskeletal arm: damping of muscles (.osim parameter)
+armMuscleGains = [2, 1, 1, 0.8] # musculoskeletal arm: gain factors to multiply force of sh ext, sh flex, el ext, el flex muscles (.osim parameter)
 startAng = [0.62,1.53] # starting shoulder and elbow angles (rad) = natural rest position
 targetDist = 0.15 # target distance from center (15 cm)
 # motor command encoding
@@ -340,6 +348,7 @@ if PMdinput == 'Plexon':
     emptyVec = h.Vector()
     inncl = h.List() # used to store the plexon-interfaced PMd Netcons
     innclDic = {} # dictionary to relate global and local PMd netcons
+    innvec = [] # spike time vectors of the PMd VecStims (server.injectMode 'vector'), in the order of inncl
 if PMdinput == 'targetSplit':
     trialTargets = [] # target id for each trial
     targetPMdInputs = [] # PMd units active for each trial
@@ -352,6 +361,8 @@ if PMdinput == 'spikes':
     spikesPMdFile = 'pmdData.mat'  # file with raw pmd spiking data
     patternPMd = h.PatternStim()  # Neuron object used to play back spikes
     repeatSingleTrials = [8-1, 52-1] # trial numbers for each target to repeat during training (if = -1, use all available trials)
+    streamPMd = 1 # 1: each VecStim keeps only its next PMd spikes (refilled every loopstep from the trial library, memory independent of trainTime), 0: whole training schedule in one Vector per VecStim
+    streamPMdWnd = 2*loopstep # (ms) PMd spikes kept ahead of the simulation time (> loopstep)
 PMdlesion = 0  # fraction of PMd cells silenced
 retrainTime = 10 # time to retrain after lesion
 backgroundrateRetrain = 100
@@ -0,0 +1,294 @@
+"""
+spikestore.py
+
+Binary indexed spike store (.spk) for offline PMd replay, and PMd trial library (.pmdlib) converted once from pmdData.mat
+
+Usage:
+    python spikestore.py file.tsv|file.mat [out.spk]   (convert and benchmark replay vs text parsing)
+"""
+
+import os
+import sys
+import time
+import struct
+import warnings
+import numpy as np
+
+# spike store (.spk), little endian: header, time index (int64 x numIndex + 1: first spike of each index window),
+# spikes sorted by time (RECORD)
+MAGIC = b'SPKSTOR1'
+HEADER = struct.Struct('<8sQQdd') # magic, numSpikes, numIndex, indexWnd, tStart
+RECORD = np.dtype([('ch', '<i4'), ('unit', '<i4'), ('ts', '<f8')])
+# PMd trial library (.pmdlib), little endian: header, first trial of each target (int64 x numTargets + 1),
+# CSR offsets of the spikes of each (trial, cell) (int64 x numTrials * numCells + 1), spike times (float32, ms from trial start)
+LIBMAGIC = b'PMDLIB01'
+LIBHEADER = struct.Struct('<8sQQQQ') # magic, numTargets, numTrials, numCells, numSpikes
+
+
+# write spikes (channel, unit, TS (s) arrays, any order) to a spike store with an index window of indexWnd s
+def writeStore(fileName, ch, unit, ts, indexWnd=0.01):
+    ts = np.asarray(ts, dtype=float)
+    order = np.argsort(ts, kind='stable')
+    records = np.empty(len(ts), RECORD)
+    records['ch'] = np.asarray(ch)[order]
+    records['unit'] = np.asarray(unit)[order]
+    records['ts'] = ts[order]
+    tStart = np.floor(records['ts'][0] / indexWnd) * indexWnd if len(ts) else 0.0
+    numIndex = int(np.floor((records['ts'][-1] - tStart) / indexWnd)) + 1 if len(ts) else 0
+    index = np.searchsorted(records['ts'], tStart + np.arange(numIndex + 1) * indexWnd, 'left').astype('<i8')
+    tmpName = fileName + '.tmp'
+    with open(tmpName, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(records), numIndex, indexWnd, tStart))
+        f.write(index.tobytes())
+        f.write(records.tobytes())
+    os.replace(tmpName, fileName) # readers never see a partial file
+    return fileName
+
+
+class SpikeStore:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            magic, self.numSpikes, self.numIndex, self.indexWnd, self.tStart = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError('Not a spike store: %s' % fileName)
+        self.index = np.memmap(fileName, '<i8', 'r', HEADER.size, (self.numIndex + 1,))
+        offset = HEADER.size + 8 * (self.numIndex + 1)
+        self.records = np.memmap(fileName, RECORD, 'r', offset, (self.numSpikes,)) if self.numSpikes else np.zeros(0, RECORD)
+        self.tEnd = float(self.records['ts'][-1]) if self.numSpikes else self.tStart # time of last spike (s)
+
+    def __len__(self):
+        return self.numSpikes
+
+    # position of the first spike with TS >= t (s)
+    def position(self, t):
+        k = int(np.floor((t - self.tStart) / self.indexWnd))
+        if k < 0:
+            return 0
+        if k >= self.numIndex:
+            return self.numSpikes
+        lo = int(self.index[k])
+        hi = int(self.index[k + 1])
+        return lo + int(np.searchsorted(self.records['ts'][lo:hi], t, 'left'))
+
+    # spikes with tStart <= TS < tEnd (s): view of records (fields ch, unit, ts)
+    def window(self, tStart, tEnd):
+        return self.records[self.position(tStart):self.position(tEnd)]
+
+    # iterate over the spikes in chunks of numSpikes
+    def chunks(self, numSpikes):
+        for i in range(0, self.numSpikes, numSpikes):
+            yield self.records[i:i + numSpikes]
+
+
+# numeric rows of a text file (header and malformed lines are skipped)
+def loadRows(textFile, numCols):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore') # skipped lines
+        rows = np.genfromtxt(textFile, usecols=range(numCols), invalid_raise=False, ndmin=2)
+    return rows[~np.isnan(rows).any(axis=1)] if rows.size else np.zeros((0, numCols))
+
+
+# convert a tsv spike file (|data type|ch#|unit#|TS| per line; only data type 1 = spikes) to a spike store
+def fromTsv(tsvFile, storeFile=None):
+    rows = loadRows(tsvFile, 4)
+    rows = rows[rows[:, 0] == 1]
+    return writeStore(storeFile or os.path.splitext(tsvFile)[0] + '.spk', rows[:, 1].astype(int), rows[:, 2].astype(int), rows[:, 3])
+
+
+# convert pmdData.mat to a spike store: trials (list of (target, trial), default all trials of each target) one after
+# the other every trialDur ms; channel of each recorded cell = cell index + 1 (unit 1), TS in s
+def fromPmdMat(matFile, storeFile=None, trials=None, trialDur=1000.0):
+    from scipy.io import loadmat
+    rawSpikesPMd = loadmat(matFile)['pmdData']
+    if trials is None:
+        trials = [(target, trial) for target in range(len(rawSpikesPMd)) for trial in range(len(rawSpikesPMd[target]))]
+    ch, ts = [], []
+    for k, (target, trial) in enumerate(trials):
+        cells = rawSpikesPMd[target][trial]
+        for icell in range(len(cells)):
+            spkt = np.asarray(cells[icell]['spkt'][0], dtype=float).ravel()
+            ch.append(np.full(len(spkt), icell + 1))
+            ts.append((spkt + k * trialDur) / 1000.0) # ms -> s
+    ch = np.concatenate(ch) if ch else np.zeros(0, dtype=int)
+    ts = np.concatenate(ts) if ts else np.zeros(0)
+    return writeStore(storeFile or os.path.splitext(matFile)[0] + '.spk', ch, np.ones(len(ch), dtype=int), ts)
+
+
+# write the PMd trial library of pmdData (loadmat(...)['pmdData']: trials of each target, spkt of each cell in a trial)
+def writeLibrary(libFile, rawSpikesPMd):
+    numCells = len(rawSpikesPMd[0][0])
+    trialStart = [0]
+    spkts = []
+    for target in range(len(rawSpikesPMd)):
+        trialStart.append(trialStart[-1] + len(rawSpikesPMd[target]))
+        for trial in range(len(rawSpikesPMd[target])):
+            for icell in range(numCells):
+                spkts.append(np.asarray(rawSpikesPMd[target][trial][icell]['spkt'][0], dtype='<f4').ravel())
+    offsets = np.zeros(len(spkts) + 1, dtype='<i8')
+    offsets[1:] = np.cumsum([len(spkt) for spkt in spkts])
+    times = np.concatenate(spkts) if spkts else np.zeros(0, dtype='<f4')
+    tmpName = libFile + '.tmp'
+    with open(tmpName, 'wb') as f:
+        f.write(LIBHEADER.pack(LIBMAGIC, len(rawSpikesPMd), trialStart[-1], numCells, len(times)))
+        f.write(np.asarray(trialStart, dtype='<i8').tobytes())
+        f.write(offsets.tobytes())
+        f.write(times.tobytes())
+    os.replace(tmpName, libFile) # readers never see a partial file
+    return libFile
+
+
+class PmdLibrary:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        with open(fileName, 'rb') as f:
+            magic, self.numTargets, self.numTrials, self.numCells, self.numSpikes = LIBHEADER.unpack(f.read(LIBHEADER.size))
+        if magic != LIBMAGIC:
+            raise ValueError('Not a PMd trial library: %s' % fileName)
+        offset = LIBHEADER.size
+        self.trialStart = np.memmap(fileName, '<i8', 'r', offset, (self.numTargets + 1,))
+        offset += 8 * (self.numTargets + 1)
+        self.offsets = np.memmap(fileName, '<i8', 'r', offset, (self.numTrials * self.numCells + 1,))
+        offset += 8 * (self.numTrials * self.numCells + 1)
+        self.times = np.memmap(fileName, '<f4', 'r', offset, (self.numSpikes,)) if self.numSpikes else np.zeros(0, '<f4')
+
+    # number of trials of a target
+    def trials(self, target):
+        return int(self.trialStart[target + 1] - self.trialStart[target])
+
+    # spike times (ms, float32 view) of a cell in a trial of a target
+    def spikes(self, target, trial, cell):
+        k = (self.trialStart[target] + trial) * self.numCells + cell
+        return self.times[self.offsets[k]:self.offsets[k + 1]]
+
+    # spike times of cells over consecutive trials (trial k: trial trials[k] of target targets[k], from k * trialDur ms);
+    # cells >= numCells - numLesioned have no spikes. Returns CSR offsets per cell (len(cells) + 1) and times (ms, float64)
+    def schedule(self, targets, trials, cells, trialDur=1000.0, numLesioned=0):
+        targets = np.asarray(targets, dtype=int)
+        cells = np.asarray(cells, dtype=int)
+        rows = np.asarray(self.trialStart)[targets] + np.asarray(trials, dtype=int) # trial of each step
+        k = cells[:, None] + rows[None, :] * self.numCells # (cell, step), spikes of each cell in step order
+        starts = np.asarray(self.offsets)[k].ravel()
+        lengths = np.asarray(self.offsets)[k + 1].ravel() - starts
+        if numLesioned > 0:
+            lengths[np.repeat(cells >= self.numCells - numLesioned, len(targets))] = 0
+        ends = np.cumsum(lengths)
+        pos = np.arange(ends[-1] if len(ends) else 0) + np.repeat(starts - ends + lengths, lengths) # gather index of each spike
+        shift = np.repeat(np.tile(np.arange(len(targets)) * trialDur, len(cells)), lengths)
+        times = self.times[pos].astype(float) + shift
+        cellOffsets = np.zeros(len(cells) + 1, dtype=int)
+        cellOffsets[1:] = ends.reshape(len(cells), len(targets))[:, -1] if len(targets) else 0
+        return cellOffsets, times
+
+
+# streaming schedule(): spike times of cells over consecutive trials (step k: trial trialOf[targets[k]] of target targets[k],
+# from k * trialDur ms) handed out in time order with a cursor per cell; memory does not depend on the number of trials
+class PmdStream:
+    def __init__(self, library, targets, trialOf, cells, trialDur=1000.0, numLesioned=0):
+        self.library = library
+        self.targets = targets # target of each step (not copied)
+        self.trialOf = trialOf # trial played for each target
+        self.cells = list(cells)
+        self.trialDur = trialDur
+        self.silent = [numLesioned > 0 and cell >= library.numCells - numLesioned for cell in self.cells] # lesioned cells
+        self.step = [0] * len(self.cells) # trial step of the next spike of each cell
+        self.pos = [0] * len(self.cells) # position of the next spike in its trial
+        self.last = [-np.inf] * len(self.cells) # last spike handed out (ms)
+
+    # spike times (ms) of the i-th cell up to tUntil and the first one after it, from its cursor (advanced past them);
+    # nothing while the last spike handed out is after tUntil
+    def take(self, i, tUntil):
+        if self.last[i] > tUntil:
+            return np.zeros(0)
+        k, p = self.step[i], self.pos[i]
+        out = []
+        while k < len(self.targets) and not self.silent[i]:
+            target = self.targets[k]
+            times = self.library.spikes(target, self.trialOf[target], self.cells[i])[p:].astype(float) + k * self.trialDur
+            n = int(np.searchsorted(times, tUntil, 'right'))
+            if n < len(times): # first spike after tUntil: played before the next take
+                out.append(times[:n + 1])
+                p += n + 1
+                break
+            out.append(times)
+            k += 1
+            p = 0
+        self.step[i], self.pos[i] = k, p
+        out = np.concatenate(out) if out else np.zeros(0)
+        if len(out):
+            self.last[i] = out[-1]
+        return out
+
+
+# trial library file cached next to a mat file
+def libraryFile(matFile):
+    return os.path.splitext(matFile)[0] + '.pmdlib'
+
+
+# convert pmdData.mat to its trial library when missing or older than the mat file; returns the library file
+def updateLibrary(matFile):
+    libFile = libraryFile(matFile)
+    if isOutdated(libFile, matFile):
+        from scipy.io import loadmat
+        writeLibrary(libFile, loadmat(matFile)['pmdData'])
+    return libFile
+
+
+def isOutdated(fileName, sourceFile):
+    return not os.path.exists(fileName) or (os.path.exists(sourceFile) and os.path.getmtime(fileName) < os.path.getmtime(sourceFile))
+
+
+# open the spike store of a .spk, .tsv or .mat file (converted to .spk next to it when missing or older than the source)
+def openStore(fileName):
+    base, ext = os.path.splitext(fileName)
+    if ext != '.spk':
+        storeFile = base + '.spk'
+        if isOutdated(storeFile, fileName):
+            (fromPmdMat if ext == '.mat' else fromTsv)(fileName, storeFile)
+        fileName = storeFile
+    return SpikeStore(fileName)
+
+
+# binned MUA of a tsv file (|bin end (ms)|MUA ch1|...|MUA chN| per line) as a memory-mapped array, cached as .npy next to it
+def loadMua(tsvFile, numChannels=96):
+    npyFile = os.path.splitext(tsvFile)[0] + '.npy'
+    if isOutdated(npyFile, tsvFile):
+        np.save(npyFile, loadRows(tsvFile, numChannels + 1))
+    return np.load(npyFile, mmap_mode='r')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    source = sys.argv[1]
+    start = time.time()
+    if source.endswith('.mat'):
+        storeFile = fromPmdMat(source, sys.argv[2] if len(sys.argv) > 2 else None)
+    elif source.endswith('.spk'):
+        storeFile = source
+    else:
+        storeFile = fromTsv(source, sys.argv[2] if len(sys.argv) > 2 else None)
+    print('Converted %s to %s in %.3f s' % (source, storeFile, time.time() - start))
+    store = SpikeStore(storeFile)
+    print('%d spikes, %.3f-%.3f s, index of %d windows of %g ms' % (len(store), store.tStart, store.tEnd, store.numIndex, store.indexWnd * 1e3))
+    # replay in 1 ms windows (as the NEURON callback) vs parsing the text file line by line
+    start = time.time()
+    numSpikes = 0
+    t = store.tStart
+    while t <= store.tEnd:
+        numSpikes += len(store.window(t, t + 1e-3))
+        t += 1e-3
+    wall = time.time() - start
+    print('Replay in 1 ms windows: %d spikes in %.3f s (%.0f spikes/s, %.0fx real time)' % (numSpikes, wall, numSpikes / max(wall, 1e-9), (store.tEnd - store.tStart) / max(wall, 1e-9)))
+    if source.endswith('.tsv'):
+        start = time.time()
+        numSpikes = 0
+        with open(source) as f:
+            for line in f:
+                fields = line.split()
+                if fields and fields[0] == '1':
+                    numSpikes += 1
+                    float(fields[3])
+        wall = time.time() - start
+        print('Text parsing: %d spikes in %.3f s (%.0f spikes/s)' % (numSpikes, wall, numSpikes / max(wall, 1e-9)))
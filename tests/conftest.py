@@ -0,0 +1,5 @@
+# modules are at the top level of the repo (run from the repo: python -m pytest tests)
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+# vectorized forward/inverse kinematics of the 2-joint arm
+from math import cos, sin, hypot
+
+import numpy as np
+
+from armKinematics import forwardKinematics, angles2pos, pos2angles, handError, trajError, meanTrajError
+
+armLen = [0.4634 - 0.173, 0.7169 - 0.4634] # as shared.py
+
+
+# hand position of one sample, as the per-sample code of arm.py
+def handPos(ang):
+    elbow = [armLen[0] * cos(ang[0]), armLen[0] * sin(ang[0])]
+    return [elbow[0] + armLen[1] * cos(ang[0] + ang[1]), elbow[1] + armLen[1] * sin(ang[0] + ang[1])]
+
+
+def test_forward_matches_per_sample():
+    rng = np.random.RandomState(0)
+    ang = np.column_stack((rng.uniform(-0.5, 2.3, 200), rng.uniform(0.05, 2.5, 200)))
+    elbowPos, hand = forwardKinematics(ang, armLen)
+    assert hand.shape == (200, 2)
+    assert np.allclose(np.hypot(elbowPos[:, 0], elbowPos[:, 1]), armLen[0])
+    assert np.allclose(hand, [handPos(a) for a in ang])
+    assert np.allclose(angles2pos(ang[3], armLen), handPos(ang[3])) # single sample
+
+
+def test_round_trips():
+    rng = np.random.RandomState(1)
+    ang = np.column_stack((rng.uniform(-0.5, 2.3, 200), rng.uniform(0.05, 2.5, 200))) # elbow-down (elbow angle > 0)
+    assert np.allclose(pos2angles(angles2pos(ang, armLen), armLen), ang)
+    pos = angles2pos(ang, armLen)
+    assert np.allclose(angles2pos(pos2angles(pos, armLen), armLen), pos)
+    assert np.allclose(pos2angles(pos[7], armLen), ang[7]) # single sample
+    startAng = [0.62, 1.53] # shared.py
+    assert np.allclose(pos2angles(angles2pos(startAng, armLen), armLen), startAng)
+
+
+def test_errors():
+    ang = np.array([[0.62, 1.53], [0.3, 1.0], [1.0, 0.5]])
+    target = [0.1, 0.3]
+    expected = [hypot(p[0] - target[0], p[1] - target[1]) for p in map(handPos, ang)]
+    assert np.allclose(trajError(ang, target, armLen), expected)
+    assert np.isclose(meanTrajError(ang, target, armLen), np.mean(expected))
+    assert np.isclose(handError(handPos(ang[0]), target), expected[0])
@@ -0,0 +1,59 @@
+# columnar reader of the .pnt files written by the musculoskeletal arm
+import os
+
+import numpy as np
+
+from armPnt import parsePnt, readPnt, readMuscleStatus
+
+numMuscles = 3
+
+
+# muscle status .pnt: time, then excitation, activation, force of each muscle; last line cut (run stopped)
+def writePnt(fileName, numRows=20):
+    data = np.zeros((numRows, 1 + 3 * numMuscles))
+    data[:, 0] = np.arange(numRows) * 0.01
+    for m in range(numMuscles):
+        data[:, 1 + 3 * m] = m + 0.1 # excitation
+        data[:, 2 + 3 * m] = m + 0.2 # activation
+        data[:, 3 + 3 * m] = (m + 1) * 100 + np.arange(numRows) # force
+    with open(fileName, 'w') as f:
+        for row in data:
+            f.write('  '.join('%.8f' % v for v in row) + '\n')
+        f.write('0.2 1.1 1.2')
+    return data
+
+
+def test_parse(tmp_path):
+    fileName = str(tmp_path / 'muscles.pnt')
+    data = writePnt(fileName)
+    assert np.allclose(parsePnt(fileName), data) # incomplete last line dropped
+    open(fileName, 'w').close()
+    assert parsePnt(fileName).shape == (0, 0)
+
+
+def test_time_range_and_columns(tmp_path):
+    fileName = str(tmp_path / 'muscles.pnt')
+    data = writePnt(fileName)
+    rows = readPnt(fileName, timeRange=[0.025, 0.05], columns=[0, 3])
+    assert np.allclose(rows, data[3:6][:, [0, 3]])
+    assert len(readPnt(fileName, timeRange=[1, 2])) == 0
+
+
+def test_cache(tmp_path):
+    fileName = str(tmp_path / 'muscles.pnt')
+    data = writePnt(fileName)
+    assert np.allclose(readPnt(fileName, cache=True), data)
+    assert os.path.exists(fileName + '.npy')
+    assert np.allclose(readPnt(fileName, timeRange=[0, 0.1], cache=True), data[:11]) # from the memory-mapped .npy
+
+
+def test_muscle_status(tmp_path):
+    fileName = str(tmp_path / 'muscles.pnt')
+    data = writePnt(fileName)
+    exc, act, force = readMuscleStatus(fileName, muscles=[2, 0], lastSamples=5)
+    assert exc.shape == (2, 5)
+    assert np.allclose(exc[:, 0], [2.1, 0.1])
+    assert np.allclose(act[:, 0], [2.2, 0.2])
+    assert np.allclose(force, data[-5:][:, [9, 3]].T)
+    exc, act, force = readMuscleStatus(fileName)
+    assert exc.shape == (numMuscles, len(data))
@@ -0,0 +1,108 @@
+# arm-only replay of saved motor commands (dummyArm; no loadmat needed)
+from math import hypot, radians
+
+import numpy as np
+
+from armReplay import normalizeMotorCmd, trialSchedule, feedbackAngles, replayDummyArm, sweep, targetOffsets
+import armKinematics
+
+[SH_EXT, SH_FLEX, EL_EXT, EL_FLEX] = [0, 1, 2, 3]
+
+
+# run as loaded by armReplay.loadRun: 2 trials of testTime ms, motor commands from initArmMovement
+def dummyRun(feedbackDelay=0):
+    rng = np.random.RandomState(0)
+    numSteps = 120
+    motorCmdRaw = rng.randint(0, 60, (numSteps, 4)).astype(float)
+    motorCmdRaw[:5] = 0 # before initArmMovement
+    return {'useArm': 'dummyArm', 'loopstep': 10, 'testTime': 600, 'trialReset': 1, 'startAng': [0.62, 1.53],
+            'armLen': [0.4634 - 0.173, 0.7169 - 0.4634], 'minPval': radians(-30), 'maxPval': radians(135),
+            'cmdmaxrate': 40.0, 'antagInh': 1, 'armFriction': 0.4, 'armFeedbackDelay': feedbackDelay,
+            'motorCmdRaw': motorCmdRaw, 'targetid': np.array([0] * 60 + [1] * 60)}
+
+
+# motor command of one step, as Arm.run
+def armMotorCmd(raw, cmdmaxrate, antagInh):
+    cmd = [x / cmdmaxrate for x in raw]
+    if antagInh:
+        for ext, flex in [(SH_EXT, SH_FLEX), (EL_EXT, EL_FLEX)]:
+            if cmd[ext] > cmd[flex]:
+                cmd[flex] = cmd[flex]**2 / cmd[ext] / antagInh
+            elif cmd[ext] < cmd[flex]:
+                cmd[ext] = cmd[ext]**2 / cmd[flex] / antagInh
+    return cmd
+
+
+# angles of the dummyArm one step at a time, as Arm.runDummyArm/resetArm (serial coupling)
+def armAngles(run, cmdmaxrate, antagInh, friction):
+    t, reset, targetPos = trialSchedule(run)
+    ang, vel = list(run['startAng']), [0.0, 0.0]
+    angAll = []
+    for k, raw in enumerate(run['motorCmdRaw']):
+        if reset[k]:
+            ang, vel = list(run['startAng']), [0.0, 0.0]
+        cmd = armMotorCmd(raw, cmdmaxrate, antagInh)
+        newAng = [min(max(ang[j] + vel[j] * run['loopstep'] / 1000.0, run['minPval']), run['maxPval']) for j in range(2)]
+        vel = [vel[0] + (cmd[SH_FLEX] - cmd[SH_EXT]) - friction * vel[0], vel[1] + (cmd[EL_FLEX] - cmd[EL_EXT]) - friction * vel[1]]
+        ang = newAng
+        angAll.append(ang)
+    return np.array(angAll)
+
+
+def test_normalize_matches_arm():
+    raw = np.array([[10, 30, 0, 0], [30, 10, 5, 5], [0, 20, 40, 10], [0, 0, 0, 0]], dtype=float)
+    for antagInh in [0, 1, 2]:
+        cmd = normalizeMotorCmd(raw, 20.0, antagInh)
+        assert np.allclose(cmd, [armMotorCmd(r, 20.0, antagInh) for r in raw])
+
+
+def test_trial_schedule():
+    run = dummyRun()
+    t, reset, targetPos = trialSchedule(run)
+    assert list(np.flatnonzero(reset)) == [60] # first step after testTime ms
+    startPos = armKinematics.angles2pos(run['startAng'], run['armLen'])
+    assert np.allclose(targetPos[0], startPos + targetOffsets[0])
+    assert np.allclose(targetPos[-1], startPos + targetOffsets[1])
+
+
+def test_replay_matches_arm():
+    run = dummyRun()
+    error, angAll = replayDummyArm(run)
+    assert angAll.shape == (120, 1, 2)
+    assert np.allclose(angAll[:, 0], armAngles(run, 40.0, 1, 0.4))
+    assert np.allclose(angAll[60, 0], run['startAng']) # reset at the start of the second trial
+    # error stored at the start of each step (0 before the first step), as Arm.errorAll
+    t, reset, targetPos = trialSchedule(run)
+    handPos = armKinematics.angles2pos(angAll[:, 0], run['armLen'])
+    stepError = [0.0] + [hypot(handPos[k][0] - targetPos[k][0], handPos[k][1] - targetPos[k][1]) for k in range(119)]
+    assert np.isclose(error[0], np.mean(stepError))
+
+
+def test_parameter_sets_at_once():
+    run = dummyRun()
+    cmdmaxrate = [20.0, 40.0, 80.0]
+    friction = [0.2, 0.4, 0.6]
+    errors, angAll = replayDummyArm(run, cmdmaxrate=cmdmaxrate, antagInh=0, armFriction=friction)
+    assert angAll.shape == (120, 3, 2)
+    for p in range(3):
+        error, ang = replayDummyArm(run, cmdmaxrate=cmdmaxrate[p], antagInh=0, armFriction=friction[p])
+        assert np.isclose(errors[p], error[0])
+        assert np.allclose(angAll[:, p], ang[:, 0])
+        assert np.allclose(ang[:, 0], armAngles(run, cmdmaxrate[p], 0, friction[p]))
+    results = sweep(run, {'cmdmaxrate': cmdmaxrate[:2], 'antagInh': [0, 1]})
+    assert [params for params, error in results] == [{'cmdmaxrate': c, 'antagInh': a} for c in cmdmaxrate[:2] for a in [0, 1]]
+    for params, error in results:
+        assert np.isclose(error, replayDummyArm(run, **params)[0][0])
+
+
+def test_feedback_delay():
+    run = dummyRun(feedbackDelay=2)
+    error, angAll = replayDummyArm(run)
+    serial = armAngles(run, 40.0, 1, 0.4)
+    # network sees the arm 2 steps late, start angles while the pipeline fills (start and reset)
+    assert np.allclose(angAll[:2, 0], run['startAng'])
+    assert np.allclose(angAll[2:60, 0], serial[:58])
+    assert np.allclose(angAll[60:62, 0], run['startAng'])
+    assert np.allclose(angAll[62:, 0], serial[60:118])
+    seen = feedbackAngles(np.arange(6.0)[:, None], np.array([0, 0, 0, 1, 0, 0], dtype=bool), [-1], 1)
+    assert list(seen[:, 0]) == [-1, 0, 1, -1, 3, 4]
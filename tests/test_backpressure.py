@@ -0,0 +1,72 @@
+# backpressure policies on the shared-memory ring (no NEURON needed)
+import threading
+import multiprocessing
+
+from ringbuffer import SpscRing
+from backpressure import Backpressure
+
+
+def spikes(item):
+    return int(item[1])
+
+
+# consumer stalled (never gets) and ring full: dropOldest discards the oldest items instead of blocking the producer
+def test_drop_oldest_full_ring_stalled_consumer():
+    ring = SpscRing(2, capacity=8)
+    bp = Backpressure(ring, lambda: 0.0, 'dropOldest', maxLag=1e9, itemSpikes=spikes) # never lagging: only the full ring drops
+    producer = threading.Thread(target=lambda: [bp.put([i, 2], float(i)) for i in range(20)])
+    producer.start()
+    producer.join(5)
+    assert not producer.is_alive()
+    assert ring.qsize() == 8
+    assert bp.itemsPut == 20
+    assert bp.itemsDropped == 12
+    assert bp.spikesDropped == 24
+    assert [ring.get(False)[0] for i in range(8)] == list(range(12, 20))
+    assert not bp.wouldBlock(100.0)
+    ring.close()
+
+
+# simulation lagging: only the newest item is kept
+def test_drop_oldest_lagging():
+    ring = SpscRing(2, capacity=8)
+    bp = Backpressure(ring, lambda: 0.0, 'dropOldest', maxLag=10, itemSpikes=spikes)
+    for i in range(5):
+        bp.put([i, 1], 100.0 + i)
+    assert ring.qsize() == 1
+    assert bp.itemsDropped == 4
+    assert ring.get(False)[0] == 4
+    ring.close()
+
+
+def produceAndDrop(ring, numItems, conn):
+    dropped = []
+    for i in range(numItems):
+        ring.put([i, 0])
+        if i % 2: # drop while the consumer gets
+            item = ring.discardOldest()
+            if item is not None:
+                dropped.append(int(item[0]))
+    conn.send(dropped)
+    conn.close()
+
+
+# producer discards while the consumer gets (another process): each item is either got or dropped, never both
+def test_discard_races_get():
+    numItems = 20000
+    ring = SpscRing(2, capacity=16)
+    recv, send = multiprocessing.Pipe(False)
+    proc = multiprocessing.get_context('fork').Process(target=produceAndDrop, args=(ring, numItems, send))
+    proc.start()
+    got = []
+    while not recv.poll() or not ring.empty():
+        try:
+            got.append(int(ring.get(True, 0.01)[0]))
+        except Exception:
+            pass
+    dropped = recv.recv()
+    proc.join()
+    assert not set(got) & set(dropped)
+    assert sorted(got + dropped) == list(range(numItems))
+    assert got == sorted(got)
+    ring.close()
@@ -0,0 +1,62 @@
+# log-bucketed latency histograms of the server path stages
+import numpy as np
+
+import latency
+from latency import bucketIndex, bucketUpper, LatencyHistogram, LatencyRecorder, NUM_BUCKETS, LINEAR
+
+
+def test_buckets():
+    durations = sorted(list(range(200)) + [int(x) for x in np.logspace(2, 12, 2000)])
+    for ns in durations:
+        index = bucketIndex(ns)
+        assert 0 <= index < NUM_BUCKETS
+        assert ns <= bucketUpper(index) # upper bound of its bucket
+        if index > 0:
+            assert bucketUpper(index - 1) < ns # above the previous bucket
+        if ns >= LINEAR:
+            assert bucketUpper(index) - bucketUpper(index - 1) <= 0.25 * ns # < 25% bucket width
+    indices = [bucketIndex(ns) for ns in durations]
+    assert indices == sorted(indices)
+
+
+def test_percentiles():
+    hist = LatencyHistogram()
+    for ns in range(1000, 101000, 1000): # 1..100 us
+        hist.add(ns)
+    num, mean, p50, p99, maxUs = hist.stats()
+    assert num == 100
+    assert np.isclose(mean, 50.5)
+    assert 50 <= p50 <= 50 * 1.25
+    assert 99 <= p99 <= 100 # at most max
+    assert maxUs == 100
+    assert LatencyHistogram().stats() == (0, 0.0, 0.0, 0.0, 0.0)
+
+
+def test_record_same_buckets(monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(latency, 'now', lambda: clock[0])
+    recorder = LatencyRecorder()
+    hist = LatencyHistogram()
+    start = 0
+    for ns in [0, 3, 7, 8, 9, 1000, 1023, 1024, 123456, 10**9]:
+        clock[0] = start + ns
+        assert recorder.record(latency.DEQUEUE, start) == clock[0] # start of the next stage
+        hist.add(ns)
+        start = clock[0]
+    assert recorder.hists[latency.DEQUEUE].counts == hist.counts # inlined bucketIndex
+    assert recorder.hists[latency.DEQUEUE].stats() == hist.stats()
+    assert 'dequeue' in recorder.report() and 'receive' not in recorder.report()
+
+
+def test_export(tmp_path, monkeypatch):
+    clock = [0]
+    monkeypatch.setattr(latency, 'now', lambda: clock[0])
+    fileName = str(tmp_path / 'latency.tsv')
+    recorder = LatencyRecorder(fileName, interval=1.0)
+    clock[0] = 5000
+    recorder.record(latency.RECEIVE, 0)
+    clock[0] = int(1.5e9) # past the export interval
+    recorder.record(latency.FILTER, clock[0] - 2000)
+    lines = open(fileName).read().splitlines()
+    assert lines[0].startswith('time (s)\tstage')
+    assert [line.split('\t')[1:3] for line in lines[1:]] == [['receive', '1'], ['filter', '1']]
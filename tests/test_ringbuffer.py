@@ -0,0 +1,117 @@
+# shared-memory ring buffer (queue between the server processes and NEURON)
+import time
+import threading
+import multiprocessing
+from queue import Empty, Full
+
+import pytest
+
+from ringbuffer import SpscRing, RingSet
+
+
+def test_fifo_and_wraparound():
+    ring = SpscRing(4, capacity=4)
+    for i in range(25): # wraps around the 4 slots several times
+        ring.put([i, i + 0.5])
+        ring.put([i, -1, -2])
+        assert ring.qsize() == 2
+        assert ring.get(False) == [i, i + 0.5]
+        assert ring.get(False) == [i, -1, -2]
+    assert ring.empty()
+    ring.close()
+
+
+def test_full_ring():
+    ring = SpscRing(1, capacity=3)
+    for i in range(3):
+        ring.put([i])
+    with pytest.raises(Full):
+        ring.put([3], block=False)
+    start = time.time()
+    with pytest.raises(Full):
+        ring.put([3], timeout=0.05)
+    assert time.time() - start >= 0.05
+    assert ring.get(False) == [0] # frees a slot
+    ring.put([3], block=False)
+    assert [ring.get(False)[0] for i in range(3)] == [1, 2, 3]
+    ring.close()
+
+
+def test_blocking_get_timeout():
+    ring = SpscRing(1, capacity=2)
+    with pytest.raises(Empty):
+        ring.get(False)
+    start = time.time()
+    with pytest.raises(Empty):
+        ring.get(True, 0.05)
+    assert time.time() - start >= 0.05
+    timer = threading.Timer(0.05, ring.put, ([7],))
+    timer.start()
+    assert ring.get(True, 5) == [7] # waits for the item
+    timer.join()
+    ring.close()
+
+
+def test_peek_and_last_stamp():
+    ring = SpscRing(2, capacity=2)
+    assert ring.peek() is None
+    before = time.perf_counter_ns()
+    ring.put([1, 2])
+    assert ring.peek() == [1, 2]
+    assert ring.qsize() == 1
+    assert ring.get(False) == [1, 2]
+    assert before <= ring.lastStamp <= time.perf_counter_ns()
+    ring.close()
+
+
+def produce(ring, numItems):
+    for i in range(numItems):
+        ring.put([i, i * 2.0]) # waits while the ring is full
+
+
+# producer process (forked after the ring was created, as in server.py) and consumer in this process
+def test_cross_process():
+    numItems = 5000
+    ring = SpscRing(2, capacity=8)
+    proc = multiprocessing.get_context('fork').Process(target=produce, args=(ring, numItems))
+    proc.start()
+    got = [ring.get(True, 5) for i in range(numItems)]
+    proc.join(5)
+    assert got == [[i, i * 2.0] for i in range(numItems)]
+    assert ring.empty()
+    ring.close()
+
+
+# a ring attached by name sees the items of the ring that created it
+def test_attach_by_name():
+    ring = SpscRing(3, capacity=4)
+    other = SpscRing(3, capacity=4, name=ring.name, create=False, lock=ring.lock)
+    other.put([1, 2, 3])
+    assert ring.get(False) == [1, 2, 3]
+    assert other.empty()
+    other.close()
+    ring.close()
+
+
+def test_ring_set_merges_by_time():
+    rings = [SpscRing(1, capacity=8) for i in range(2)]
+    for t in [1, 4, 5]:
+        rings[0].put([t])
+    for t in [2, 3, 6]:
+        rings[1].put([t])
+    queue = RingSet(rings, lambda item: item[0])
+    assert queue.qsize() == 6
+    assert [queue.get(False)[0] for i in range(6)] == [1, 2, 3, 4, 5, 6]
+    with pytest.raises(Empty):
+        queue.get(False)
+    queue.close()
+
+
+def test_ring_set_round_robin():
+    rings = [SpscRing(1, capacity=8) for i in range(2)]
+    rings[0].put([0])
+    rings[0].put([1])
+    rings[1].put([10])
+    queue = RingSet(rings)
+    assert [queue.get(False)[0] for i in range(3)] == [0, 10, 1]
+    queue.close()
@@ -0,0 +1,80 @@
+# spike store and PMd trial library (offline PMd replay, PMd training schedule)
+import numpy as np
+
+from spikestore import writeStore, SpikeStore, writeLibrary, PmdLibrary, PmdStream
+
+
+# rawSpikesPMd as loaded from pmdData.mat: [target][trial][cell]['spkt'][0] = spike times (ms)
+def rawSpikes(numTargets, numTrials, numCells, seed=0):
+    rng = np.random.RandomState(seed)
+    return [[[{'spkt': [np.sort(rng.uniform(0, 1000, rng.randint(0, 30)))]} for cell in range(numCells)]
+             for trial in range(numTrials)] for target in range(numTargets)]
+
+
+def test_store_window_and_position(tmp_path):
+    ts = np.array([0.5, 0.001, 0.0305, 0.03, 0.2, 0.2])
+    store = SpikeStore(writeStore(str(tmp_path / 'a.spk'), np.arange(6), np.zeros(6), ts))
+    assert len(store) == 6
+    assert list(store.records['ts']) == sorted(ts)
+    assert list(store.window(0.03, 0.2)['ts']) == [0.03, 0.0305]
+    assert store.position(-1) == 0
+    assert store.position(0.2) == 3
+    assert store.position(10) == 6
+    assert [len(chunk) for chunk in store.chunks(4)] == [4, 2]
+
+
+def test_empty_store(tmp_path):
+    store = SpikeStore(writeStore(str(tmp_path / 'empty.spk'), [], [], []))
+    assert len(store) == 0
+    for t in [-1.0, 0.0, 0.005, 1e3]:
+        assert store.position(t) == 0
+    assert len(store.window(0, 1e3)) == 0
+    assert list(store.chunks(10)) == []
+
+
+def test_library_spikes(tmp_path):
+    raw = rawSpikes(2, 3, 4)
+    lib = PmdLibrary(writeLibrary(str(tmp_path / 'a.pmdlib'), raw))
+    assert (lib.numTargets, lib.numTrials, lib.numCells) == (2, 6, 4)
+    assert lib.trials(1) == 3
+    for target in range(2):
+        for trial in range(3):
+            for cell in range(4):
+                expected = np.asarray(raw[target][trial][cell]['spkt'][0], dtype='<f4')
+                assert np.array_equal(lib.spikes(target, trial, cell), expected)
+
+
+# spike times of cell cells[i] over the schedule, one take at a time (as network.streamPMdSpikes)
+def streamed(stream, i, tEnd, step):
+    out = [stream.take(i, t) for t in np.arange(step, tEnd + step, step)]
+    return np.concatenate(out)
+
+
+def test_schedule_matches_stream(tmp_path):
+    numCells = 5
+    lib = PmdLibrary(writeLibrary(str(tmp_path / 'a.pmdlib'), rawSpikes(2, 3, numCells, seed=1)))
+    targets = [0, 1, 1, 0, 1]
+    trialOf = [2, 0]
+    cells = [4, 0, 3, 1]
+    for numLesioned in [0, 2]:
+        offsets, times = lib.schedule(targets, [trialOf[target] for target in targets], cells, 1000.0, numLesioned)
+        stream = PmdStream(lib, targets, trialOf, cells, 1000.0, numLesioned)
+        for i, cell in enumerate(cells):
+            cellTimes = times[offsets[i]:offsets[i + 1]]
+            assert np.array_equal(streamed(stream, i, len(targets) * 1000.0, 7.5), cellTimes)
+            if cell >= numCells - numLesioned: # lesioned cells never spike
+                assert len(cellTimes) == 0
+            else:
+                expected = np.concatenate([lib.spikes(target, trialOf[target], cell).astype(float) + k * 1000.0 for k, target in enumerate(targets)])
+                assert np.array_equal(cellTimes, expected)
+
+
+def test_stream_holds_spike_after_window(tmp_path):
+    raw = [[[{'spkt': [np.array([10.0, 20.0, 30.0])]}]]]
+    lib = PmdLibrary(writeLibrary(str(tmp_path / 'a.pmdlib'), raw))
+    stream = PmdStream(lib, [0, 0], [0], [0])
+    assert list(stream.take(0, 15)) == [10.0, 20.0] # first spike after the window is handed out with it
+    assert list(stream.take(0, 18)) == [] # nothing while the last spike is ahead
+    assert list(stream.take(0, 1015)) == [30.0, 1010.0, 1020.0]
+    assert list(stream.take(0, 5000)) == [1030.0]
+    assert list(stream.take(0, 6000)) == []
@@ -20,7 +20,19 @@ INITIAL {
 	}
 }
 
+: external events (server.py, injectMode 'vector'): flag 0 restarts a VecStim that
+: played all its times, after more were added to its vector; flag 2 is a spike relayed at once
 NET_RECEIVE (w) {
+	if (flag == 2) {
+		net_event(t)
+	}
+	if (flag == 0 && index < 0) {
+		index = 0
+		element()
+		if (index > 0) {
+			net_send(etime - t, 1)
+		}
+	}
 	if (flag == 1) {
 		net_event(t)
 		element()